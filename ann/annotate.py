@@ -10,35 +10,62 @@
 ##
 __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 
+import re
+import checkpoint as ckpt
+import dedup as dd
 import file_utils as fu
+import perf
 import utils as u
+import variant as v
 
 indicesKnownGenes=[12, 1, 3] #12 for gene
 
-def collapseGeneNames(row, indices, region, cnt):
-    names = ['bin', 'name', 'chrom', 'transcriptStrand', 'txStart', 'txEnd', 
-        'cdsStart', 'cdsEnd', 'exonCount', 'exonStarts', 'exonEnds', 'score',
-        'name2', 'cdsStartStat', 'cdsEndStat', 'exonFrames']
-    collapsed=[]
+# refGene columns
+geneColumns = ['bin', 'name', 'chrom', 'transcriptStrand', 'txStart', 'txEnd',
+    'cdsStart', 'cdsEnd', 'exonCount', 'exonStarts', 'exonEnds', 'score',
+    'name2', 'cdsStartStat', 'cdsEndStat', 'exonFrames']
+
+# bigRefGene columns, after the id
+refSeqColumns = ['chr', 'start', 'end', 'haplotypeReference',
+    'haplotypeAlternate', 'name', 'name2', 'transcriptStrand',
+    'positionType', 'frame', 'mrnaCoord', 'codonCoord', 'spliceDist',
+    'referenceCodon', 'referenceAA', 'variantCodon', 'variantAA',
+    'changesAA', 'functionalClass','codingCoordStr','proteinCoordStr',
+    'inCodingRegion', 'spliceInfo','uorfChange']
+
+
+"""INFO items of the refGene columns listed in indices
+"""
+def geneNameItems(row, indices):
+    items = []
     for i in indices:
-        mn = names[i]
         r = str(row[i])
         if(len(r) > 0 ):
-            collapsed.append(mn + '=' + r.strip())
+            items.append((geneColumns[i], r.strip()))
+    return items
+
+
+def collapseGeneNames(row, indices, region, cnt):
+    collapsed = [k + '=' + r for k, r in geneNameItems(row, indices)]
     collapsed.append(region)
 
     return  ';'.join(collapsed)
 
 
+"""INFO items of a bigRefGene row (id first); empty and 0 columns are skipped
+"""
+def refSeqItems(row):
+    items = []
+    for i in range(6, len(row)):
+        f = str(row[i])
+        if(len(f) > 0 and f !='0'):
+            items.append((refSeqColumns[i - 1], f.strip()))
+    return items
+
+
 """"Collapces bigRefSegTable
 """
 def collapseRefSeq(line):
-    names = ['chr', 'start', 'end', 'haplotypeReference', 
-        'haplotypeAlternate', 'name', 'name2', 'transcriptStrand', 
-        'positionType', 'frame', 'mrnaCoord', 'codonCoord', 'spliceDist',
-        'referenceCodon', 'referenceAA', 'variantCodon', 'variantAA',
-        'changesAA', 'functionalClass','codingCoordStr','proteinCoordStr',
-        'inCodingRegion', 'spliceInfo','uorfChange']
     fields = line.strip().split('\t')
     fcount = 0
     collapsed = []
@@ -46,7 +73,7 @@ def collapseRefSeq(line):
     for f in fields:
         if (fcount > 4):
             if(len(str(f)) > 0 and str(f) !='0'):
-                collapsed.append(str(names[fcount]).strip() + '=' + str(f).strip())
+                collapsed.append(str(refSeqColumns[fcount]).strip() + '=' + str(f).strip())
         fcount = fcount + 1
 
     return  ';'.join(collapsed)
@@ -107,206 +134,940 @@ def getComplementary(nuc):
         return compNuc
 
 
-""""Format must be pileup or vcf
-    Types of variants in dbSNP135: DIV, SNV, MNV, MIXED
-""" 
-def getSnpsFromDbSnp(vcf, format='vcf', tmpextin='', tmpextout='.1',
-    varclass='SNV', sep='\t'):
-    
-    outfile = vcf + tmpextout
-    fh_out = open(outfile, "w")
-    logcountfile = vcf + '.count.log'
-    fh_log = open(logcountfile, 'w')
-    var_count = 0
+"""Base class of the annotation stages
 
-    inds = getFormatSpecificIndices(format=format)
+   A stage annotates one VariantRecord at a time: query() builds the SQL
+   for the record (None to skip it) and apply() adds the INFO items for
+   the rows found. Stages that need more than one query override
+   annotate(). Counts are kept in self.counts so that the counts of
+   several runs of the same stage can be merged. infoKeys() lists the INFO
+   keys the stage writes, used to strip them when re-annotating.
 
-    fh = open(vcf)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
+   annotate() is fetch(), which only reads the database, then found(),
+   which annotates the record with the rows fetched; an engine may fetch
+   the rows some other way (see bulk.py, pool.py). Interval stages also
+   give joinQueries(): the same lookup for a whole chunk, as a join with a
+   table of sites.
+"""
+class Stage(object):
+    counters = ['variants', 'hits']
+
+    # Columns the rows of a record are sorted by, for stages that keep only
+    # the first row; without an ORDER BY MySQL may return them in any order
+    order = None
+
+    def __init__(self, name=None, table=None):
+        self.name = name or table
+        self.table = table
+        self.counts = dict.fromkeys(self.counters, 0)
+
+    def query(self, rec):
+        return None
+
+    def apply(self, rec, rows):
+        pass
+
+    """Annotates rec with the rows of its lookup
+    """
+    def found(self, cursor, rec, rows):
+        self.apply(rec, rows)
+
+    """Rows of the lookup of rec, or None if there is nothing to look up
+       Only reads the database, so records can be fetched concurrently.
+    """
+    def fetch(self, cursor, rec):
+        sql = self.query(rec)
+        if sql is None:
+            return None
+        cursor.execute(sql)
+        return cursor.fetchall()
+
+    def annotate(self, cursor, rec):
+        rows = self.fetch(cursor, rec)
+        if rows is not None:
+            self.found(cursor, rec, rows)
+
+    """Queries joining the sites table (idx, chrom, bare, pos) with the
+       reference rows of each site, selecting idx and then the columns of
+       query(); join is the join keyword that keeps the sites table as the
+       outer loop. None if the stage cannot be joined.
+    """
+    def joinQueries(self, sites, join):
+        return None
+
+    def merge(self, counts):
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def infoKeys(self):
+        return [self.table]
+
+    """True if the INFO item (key, value) was written by this stage
+    """
+    def owns(self, key, value):
+        return key in self.infoKeys()
+
+    """Lines this stage adds to <vcf>.count.log
+    """
+    def log_lines(self):
+        return [f"In {str(self.table)}: {str(self.counts['hits'])} in " +
+            f"{str(self.counts['variants'])} variants"]
+
+    def write_log(self, fh_log):
+        for line in self.log_lines():
+            fh_log.write(line + '\n')
+
+
+"""A stage that filters records instead of annotating them
+   select() splits the active records into kept and filtered ones. The
+   later stages only see the kept records; filtered records are dropped
+   from the output, or with passthrough written as they stood when they
+   were filtered.
+"""
+class FilterStage(Stage):
+    counters = ['kept', 'filtered']
+
+    def __init__(self, name=None, passthrough=False):
+        Stage.__init__(self, name)
+        self.passthrough = passthrough
+
+    def keep(self, rec):
+        return True
+
+    def select(self, records):
+        kept = []
+        filtered = []
+        for rec in records:
+            if self.keep(rec):
+                kept.append(rec)
+            else:
+                filtered.append(rec)
+        self.counts['kept'] += len(kept)
+        self.counts['filtered'] += len(filtered)
+        return kept, filtered
 
-    for line in fh:
-        line = line.strip()
-        if not line.startswith("#"):
-            fields = line.split(sep)
-            chr = fields[inds[0]].strip()
-            if chr.startswith("chr"):
-                chr = chr.replace('chr', '')
+    def infoKeys(self):
+        return []
 
-            pos = fields[inds[1]].strip()
-            ref = clean_mysql_chars(fields[inds[2]]).strip()
-            alt = clean_mysql_chars(fields[inds[3]]).strip()
+    def log_lines(self):
+        return [f"Filter {self.name}: {str(self.counts['kept'])} kept, " +
+            f"{str(self.counts['filtered'])} filtered"]
 
-            compRef = getComplementary(ref)
-            compAlt = getComplementary(alt)
 
-            sql = 'select * from dbSNP where CHR="' + str(chr) + \
-                '" AND POS=' + str(pos) + ' AND ( REF="' + str(ref) + \
-                '" OR REF ="' + str(compRef) + '" )  AND INFO = "' + \
-                varclass + '" ;'
-            cursor.execute(sql)
-            rows = cursor.fetchall()
+"""Keeps the records inside the job's regions (a regions.RegionSet)
+   Runs before the annotation stages, so records outside the regions cost
+   no database lookups.
+"""
+class RegionStage(FilterStage):
+    def __init__(self, name='regions', regions=None, passthrough=False):
+        FilterStage.__init__(self, name, passthrough)
+        self.regions = regions
+
+    def keep(self, rec):
+        return self.regions.contains(rec.bare_chrom(), rec.pos)
 
-            fields[2] = '.'
-            rsids = []
-            mafs = []
-            if (len(rows) > 0):
-                for row in rows:
-                    rsids.append(str(row[3]))
-                    if (str(row[7]) != '.'):
-                        mafs.append('GMAF=' + str(row[7]))
 
-                maf_str=''
-                if (len(mafs) > 0):
-                    maf_str = ';' + ';'.join([str(x) for x in mafs])
+"""Keeps the records passing a filter expression (a filters.Predicate)
+   Placed right after the last stage writing the key, so the stages after
+   it skip the filtered records.
+"""
+class PredicateStage(FilterStage):
+    def __init__(self, predicate, passthrough=False):
+        FilterStage.__init__(self, predicate.text, passthrough)
+        self.predicate = predicate
 
-                var_count = var_count + 1
-                if (str(fields[7]) == '.'):
-                    fields[7] = 'DB' + maf_str
-                else:
-                    fields[7] = fields[7] + ';DB;VC=' + varclass + maf_str
+    def keep(self, rec):
+        return self.predicate.keep(rec.info)
 
-                fields[2] = str(';'.join(rsids))
-                l = '\t'.join([str(x) for x in fields])
-                fh_out.write(l + '\n')
 
-            else:
-                ## reset rsid to "." - in case there was annotation from old release of dbSNP
-                fh_out.write('\t'.join([str(x) for x in fields]) + '\n')
+"""Interval overlap query used by most of the UCSC tables
+"""
+def overlapQuery(table, chrom, pos, chrom_column='chrom',
+    start='chromStart', end='chromEnd', order=None):
+    return 'select * from ' + table + ' where ' + chrom_column + '="' + \
+        chrom + '" AND (' + start + ' <= ' + str(pos) + ' AND ' + \
+        str(pos) + ' <= ' + end + ')' + orderBy(order) + ';'
+
+
+"""overlapQuery() for every site of a sites table
+   site_chrom is the column of the sites table matching chrom_column:
+   "chrom" (with the "chr" prefix) or "bare".
+"""
+def overlapJoin(table, sites, join, chrom_column='chrom', start='chromStart',
+    end='chromEnd', site_chrom='chrom', order=None):
+    return 'select s.idx, t.* from ' + sites + ' s ' + join + ' ' + table + \
+        ' t on t.' + chrom_column + ' = s.' + site_chrom + ' AND (t.' + \
+        start + ' <= s.pos AND s.pos <= t.' + end + ')' + \
+        orderBy(order and ['s.idx'] + ['t.' + column for column in order]) + \
+        ';'
+
+
+"""ORDER BY clause of a list of columns ('' for None)
+"""
+def orderBy(order):
+    if not order:
+        return ''
+    return ' order by ' + ', '.join(order)
 
-            linenum = linenum + 1
 
+""""Types of variants in dbSNP135: DIV, SNV, MNV, MIXED
+"""
+class DbSnpStage(Stage):
+    def __init__(self, name='dbSNP', table='dbSNP', varclass='SNV'):
+        Stage.__init__(self, name, table)
+        self.varclass = varclass
+
+    def query(self, rec):
+        ref = clean_mysql_chars(rec.ref).strip()
+        return 'select * from ' + self.table + ' where CHR="' + \
+            rec.bare_chrom() + '" AND POS=' + str(rec.pos) + \
+            ' AND ( REF="' + ref + '" OR REF ="' + getComplementary(ref) + \
+            '" )  AND INFO = "' + self.varclass + '" ;'
+
+    def apply(self, rec, rows):
+        self.counts['variants'] += 1
+        ## reset rsid to "." - in case there was annotation from old release of dbSNP
+        rec.id = '.'
+        if (len(rows) == 0):
+            return
+
+        self.counts['hits'] += 1
+        if (len(rec.info) == 0):
+            rec.add('DB')
         else:
-            fh_out.write(line + '\n')
+            rec.extend([('DB', None), ('VC', self.varclass)])
+        rec.extend([('GMAF', str(row[7])) for row in rows if str(row[7]) != '.'])
+        rec.id = ';'.join([str(row[3]) for row in rows])
 
-    ratioInDbSnp = (var_count / float(linenum)) * 100
-    fh_log.write("## Please notice that all Isoforms were counted\n")
-    fh_log.write("## Numbers may exceed number of variants in the annotated file\n")
-    fh_log.write(f"Total: {str(linenum)}\n")
-    fh_log.write(f"In dbSNP: {str(var_count)} ({str(ratioInDbSnp)}%)\n")
-    fh_log.close()
+    def infoKeys(self):
+        return ['DB', 'VC', 'GMAF']
 
-    conn.close()
-    fh.close()
-    fh_out.close()
+    def log_lines(self):
+        # Total has always been the number of variants + 1
+        total = self.counts['variants'] + 1
+        ratio = (self.counts['hits'] / float(total)) * 100
+        return ["## Please notice that all Isoforms were counted",
+            "## Numbers may exceed number of variants in the annotated file",
+            f"Total: {str(total)}",
+            f"In dbSNP: {str(self.counts['hits'])} ({str(ratio)}%)"]
 
 
 """NOTE: all isoforms are collapsed in one record
     1. chrom_pos_equal_base
     2. chrom_pos_equal_nobase
     3. chrom_pos_unequal
+   The first table with rows for the variant wins
 """
-def getBigRefGene(vcf, format='vcf', tmpextin='.1', tmpextout='.2', sep='\t'):
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-    fh_out = open(outfile, "w")
-    inds = getFormatSpecificIndices(format=format)
-    fh = open(vcf)
+class BigRefGeneStage(Stage):
+    def __init__(self, name='BigRefGene', table=None):
+        Stage.__init__(self, name, table)
+
+    def queries(self, rec):
+        chrom = rec.bare_chrom()
+        pos = str(rec.pos)
+        ref = clean_mysql_chars(rec.ref).strip()
+        alt = clean_mysql_chars(rec.alt).strip()
+
+        return ['select * from chrom_pos_equal_base where CHR="' + chrom +
+            '" AND start = ' + pos + ' AND ((haplotypeReference="' + ref +
+            '" AND haplotypeAlternate ="' + alt +
+            '") OR (haplotypeReference="' + getComplementary(ref) +
+            '" AND haplotypeAlternate ="' + getComplementary(alt) + '"));',
+            'select * from chrom_pos_equal_nobase where CHR="' + chrom +
+            '" AND start = ' + pos + ';',
+            'select * from chrom_pos_unequal where CHR="' + chrom +
+            '" AND start <= ' + pos + ' AND ' + pos + ' <= end ;']
+
+    """Rows of the first table with rows for rec, or no rows
+    """
+    def fetch(self, cursor, rec):
+        for sql in self.queries(rec):
+            cursor.execute(sql)
+            rows = cursor.fetchall()
+            if (len(rows) > 0):
+                return rows
+        return []
 
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    vcf_linenum = 1
+    def found(self, cursor, rec, rows):
+        if (len(rows) > 0):
+            self.apply(rec, rows)
 
-    for line in fh:
-        line = line.strip()
-        if not line.startswith("#"):
-            fields = line.split(sep)
-            chr = fields[inds[0]].strip()
-            if chr.startswith("chr"):
-                chr = chr.replace('chr', '')
+    def apply(self, rec, rows):
+        self.counts['variants'] += 1
+        self.counts['hits'] += len(rows)
+        collapsed = dict.fromkeys([tuple(refSeqItems(row)) for row in rows])
+        for items in collapsed:
+            rec.extend(items)
 
-            pos = fields[inds[1]].strip()
-            ref = clean_mysql_chars(fields[inds[2]]).strip()
-            alt = clean_mysql_chars(fields[inds[3]]).strip()
+    def infoKeys(self):
+        return refSeqColumns[5:]
 
-            compRef = getComplementary(ref)
-            compAlt = getComplementary(alt)
+    def log_lines(self):
+        return []
 
-            sql1 = 'select * from chrom_pos_equal_base where CHR="' + \
-                str(chr) + '" AND start = ' + str(pos) + \
-                ' AND ((haplotypeReference="' + str(ref) + \
-                '" AND haplotypeAlternate ="' + str(alt) + \
-                '") OR (haplotypeReference="' + str(compRef) + \
-                '" AND haplotypeAlternate ="' + str(compAlt) + '"));'
 
-            sql2 = 'select * from chrom_pos_equal_nobase where CHR="' + \
-                str(chr) + '" AND start = ' + str(pos) + ';'
+# positionType set by BigRefGene -> GeneStage counter
+POSITION_TYPE_COUNTERS = {
+    'intron': 'intronic',
+    'non_coding_intron': 'non_coding_intronic',
+    'CDS': 'cds',
+    'non_coding_exon': 'non_coding_exonic',
+    'utr5': 'utr5',
+    'utr3': 'utr3',
+}
+
+"""Get information about location in gene structures
+"""
+class GeneStage(Stage):
+    counters = ['interGenic', 'cds', 'utr3', 'utr5', 'intronic',
+        'non_coding_intronic', 'exonic', 'non_coding_exonic', 'promoter']
+
+    def __init__(self, name='refGene', table='refGene', promoter_offset=500):
+        Stage.__init__(self, name, table)
+        self.promoter_offset = int(promoter_offset)
+
+    def query(self, rec):
+        pos = str(rec.pos)
+        return 'select * from ' + self.table + ' where chrom="' + \
+            rec.ucsc_chrom() + '" AND (txStart - ' + \
+            str(self.promoter_offset) + ') <= ' + pos + ' AND ' + pos + \
+            ' <= (txEnd + ' + str(self.promoter_offset) + ');'
+
+    def promoterQuery(self, chrom, pos):
+        return 'select chrom, chromStart, chromEnd, name from ' + \
+            'cpgIslandExt where chrom="' + chrom + '" AND (chromStart <= ' + \
+            str(pos) + ' AND ' + str(pos) + ' <= chromEnd);'
+
+    def joinQueries(self, sites, join):
+        offset = str(self.promoter_offset)
+        return ['select s.idx, t.* from ' + sites + ' s ' + join + ' ' +
+            self.table + ' t on t.chrom = s.chrom AND (t.txStart - ' +
+            offset + ') <= s.pos AND s.pos <= (t.txEnd + ' + offset + ');']
+
+    """Promoter regions are still looked up per transcript (cpgIslandExt)
+    """
+    def found(self, cursor, rec, rows):
+        if (len(rows) == 0):
+            rec.add('positionType', 'interGenic')
+            self.counts['interGenic'] += 1
+            return
+
+        # Isoforms are counted once per refGene row
+        counter = POSITION_TYPE_COUNTERS.get(rec.get('positionType'))
+        if counter is not None:
+            self.counts[counter] += len(rows)
+
+        for row in rows:
+            region = self.region(cursor, rec, row)
+            if (len(region) > 0):
+                rec.extend(geneNameItems(row, indicesKnownGenes))
+                rec.extend(region)
+
+    """INFO items describing where the variant falls in one transcript
+    """
+    def region(self, cursor, rec, row):
+        pos = rec.pos
+        txtStart = int(row[4])
+        txtEnd = int(row[5])
+        cdsStart = int(row[6])
+        cdsEnd = int(row[7])
+        exonCount = int(row[8])
+        exonsSt = str(row[9].decode("utf-8")).split(',')
+        exonsEn = str(row[10].decode("utf-8")).split(',')
+        strand = str(row[3])
+
+        if (cdsStart == cdsEnd):
+            return self.exons(pos, exonsSt, exonsEn, exonCount, strand,
+                'non_coding_exon')
+
+        elif (u.isBetween(pos, cdsStart, cdsEnd)):
+            exons = self.exons(pos, exonsSt, exonsEn, exonCount, strand, 'exon')
+            self.counts['exonic'] += len(exons)
+            return exons
+
+        elif ((u.isBetween(pos, txtStart - self.promoter_offset, txtStart) and
+            (strand == "+")) or (u.isBetween(pos, txtEnd,
+            txtEnd + self.promoter_offset) and (strand == "-"))):
+            cursor.execute(self.promoterQuery(rec.ucsc_chrom(), pos))
+            cpg = cursor.fetchone()
+            if (cpg is not None):
+                self.counts['promoter'] += 1
+                return [('putativePromoterRegion', "".join(str(cpg[3]).split()))]
+
+        return []
+
+    def exons(self, pos, exonsSt, exonsEn, exonCount, strand, key):
+        exons = []
+        for e in range(0, exonCount):
+            if (u.isBetween(pos, int(exonsSt[e]), int(exonsEn[e]))):
+                exnum = e + 1
+                if (strand == '-'):
+                    exnum = exonCount - e
+                exons.append((key, 'ex' + str(exnum) + '/' + str(exonCount)))
+        return exons
+
+    def infoKeys(self):
+        return [geneColumns[i] for i in indicesKnownGenes] + ['positionType',
+            'exon', 'non_coding_exon', 'putativePromoterRegion']
+
+    def log_lines(self):
+        c = self.counts
+        return ["Variants located:",
+            f"In interGenic {str(c['interGenic'])}",
+            f"In CDS {str(c['cds'])}",
+            f"In \'3 UTR {str(c['utr3'])}",
+            f"In \'5 UTR {str(c['utr5'])}",
+            f"In Intronic {str(c['intronic'])}",
+            f"In Non_coding_intronic {str(c['non_coding_intronic'])}",
+            f"In Exonic {str(c['exonic'])}",
+            f"In Non_coding_exonic {str(c['non_coding_exonic'])}",
+            f"In Putative Promoter Region {str(c['promoter'])}"]
+
+    def write_log(self, fh_log):
+        for line in self.log_lines():
+            print(line)
+            fh_log.write(line + '\n')
+
+
+"""Overlap with tfbsConsSites; the sites are split into one table per
+   chromosome (tfbsConsSites1 ... tfbsConsSitesY)
+"""
+class TfbsConsSitesStage(Stage):
+    allowed_chrom = ['1','2','3','4','5','6','7','8','9','10','11','12','13',
+        '14','15','16','17','18','19','20','21','22','X','Y']
 
-            sql3 = 'select * from chrom_pos_unequal where CHR="' + \
-                str(chr) + '" AND start <= ' + str(pos) + ' AND ' + \
-                str(pos) + ' <= end ;'
+    def __init__(self, name=None, table='tfbsConsSites'):
+        Stage.__init__(self, name, table)
+
+    def query(self, rec):
+        chrom = rec.bare_chrom()
+        if chrom not in self.allowed_chrom:
+            return None
+        return 'select chrom, chromStart, chromEnd, name from ' + \
+            self.table + chrom + ' where  chromStart <= ' + str(rec.pos) + \
+            ' AND ' + str(rec.pos) + ' <= chromEnd;'
+
+    """One join per chromosome table; sites on other chromosomes get no
+       rows, which apply() skips like a record without a query
+    """
+    def joinQueries(self, sites, join):
+        return ['select s.idx, t.chrom, t.chromStart, t.chromEnd, t.name ' +
+            'from ' + sites + ' s ' + join + ' ' + self.table + chrom +
+            ' t on t.chromStart <= s.pos AND s.pos <= t.chromEnd where ' +
+            's.bare = "' + chrom + '";' for chrom in self.allowed_chrom]
+
+    def apply(self, rec, rows):
+        if (len(rows) == 0):
+            return
+        self.counts['variants'] += 1
+        self.counts['hits'] += len(rows)
+        for row in rows:
+            rec.add('tfbsRegion', (str(row[3]) + '.' + str(row[0]) + '.' +
+                str(row[1]) + '.' + str(row[2])).strip())
+
+    def infoKeys(self):
+        return ['tfbsRegion']
 
-            keep_going = True
-            cursor.execute(sql1)
-            rows = cursor.fetchall()
 
-            if (len(rows) > 0):
-                keep_going = False
-                m = set([])
-                for row in rows:
-                    m.add(collapseRefSeq('\t'.join([str(x) for x in row[1:len(row)] ])))
+"""Overlap with GadAll table
+"""
+class GadAllStage(Stage):
+    def __init__(self, name=None, table='gadAll'):
+        Stage.__init__(self, name, table)
 
-                fields[7] = fields[7] + ';' + ';'.join(m)
-                if (str(fields[7]).startswith(".;")):
-                    fields[7] = str(fields[7]).replace('.;', '', 1)
+    def query(self, rec):
+        # For some reason this table has no "chr" preceeding number
+        return overlapQuery(self.table, rec.bare_chrom(), rec.pos,
+            chrom_column='chromosome')
 
-                l = '\t'.join([str(x) for x in fields])
-                fh_out.write(l + '\n')
+    def joinQueries(self, sites, join):
+        return [overlapJoin(self.table, sites, join,
+            chrom_column='chromosome', site_chrom='bare')]
 
-            if (keep_going):
-                cursor.execute(sql2)
-                rows = cursor.fetchall()
+    def apply(self, rec, rows):
+        if (len(rows) == 0):
+            return
+        self.counts['variants'] += 1
+        self.counts['hits'] += len(rows)
+        for disease in u.dedup([str(row[3]) for row in rows]):
+            rec.add(self.table, disease)
 
-                if (len(rows) > 0):
-                    keep_going = False
-                    m = set([])
-                    for row in rows:
-                        m.add(collapseRefSeq('\t'.join([str(x) for x in row[1:len(row)]])))
 
-                    fields[7] = fields[7] + ';' + ';'.join(m)
-                    if (str(fields[7]).startswith(".;")):
-                        fields[7] = str(fields[7]).replace('.;', '', 1)
-                    
-                    l = '\t'.join([str(x) for x in fields])
-                    fh_out.write(l + '\n')
+""" Overlap with gwasCatalog table """
+class GwasCatalogStage(Stage):
+    def __init__(self, name=None, table='gwasCatalog'):
+        Stage.__init__(self, name, table)
 
-            if (keep_going):
-                cursor.execute(sql3)
-                rows = cursor.fetchall()
+    def query(self, rec):
+        return 'select * from ' + self.table + ' where chrom="' + \
+            rec.ucsc_chrom() + '" AND chromEnd = ' + str(rec.pos) + ';'
 
-                if (len(rows) > 0):
-                    keep_going = False
-                    m = set([])
-                    for row in rows:
-                        m.add(collapseRefSeq('\t'.join([str(x) for x in row[1:len(row)]])))
+    def joinQueries(self, sites, join):
+        return ['select s.idx, t.* from ' + sites + ' s ' + join + ' ' +
+            self.table + ' t on t.chrom = s.chrom AND t.chromEnd = s.pos;']
 
-                    fields[7] = fields[7] + ';' + ';'.join(m)
-                    if (str(fields[7]).startswith(".;")):
-                        fields[7] = str(fields[7]).replace('.;', '', 1)
+    def apply(self, rec, rows):
+        if (len(rows) == 0):
+            return
+        self.counts['variants'] += 1
+        self.counts['hits'] += len(rows)
+        for row in rows:
+            rec.add(self.table, 'pubMedID=' + str(row[5]) + ',trait=' +
+                str(row[10]))
 
-                    l = '\t'.join([str(x) for x in fields])
-                    fh_out.write(l + '\n')
 
-            if (keep_going):
-                fh_out.write(line + '\n')
+"""Overlap with HUGO Gene Nomenclature Committee (HGNC) table
+"""
+class HugoStage(Stage):
+    def __init__(self, name=None, table='hugo'):
+        Stage.__init__(self, name, table)
+
+    def query(self, rec):
+        return overlapQuery(self.table, rec.ucsc_chrom(), rec.pos)
+
+    def joinQueries(self, sites, join):
+        return [overlapJoin(self.table, sites, join)]
+
+    def apply(self, rec, rows):
+        if (len(rows) == 0):
+            return
+        self.counts['variants'] += 1
+        self.counts['hits'] += len(rows)
+        genes = u.dedup([(str(row[5]) + ',' + str(row[6])).strip()
+            for row in rows])
+        # All genes go in one comma separated item
+        rec.add('HGNC_GeneAnnotation',
+            ',HGNC_GeneAnnotation='.join(genes).replace(';', ','))
+
+    def infoKeys(self):
+        return ['HGNC_GeneAnnotation']
+
+
+"""Overlap with segdup regions genomicSuperDups
+"""
+class GenomicSuperDupsStage(Stage):
+    order = ['chromStart', 'chromEnd', 'otherChrom', 'otherStart', 'otherEnd']
+
+    def __init__(self, name=None, table='genomicSuperDups'):
+        Stage.__init__(self, name, table)
+
+    def query(self, rec):
+        return overlapQuery(self.table, rec.ucsc_chrom(), rec.pos,
+            order=self.order)
+
+    def joinQueries(self, sites, join):
+        return [overlapJoin(self.table, sites, join, order=self.order)]
+
+    def apply(self, rec, rows):
+        if (len(rows) == 0):
+            return
+        self.counts['variants'] += 1
+        self.counts['hits'] += 1
+        row = rows[0]
+        rec.extend([(self.table, 'True'), ('otherChrom', str(row[7])),
+            ('otherStart', str(row[8])), ('otherEnd', str(row[9]))])
+
+    def infoKeys(self):
+        return [self.table, 'otherChrom', 'otherStart', 'otherEnd']
+
+
+# Cytogenetic band name, e.g. p36.33 or q11.21
+BAND = re.compile(r'^[pq][0-9]+(\.[0-9]+)?$')
+
+"""Method to find overlap with Cytoband table
+"""
+class CytobandStage(Stage):
+    def __init__(self, name=None, table='cytoBand'):
+        Stage.__init__(self, name, table)
+        self.colindex = 12
+        self.startName = 'txStart'
+        self.endName = 'txEnd'
+
+        if (table == 'cytoBand'):
+            self.colindex = 3
+            self.startName = 'chromStart'
+            self.endName = 'chromEnd'
+
+    def query(self, rec):
+        return overlapQuery(self.table, rec.ucsc_chrom(), rec.pos,
+            start=self.startName, end=self.endName)
+
+    def joinQueries(self, sites, join):
+        return [overlapJoin(self.table, sites, join, start=self.startName,
+            end=self.endName)]
+
+    def apply(self, rec, rows):
+        if (len(rows) == 0):
+            return
+        self.counts['variants'] += 1
+        self.counts['hits'] += len(rows)
+        bands = u.dedup([str(row[self.colindex]) for row in rows])
+        rec.add_fragment(str(self.table) + '=' + ';'.join(bands))
+
+    """Bands after the first are written as bare flags (e.g. "p36.32")
+    """
+    def owns(self, key, value):
+        return (key == self.table or (value is None and
+            BAND.match(key) is not None))
+
+
+"""Method to find overlap with CNV tables
+"""
+class CnvStage(Stage):
+    def __init__(self, name=None, table='dgv_Cnv'):
+        Stage.__init__(self, name, table)
+
+    def query(self, rec):
+        return overlapQuery(self.table, rec.ucsc_chrom(), rec.pos)
+
+    def joinQueries(self, sites, join):
+        return [overlapJoin(self.table, sites, join)]
+
+    def apply(self, rec, rows):
+        if (len(rows) == 0):
+            return
+        self.counts['variants'] += 1
+        self.counts['hits'] += 1
+        rec.add(self.table, 'True')
+
+
+"""Method to find overlap with targetScanS tables
+"""
+class MiRNAStage(Stage):
+    order = ['chromStart', 'chromEnd', 'name']
+
+    def __init__(self, name=None, table='targetScanS'):
+        Stage.__init__(self, name, table)
+
+    def query(self, rec):
+        return overlapQuery(self.table, rec.ucsc_chrom(), rec.pos,
+            order=self.order)
+
+    def joinQueries(self, sites, join):
+        return [overlapJoin(self.table, sites, join, order=self.order)]
 
-            vcf_linenum = vcf_linenum + 1
+    def apply(self, rec, rows):
+        if (len(rows) == 0):
+            return
+        self.counts['variants'] += 1
+        self.counts['hits'] += 1
+        row = rows[0]
+        rec.add('miRNAsites', (str(row[4]) + ',' + str(row[1]) + '_' +
+            str(row[2]) + '_' + str(row[3])).strip())
 
+    def infoKeys(self):
+        return ['miRNAsites']
+
+    def log_lines(self):
+        return [f"In miRNAsites: {str(self.counts['hits'])} in " +
+            f"{str(self.counts['variants'])} variants"]
+
+
+# Records run through the stages together; each stage sees a whole chunk.
+# A chunk is also limited to one fill of the read buffer (v.BUFFER_SIZE).
+CHUNK_SIZE = 10000
+
+"""Annotates records with one (non-filter) stage
+   sites maps id(rec) to the site key of each record for the cache. With
+   an engine (bulk.BulkJoin) the rows of the records the cache does not
+   replay are fetched together.
+"""
+def annotateStage(stage, records, cursor, cache=None, sites=None,
+    engine=None):
+    if (engine is not None and cache is not None):
+        records = [rec for rec in records
+            if not cache.replay(stage, rec, sites[id(rec)])]
+    found = None
+    if (engine is not None and len(records) > 0):
+        found = engine.rows(stage, records)
+
+    for i, rec in enumerate(records):
+        rows = found[i] if found is not None else None
+        if cache is not None:
+            cache.annotate(stage, cursor, rec, sites[id(rec)], rows)
+        elif rows is not None:
+            stage.found(cursor, rec, rows)
         else:
-            fh_out.write(line + '\n')
+            stage.annotate(cursor, rec)
 
-    conn.close()
+
+"""Annotates the lines buf[start:end] of a chunk with every stage and
+   writes them out. A FilterStage narrows the records the later stages
+   see. With a dedup.SiteCache, each stage looks up a site only once per
+   job; an engine looks up the records of sites new to the cache together
+   (see annotateStage and bulk.py). Returns the number of records read.
+"""
+def annotateChunk(buf, mv, lines, stages, cursor, fh_out, profiler,
+    cache=None, engine=None):
+    if (len(lines) == 0):
+        return 0
+
+    with profiler.span('parse') as span:
+        records = [v.parse_record(buf, start, end, mv) for start, end in lines]
+        sites = {}
+        lookups = records
+        if cache is not None:
+            lookups = []
+            for rec in records:
+                site = dd.site_key(rec)
+                if not cache.seen(site):
+                    lookups.append(rec)
+                sites[id(rec)] = site
+        span.records += len(records)
+
+    if engine is not None:
+        engine.begin(stages, lookups)
+    active = records
+    dropped = set()
+    for stage in stages:
+        with profiler.span(stage.name) as span:
+            span.records += len(active)
+            if isinstance(stage, FilterStage):
+                active, filtered = stage.select(active)
+                if not stage.passthrough:
+                    dropped.update([id(rec) for rec in filtered])
+            else:
+                annotateStage(stage, active, cursor, cache, sites, engine)
+    if engine is not None:
+        engine.end()
+
+    with profiler.span('write') as span:
+        pieces = []
+        for rec in records:
+            if id(rec) not in dropped:
+                pieces.extend(rec.pieces())
+        fh_out.writelines(pieces)
+        span.records += len(records)
+
+    return len(records)
+
+
+"""True for a header line at buf[start:]; the original pipeline also
+   treated a bare "CHROM" line as the header
+"""
+def isHeader(buf, start):
+    return (buf[start] == ord('#') or buf[start:start + 5] == b'CHROM')
+
+
+"""Annotates the lines of one buffer, copying header lines through
+"""
+def annotateLines(buf, mv, lines, stages, cursor, fh_out, profiler,
+    chunk_size=CHUNK_SIZE, cache=None, engine=None):
+    records = 0
+    pending = []
+    for start, end in lines:
+        if isHeader(buf, start):
+            records += annotateChunk(buf, mv, pending, stages, cursor,
+                fh_out, profiler, cache, engine)
+            pending = []
+            fh_out.write(bytes(mv[start:end]).strip() + b'\n')
+        elif (buf[start] in b'\r\n'):
+            continue
+        else:
+            pending.append((start, end))
+            if (len(pending) >= chunk_size):
+                records += annotateChunk(buf, mv, pending, stages, cursor,
+                    fh_out, profiler, cache, engine)
+                pending = []
+    records += annotateChunk(buf, mv, pending, stages, cursor, fh_out,
+        profiler, cache, engine)
+    return records
+
+
+"""Runs infile through the stages and writes outfile in a single pass
+   The input is read with readinto() into one reusable buffer. Header lines
+   are copied. Data lines are parsed into VariantRecords that point into
+   the buffer, annotated a chunk at a time and written by concatenating
+   their unchanged slices with the new INFO. Each stage is timed in its own
+   profiler span. Returns the number of records.
+
+   With a checkpoint.Checkpoint, progress is saved at buffer boundaries
+   and a run interrupted earlier resumes from its last checkpoint. cache
+   is an optional dedup.SiteCache shared by all chunks, engine an optional
+   lookup engine such as bulk.BulkJoin.
+"""
+def annotateVcf(infile, outfile, stages, cursor, profiler=None,
+    chunk_size=CHUNK_SIZE, buffer_size=v.BUFFER_SIZE, checkpoint=None,
+    cache=None, engine=None):
+    if profiler is None:
+        profiler = perf.Profiler()
+
+    fh = open(infile, 'rb', buffering=0)
+    state = checkpoint.load() if checkpoint else None
+    records = 0
+    offset = 0
+    if state is not None:
+        records = ckpt.restore(state, stages)
+        offset = state['input_offset']
+        fh.seek(offset)
+    fh_out = checkpoint.open_output(state) if checkpoint else \
+        open(outfile, 'wb')
+
+    for buf, mv, lines in v.read_chunks(fh, buffer_size):
+        records += annotateLines(buf, mv, lines, stages, cursor, fh_out,
+            profiler, chunk_size, cache, engine)
+        offset = offset + lines[-1][1]
+        if (checkpoint and checkpoint.due()):
+            checkpoint.save(fh_out, offset, records, stages)
+    if checkpoint:
+        checkpoint.save(fh_out, offset, records, stages, done=True)
     fh.close()
     fh_out.close()
+    return records
+
+
+"""Offsets of the lines in buf[start:end]; a line belongs to the range in
+   which it starts
+"""
+def lineOffsets(buf, start, end):
+    lines = []
+    i = start
+    while (i < end):
+        j = buf.find(b'\n', i)
+        j = len(buf) if j < 0 else j + 1
+        lines.append((i, j))
+        i = j
+    return lines
+
+
+"""Annotates the lines starting in the byte range [start, end) of a
+   memory-mapped VCF and writes them to outfile. Header lines in the range
+   are copied. Used by the parallel driver; returns the number of records.
+   A checkpoint, a cache and an engine are used as in annotateVcf.
+"""
+def annotateRange(mm, start, end, outfile, stages, cursor, profiler=None,
+    chunk_size=CHUNK_SIZE, checkpoint=None, cache=None, engine=None):
+    if profiler is None:
+        profiler = perf.Profiler()
+
+    state = checkpoint.load() if checkpoint else None
+    records = 0
+    i = start
+    if state is not None:
+        records = ckpt.restore(state, stages)
+        i = state['input_offset']
+    fh_out = checkpoint.open_output(state) if checkpoint else \
+        open(outfile, 'wb')
+
+    mv = memoryview(mm)
+    while (i < end):
+        # About one read buffer of lines at a time
+        lines = lineOffsets(mm, i, min(i + v.BUFFER_SIZE, end))
+        records += annotateLines(mm, mv, lines, stages, cursor, fh_out,
+            profiler, chunk_size, cache, engine)
+        i = lines[-1][1]
+        if (checkpoint and checkpoint.due()):
+            checkpoint.save(fh_out, i, records, stages)
+    if checkpoint:
+        checkpoint.save(fh_out, i, records, stages, done=True)
+    fh_out.close()
+    mv.release()
+    return records
+
+
+"""Writes the count log of all stages, in stage order
+"""
+def writeCountLog(stages, logcountfile, mode='w'):
+    fh_log = open(logcountfile, mode)
+    for stage in stages:
+        stage.write_log(fh_log)
+    fh_log.close()
+
+
+"""Runs one stage over <vcf><tmpextin> and writes <vcf><tmpextout>
+   The stage's counts are added to <vcf>.count.log
+"""
+def annotateFile(stage, vcf, tmpextin, tmpextout, log_mode='a'):
+    conn = u.db_connect()
+    cursor = conn.cursor()
+    annotateVcf(vcf + tmpextin, vcf + tmpextout, [stage], cursor)
+    conn.close()
+    writeCountLog([stage], vcf + '.count.log', mode=log_mode)
+
+
+""""Format must be pileup or vcf
+    Types of variants in dbSNP135: DIV, SNV, MNV, MIXED
+"""
+def getSnpsFromDbSnp(vcf, format='vcf', tmpextin='', tmpextout='.1',
+    varclass='SNV', sep='\t'):
+    annotateFile(DbSnpStage(varclass=varclass), vcf, tmpextin, tmpextout,
+        log_mode='w')
+
+
+"""NOTE: all isoforms are collapsed in one record
+"""
+def getBigRefGene(vcf, format='vcf', tmpextin='.1', tmpextout='.2', sep='\t'):
+    annotateFile(BigRefGeneStage(), vcf, tmpextin, tmpextout)
 
 
 """Get information about location in gene structures
 """
-def getGenes(vcf, format='vcf', table='refGene', promoter_offset=500, 
+def getGenes(vcf, format='vcf', table='refGene', promoter_offset=500,
     tmpextin='.2', tmpextout='.3', sep='\t'):
-    
+    annotateFile(GeneStage(table=table, promoter_offset=promoter_offset),
+        vcf, tmpextin, tmpextout)
+
+
+"""Overlap with tfbsConsSites
+"""
+def addOverlapWithTfbsConsSites(vcf, format='vcf', table='tfbsConsSites',
+    tmpextin='.2', tmpextout='.3', sep='\t'):
+    annotateFile(TfbsConsSitesStage(table=table), vcf, tmpextin, tmpextout)
+
+
+"""Overlap with GadAll table
+"""
+def addOverlapWithGadAll(vcf, format='vcf', table='gadAll', tmpextin='',
+    tmpextout='.1', sep='\t'):
+    annotateFile(GadAllStage(table=table), vcf, tmpextin, tmpextout)
+
+
+""" Overlap with gwasCatalog table """
+def addOverlapWithGwasCatalog(vcf, format='vcf', table='gwasCatalog', \
+    tmpextin='', tmpextout='.1', sep='\t'):
+    annotateFile(GwasCatalogStage(table=table), vcf, tmpextin, tmpextout)
+
+
+"""Overlap with HUGO Gene Nomenclature Committee (HGNC) table
+"""
+def addOverlapWitHUGOGeneNomenclature(vcf, format='vcf', table='hugo',
+    tmpextin='', tmpextout='.1', sep='\t'):
+    annotateFile(HugoStage(table=table), vcf, tmpextin, tmpextout)
+
+
+"""Overlap with segdup regions genomicSuperDups
+"""
+def addOverlapWithGenomicSuperDups(vcf, format='vcf',
+    table='genomicSuperDups', tmpextin='', tmpextout='.1', sep='\t'):
+    annotateFile(GenomicSuperDupsStage(table=table), vcf, tmpextin, tmpextout)
+
+
+"""Method to find overlap with Cytoband table
+"""
+def addOverlapWithCytoband(vcf, format='vcf', table='cytoBand',
+    tmpextin='', tmpextout='.1', sep='\t'):
+    annotateFile(CytobandStage(table=table), vcf, tmpextin, tmpextout)
+
+
+"""Method to find overlap with CNV tables
+"""
+def addOverlapWithCnvDatabase(vcf, format='vcf', table='dgv_Cnv',
+    tmpextin='', tmpextout='.1', sep='\t'):
+    annotateFile(CnvStage(table=table), vcf, tmpextin, tmpextout)
+
+
+"""Method to find overlap with targetScanS tables
+"""
+def addOverlapWithMiRNA(vcf, format='vcf', table='targetScanS',
+    tmpextin='', tmpextout='.1', sep='\t'):
+    annotateFile(MiRNAStage(table=table), vcf, tmpextin, tmpextout)
+
+
+"""Method used in INDELS, where bigRefGeneTable is not applicable
+"""
+def getExonsEtAl(vcf, format='vcf', table='refGene', promoter_offset=500, 
+    tmpextin='.2', tmpextout='.3', sep='\t'):
+
     basefile = vcf
     vcf = basefile + tmpextin
     outfile = basefile + tmpextout
@@ -336,10 +1097,10 @@ def getGenes(vcf, format='vcf', table='refGene', promoter_offset=500,
         if not line.startswith("#"):
             fields = line.split(sep)
             chr = fields[inds[0]].strip()
-
+            
             if not chr.startswith("chr"):
                 chr = "chr" + chr
-
+            
             pos = fields[inds[1]].strip()
             ref = clean_mysql_chars(fields[inds[2]]).strip()
             alt = clean_mysql_chars(fields[inds[3]]).strip()
@@ -347,41 +1108,22 @@ def getGenes(vcf, format='vcf', table='refGene', promoter_offset=500,
             this_gene_name = str(u.parse_field(info_field, 'name', ';', '='))
 
             sql = 'select * from ' + table + ' where chrom="' + str(chr) + \
-                '" AND (txStart - ' + str(promoter_offset) +') <= ' + \
+                '"   AND (txStart - ' + str(promoter_offset) + ') <= ' + \
                 str(pos) + ' AND ' + str(pos) + ' <= (txEnd + ' + \
                 str(promoter_offset) +');'
-
             cursor.execute(sql)
             rows = cursor.fetchall()
             info = []
-
             if (len(rows) > 0):
                 cnt = 1
                 for row in rows:
-                    #count location
-                    positionType = str(u.parse_field(info_field, 
-                        'positionType', ';', '='))
-                    
-                    if (positionType == 'intron'):
-                        intronic_count = intronic_count + 1
-                    elif (positionType == 'non_coding_intron'):
-                        non_coding_intronic_count = non_coding_intronic_count + 1
-                    elif (positionType == 'CDS'):
-                        cds_count = cds_count + 1
-                    elif (positionType == 'non_coding_exon'):
-                        non_coding_exonic_count = non_coding_exonic_count + 1
-                    elif (positionType == 'utr5'):
-                        utr5_count = utr5_count + 1
-                    elif (positionType == 'utr3'):
-                        utr3_count = utr3_count + 1
-
                     txtStart = int(row[4])
                     txtEnd = int(row[5])
                     cdsStart = int(row[6])
                     cdsEnd = int(row[7])
                     exonCount = int(row[8])
-                    exonStarts =str(row[9].decode("utf-8"))
-                    exonEnds = str(row[10].decode("utf-8"))
+                    exonStarts =str(row[9].decode('utf-8'))
+                    exonEnds = str(row[10].decode('utf-8'))
                     geneSymbol = str(row[12])
                     strand = str(row[3])
 
@@ -398,211 +1140,31 @@ def getGenes(vcf, format='vcf', table='refGene', promoter_offset=500,
                             if (u.isBetween(pos, int(exonsSt[e]), int(exonsEn[e]))):
                                 exnum = e + 1
                                 if (strand == '-'):
-                                    exnum = exonCount - e
+                                    exnum =  exonCount - e
                                 exons.append("non_coding_exon=" + "ex" + \
                                     str(exnum) + '/' + str(exonCount))
+                                non_coding_exonic_count = non_coding_exonic_count + 1
                         if (len(exons) > 0):
-                            region = ";".join(exons)
-                    elif (u.isBetween(pos, cdsStart, cdsEnd)):
+                            region='positionType=non_coding_exon;' + ";".join(exons)
+                        else:
+                            non_coding_intronic_count = non_coding_intronic_count + 1
+                            region = 'positionType=non_coding_intron'
+
+                    elif (u.isBetween(pos, cdsStart, cdsEnd) and (cdsStart < cdsEnd)):
+                        cds_count = cds_count + 1
                         for e in range(0, exonCount):
-                            if u.isBetween(pos, int(exonsSt[e]), int(exonsEn[e])):
+                            if (u.isBetween(pos, int(exonsSt[e]), int(exonsEn[e]))):
                                 exnum = e + 1
                                 if (strand == '-'):
-                                    exnum = exonCount - e
-                                exons.append("exon=" +  "ex" + \
+                                    exnum =  exonCount - e
+                                exons.append("exon=" + "ex" + \
                                     str(exnum) + '/' + str(exonCount))
-                                exonic_count = exonic_count + 1
+                                exonic_count=exonic_count+1
                         if (len(exons) > 0):
-                            region = ";".join(exons)
-
-                    elif (u.isBetween(pos, promoter_plus, txtStart) and 
-                        (strand == "+")):
-                        sql = 'select chrom, chromStart, chromEnd, name from ' + \
-                            'cpgIslandExt where chrom="' + str(chr) + \
-                            '" AND (chromStart <= ' + str(pos) + \
-                            ' AND ' + str(pos) + ' <= chromEnd);'
-                        cursor.execute(sql)
-                        rows = cursor.fetchone()
-
-                        if (rows is not None):
-                            region = 'putativePromoterRegion=' + \
-                                "".join(str(rows[3]).split())
-                            promoter_count = promoter_count + 1
-
-                    elif (u.isBetween(pos, txtEnd, promoter_minus) and (strand == "-")):
-                        sql = 'select chrom, chromStart, chromEnd, name from ' + \
-                            'cpgIslandExt where chrom="' + str(chr) + \
-                            '" AND (chromStart <= ' + str(pos) + \
-                            ' AND ' + str(pos) + ' <= chromEnd);'
-                        cursor.execute(sql)
-
-                        rows = cursor.fetchone()
-                        if (rows is not None):
-                            region = 'putativePromoterRegion=' +  \
-                                "".join(str(rows[3]).split())
-                            promoter_count = promoter_count + 1
-
-                    else:
-                        region = ''
-
-                    if (region != ''):
-                        info.append(collapseGeneNames(row=row, 
-                            indices=indicesKnownGenes, region=region, cnt=cnt))
-
-                    cnt = cnt + 1
-
-                str_info = ";".join(info)
-                fields[7] = fields[7] + ';' + str_info
-                fh_out.write('\t'.join(fields) + '\n')
-
-            else:
-                fields[7] = fields[7] + ";positionType=interGenic"
-                fh_out.write('\t'.join(fields) + '\n')
-                interGenic_count = interGenic_count + 1
-
-            linenum = linenum + 1
-
-        else:
-            fh_out.write(line + '\n')
-
-    print("Variants located:")
-    fh_log.write("Variants located:\n")
-
-    print(f"In interGenic {str(interGenic_count)}")
-    fh_log.write(f"In interGenic {str(interGenic_count)}\n")
-
-    print(f"In CDS {str(cds_count)}")
-    fh_log.write(f"In CDS {str(cds_count)}\n")
-
-    print(f"In \'3 UTR {str(utr3_count)}")
-    fh_log.write(f"In \'3 UTR {str(utr3_count)}\n")
-
-    print(f"In \'5 UTR {str(utr5_count)}")
-    fh_log.write(f"In \'5 UTR {str(utr5_count)}\n")
-
-    print(f"In Intronic {str(intronic_count)}")
-    fh_log.write(f"In Intronic {str(intronic_count)}\n")
-
-    print(f"In Non_coding_intronic {str(non_coding_intronic_count)}")
-    fh_log.write(f"In Non_coding_intronic {str(non_coding_intronic_count)}\n")
-
-    print(f"In Exonic {str(exonic_count)}")
-    fh_log.write(f"In Exonic {str(exonic_count)}\n")
-
-    print(f"In Non_coding_exonic {str(non_coding_exonic_count)}")
-    fh_log.write(f"In Non_coding_exonic {str(non_coding_exonic_count)}\n")
-
-    print(f"In Putative Promoter Region {str(promoter_count)}")
-    fh_log.write(f"In Putative Promoter Region {str(promoter_count)}\n")
-
-    fh_out.close()
-    fh_log.close()
-    fh.close()
-    conn.close()
-
-
-"""Method used in INDELS, where bigRefGeneTable is not applicable
-"""
-def getExonsEtAl(vcf, format='vcf', table='refGene', promoter_offset=500, 
-    tmpextin='.2', tmpextout='.3', sep='\t'):
-
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-    fh_out = open(outfile, "w")
-
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-
-    interGenic_count = 0
-    cds_count = 0
-    utr3_count = 0
-    utr5_count = 0
-    intronic_count = 0
-    non_coding_intronic_count = 0
-    exonic_count = 0
-    non_coding_exonic_count = 0
-    promoter_count = 0
-
-    inds = getFormatSpecificIndices(format=format)
-    fh = open(vcf)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
-
-    for line in fh:
-        line = line.strip()
-        if not line.startswith("#"):
-            fields = line.split(sep)
-            chr = fields[inds[0]].strip()
-            
-            if not chr.startswith("chr"):
-                chr = "chr" + chr
-            
-            pos = fields[inds[1]].strip()
-            ref = clean_mysql_chars(fields[inds[2]]).strip()
-            alt = clean_mysql_chars(fields[inds[3]]).strip()
-            info_field = clean_mysql_chars(fields[7]).strip()
-            this_gene_name = str(u.parse_field(info_field, 'name', ';', '='))
-
-            sql = 'select * from ' + table + ' where chrom="' + str(chr) + \
-                '"   AND (txStart - ' + str(promoter_offset) + ') <= ' + \
-                str(pos) + ' AND ' + str(pos) + ' <= (txEnd + ' + \
-                str(promoter_offset) +');'
-            cursor.execute(sql)
-            rows = cursor.fetchall()
-            info = []
-            if (len(rows) > 0):
-                cnt = 1
-                for row in rows:
-                    txtStart = int(row[4])
-                    txtEnd = int(row[5])
-                    cdsStart = int(row[6])
-                    cdsEnd = int(row[7])
-                    exonCount = int(row[8])
-                    exonStarts =str(row[9].decode('utf-8'))
-                    exonEnds = str(row[10].decode('utf-8'))
-                    geneSymbol = str(row[12])
-                    strand = str(row[3])
-
-                    promoter_plus = txtStart - int(promoter_offset)
-                    promoter_minus = txtEnd + int(promoter_offset)
-                    region = ""
-                    pos = int(pos)
-                    exons = []
-                    exonsSt = exonStarts.split(',')
-                    exonsEn = exonEnds.split(',')
-
-                    if (cdsStart == cdsEnd):
-                        for e in range(0, exonCount):
-                            if (u.isBetween(pos, int(exonsSt[e]), int(exonsEn[e]))):
-                                exnum = e + 1
-                                if (strand == '-'):
-                                    exnum =  exonCount - e
-                                exons.append("non_coding_exon=" + "ex" + \
-                                    str(exnum) + '/' + str(exonCount))
-                                non_coding_exonic_count = non_coding_exonic_count + 1
-                        if (len(exons) > 0):
-                            region='positionType=non_coding_exon;' + ";".join(exons)
-                        else:
-                            non_coding_intronic_count = non_coding_intronic_count + 1
-                            region = 'positionType=non_coding_intron'
-
-                    elif (u.isBetween(pos, cdsStart, cdsEnd) and (cdsStart < cdsEnd)):
-                        cds_count = cds_count + 1
-                        for e in range(0, exonCount):
-                            if (u.isBetween(pos, int(exonsSt[e]), int(exonsEn[e]))):
-                                exnum = e + 1
-                                if (strand == '-'):
-                                    exnum =  exonCount - e
-                                exons.append("exon=" + "ex" + \
-                                    str(exnum) + '/' + str(exonCount))
-                                exonic_count=exonic_count+1
-                        if (len(exons) > 0):
-                            region = 'positionType=CDS;' + ";".join(exons)
-                        else:
-                            intronic_count = intronic_count + 1
-                            region = 'positionType=CDS;' + 'intron'
+                            region = 'positionType=CDS;' + ";".join(exons)
+                        else:
+                            intronic_count = intronic_count + 1
+                            region = 'positionType=CDS;' + 'intron'
 
                     elif (u.isBetween(pos, txtStart, cdsStart) and \
                         (cdsStart < cdsEnd) and (strand == "+")):
@@ -712,114 +1274,28 @@ def getExonsEtAl(vcf, format='vcf', table='refGene', promoter_offset=500,
     conn.close()
 
 
-"""Overlap with tfbsConsSites
-"""
-def addOverlapWithTfbsConsSites(vcf, format='vcf', table='tfbsConsSites', 
-    tmpextin='.2', tmpextout='.3', sep='\t'):
-
-    allowed_chrom=['1','2','3','4','5','6','7','8','9','10','11','12','13',
-        '14','15','16','17','18','19','20','21','22','X','Y']
-
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
-
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-
-    linenum = 1
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if (line.startswith("##")):
-            fh_out.write(line + '\n')
-
-        #header line
-        elif (line.startswith('#CHROM') or line.startswith('CHROM')):
-            fh_out.write(line + '\n')
-
-        else:
-            fields = line.split(sep)
-            chr = fields[inds[0]].strip()
-            # For some reason this table has no "chr" preceeding number
-            if not chr.startswith("chr"):
-                chr = "chr" + chr
-
-            pos=fields[inds[1]].strip()
-            isOverlap = False
-            chrIndex=chr.replace('chr', '')
-
-            if (chrIndex in allowed_chrom):
-                isOverlap = False
-                sql = 'select chrom, chromStart, chromEnd, name ' + \
-                    'from tfbsConsSites' + chrIndex + \
-                    ' where  chromStart <= ' + str(pos) + ' AND ' + \
-                    str(pos) + ' <= chromEnd;'
-                cursor.execute(sql)
-                rows = cursor.fetchall()
-                records = []
-
-                if (len(rows) > 0):
-                    records_count = 1
-                    line_count = line_count + 1
-
-                    for row in rows:
-                        var_count = var_count + 1
-                        t = str(row[3]) + '.' + str(row[0]) + '.' + \
-                            str(row[1]) + '.' + str(row[2])
-                        t = t.strip()
-                        records.append('tfbsRegion' + '=' + t)
-                        records_count = records_count + 1
-
-                    if str(fields[7]).endswith(';'):
-                        fields[7] = fields[7] + ';'.join(records)
-                    else:
-                        fields[7] = fields[7] + ';' + ';'.join(records)
-
-                    fh_out.write('\t'.join(fields) + '\n')
-
-                else: # chrom is not on the list
-                    fh_out.write(line + '\n')
-
-            else: # chrom is not on the list
-                fh_out.write(line + '\n')
-
-        linenum = linenum + 1
-
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
-
-    conn.close()
-    fh.close()
-    fh_out.close()
-
-
-"""Overlap with GadAll table
+"""Searches Genes Databases and returns Genes/Cytobands 
+   with which SNP or INDEL overlaps
 """
-def addOverlapWithGadAll(vcf, format='vcf', table='gadAll', tmpextin='', 
-    tmpextout='.1', sep='\t'):
+def addOverlapWithRefGene(vcf, format='vcf', table='refGene', 
+    tmpextin='', tmpextout='.1', sep='\t'):
     
     basefile = vcf
     vcf = basefile + tmpextin
     outfile = basefile + tmpextout
-
     fh_out = open(outfile, "w")
     fh = open(vcf)
 
-    logcountfile = basefile+'.count.log'
+    logcountfile = basefile + '.count.log'
     fh_log = open(logcountfile, 'a')
     var_count = 0
     line_count = 0
+    colindex = 1
+    colindex2 = 12
+    name = 'name'
+    name2 = 'name2'
+    startName = 'txStart'
+    endName = 'txEnd'
 
     inds = getFormatSpecificIndices(format=format)
     conn = u.db_connect()
@@ -836,326 +1312,16 @@ def addOverlapWithGadAll(vcf, format='vcf', table='gadAll', tmpextin='',
             else:
                 fields = line.split(sep)
                 chr = fields[inds[0]].strip()
-                # For some reason this table has no "chr" preceeding number
-                if chr.startswith("chr"):
-                    chr = str(chr).replace("chr", "")
+                if not chr.startswith("chr"):
+                    chr = "chr" + chr
 
                 pos = fields[inds[1]].strip()
                 isOverlap = False
-
-                sql = 'select * from ' + table + ' where chromosome="' + \
-                    str(chr) + '" AND (chromStart <= ' + str(pos) + \
-                    ' AND ' + str(pos) + ' <= chromEnd);'
-                cursor.execute(sql)
-                rows = cursor.fetchall()
-                records = []
-
-                if (len(rows) > 0):
-                    records_count = 1
-                    line_count = line_count + 1
-                    r_tmp = []
-                    for row in rows:
-                        var_count = var_count + 1
-                        if not fu.isOnTheList(r_tmp, str(row[3])):
-                            r_tmp.append(str(row[3]) )
-                            records.append(str(table) + '=' + str(row[3]))
-                            records_count = records_count + 1
-                    if str(fields[7]).endswith(';'):
-                        fields[7] = fields[7] + ';'.join(records)
-                    else:
-                        fields[7] = fields[7] + ';' + ';'.join(records)
-                    fh_out.write('\t '.join(fields) + '\n')
-                else:
-                    fh_out.write(line + '\n')
-
-            linenum = linenum + 1
-        else:
-            fh_out.write(line + '\n')
-
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
-
-    conn.close()
-    fh.close()
-    fh_out.close()
-
-
-""" Overlap with gwasCatalog table """
-def addOverlapWithGwasCatalog(vcf, format='vcf', table='gwasCatalog', \
-    tmpextin='', tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
-
-    logcountfile = basefile+'.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
-
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                if not chr.startswith("chr"):
-                    chr = "chr" + chr
-                
-                pos = fields[inds[1]].strip()
-                isOverlap = False
-
-                sql = 'select * from ' + table + ' where chrom="' + \
-                    str(chr) + '" AND chromEnd = ' + str(pos) + ';'
-                cursor.execute(sql)
-                rows = cursor.fetchall()
-                records = []
-
-                if (len(rows) > 0):
-                    line_count = line_count + 1
-                    records_count = 1
-                    for row in rows:
-                        var_count = var_count + 1
-                        records.append(str(table) + '=' + str('pubMedID') + \
-                            '=' + str(row[5]) + ',trait=' + str(row[10]))
-                        records_count = records_count + 1
-                    if str(fields[7]).endswith(';'):
-                        fields[7] = fields[7] + ';'.join(records)
-                    else:
-                        fields[7] = fields[7] + ';' + ';'.join(records)
-                    fh_out.write('\t'.join(fields) + '\n')
-                else:
-                    fh_out.write(line + '\n')
-
-            linenum = linenum + 1
-        else:
-            fh_out.write(line + '\n')
-
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
-
-    conn.close()
-    fh.close()
-    fh_out.close()
-
-
-"""Overlap with HUGO Gene Nomenclature Committee (HGNC) table
-"""
-def addOverlapWitHUGOGeneNomenclature(vcf, format='vcf', table='hugo', 
-    tmpextin='', tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
-
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
-
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                if not chr.startswith("chr"):
-                    chr = "chr" + chr
-
-                pos=fields[inds[1]].strip()
-                isOverlap = False
-
-                sql = 'select * from ' + table + ' where chrom="' + \
-                    str(chr) + '" AND (chromStart <= ' + str(pos) + \
-                    ' AND ' + str(pos) + ' <= chromEnd);'
-                cursor.execute(sql)
-                rows = cursor.fetchall()
-                records = []
-
-                if (len(rows) > 0):
-                    line_count = line_count + 1
-                    records_count = 1
-                    r_tmp = []
-                    for row in rows:
-                        var_count = var_count + 1
-                        t = str(str(row[5]) + ',' + str(row[6])).strip()
-                        if not fu.isOnTheList(r_tmp, t):
-                            r_tmp.append(t)
-                            records.append('HGNC_GeneAnnotation' + '=' + t)
-                        records_count = records_count + 1
-
-                    records_str = ','.join(records).replace(';', ',')
-
-                    if str(fields[7]).endswith(';'):
-                        fields[7] = fields[7] +records_str
-                    else:
-                        fields[7] = fields[7] + ';' + records_str
-                    fh_out.write('\t'.join(fields) + '\n')
-                else:
-                    fh_out.write(line + '\n')
-
-            linenum = linenum + 1
-        else:
-            fh_out.write(line + '\n')
-
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
-
-    conn.close()
-    fh.close()
-    fh_out.close()
-
-
-"""Overlap with segdup regions genomicSuperDups
-"""
-def addOverlapWithGenomicSuperDups(vcf, format='vcf', 
-    table='genomicSuperDups', tmpextin='', tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
-
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
-
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                if not chr.startswith("chr"):
-                    chr = "chr" + chr
-
-                pos = fields[inds[1]].strip()
-                isOverlap = False
-                otherChrom = ''
-                otherStart = ''
-                otherEnd = ''
-                l = str(isOverlap)
-
-                sql = 'select * from ' + table + ' where chrom="'+ str(chr) + \
-                    '" AND (chromStart <= ' + str(pos) + \
-                    ' AND ' + str(pos) + ' <= chromEnd);'
-                cursor.execute(sql)
-                rows = cursor.fetchone()
-
-                if rows is not None:
-                    line_count = line_count + 1
-                    var_count = var_count + 1
-                    isOverlap = True
-                    otherChrom = rows[7]
-                    otherStart = rows[8]
-                    otherEnd = rows[9]
-                    fields[7] = fields[7] + ';' + str(table) + '=' + \
-                        str(isOverlap) + ';' + 'otherChrom=' + \
-                        str(otherChrom) + ';otherStart=' + \
-                        str(otherStart) + ';otherEnd=' + str(otherEnd)
-
-                fh_out.write('\t'.join(fields) + '\n')
-
-            linenum = linenum + 1
-        else:
-            fh_out.write(line + '\n')
-
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
-
-    conn.close()
-    fh.close()
-    fh_out.close()
-
-
-"""Searches Genes Databases and returns Genes/Cytobands 
-   with which SNP or INDEL overlaps
-"""
-def addOverlapWithRefGene(vcf, format='vcf', table='refGene', 
-    tmpextin='', tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
-
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-    colindex = 1
-    colindex2 = 12
-    name = 'name'
-    name2 = 'name2'
-    startName = 'txStart'
-    endName = 'txEnd'
-
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
-
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                if not chr.startswith("chr"):
-                    chr = "chr" + chr
-
-                pos = fields[inds[1]].strip()
-                isOverlap = False
-                
-                sql = 'select * from ' + table + ' where chrom="' + \
-                    str(chr) + '" AND (' + startName + ' <= ' + str(pos) + \
-                    ' AND ' + str(pos) + ' <= ' + endName +');'
-                overlapsWith = []
+                
+                sql = 'select * from ' + table + ' where chrom="' + \
+                    str(chr) + '" AND (' + startName + ' <= ' + str(pos) + \
+                    ' AND ' + str(pos) + ' <= ' + endName +');'
+                overlapsWith = []
                 cursor.execute(sql)
                 rows = cursor.fetchall()
 
@@ -1186,218 +1352,4 @@ def addOverlapWithRefGene(vcf, format='vcf', table='refGene',
     fh.close()
     fh_out.close()
 
-
-"""Method to find overlap with Cytoband table
-"""
-def addOverlapWithCytoband(vcf, format='vcf', table='cytoBand', 
-    tmpextin='', tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
-
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-    colindex = 12
-    startName = 'txStart'
-    endName = 'txEnd'
-
-    if (table == 'cytoBand'):
-        colindex = 3
-        startName = 'chromStart'
-        endName = 'chromEnd'
-
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
-
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                if not chr.startswith("chr"):
-                    chr = "chr" + chr
-
-                pos = fields[inds[1]].strip()
-                isOverlap = False
-                
-                sql = 'select * from ' + table + ' where chrom="' + \
-                    str(chr) + '" AND (' + startName + ' <= ' + str(pos) + \
-                    ' AND ' + str(pos) + ' <= ' + endName + ');'
-                overlapsWith = []
-                cursor.execute(sql)
-                rows = cursor.fetchall()
-
-                if (len(rows) > 0):
-                    line_count = line_count + 1
-                    for row in rows:
-                        var_count = var_count + 1
-                        overlapsWith.append(str(row[colindex]))
-                    overlapsWith = u.dedup(overlapsWith)
-                    cytoband = ';'.join([str(x) for x in overlapsWith])
-
-                    if str(fields[7]).endswith(";"):
-                        fields[7] = fields[7] + str(table) + '=' + str(cytoband)
-                    else:
-                        fields[7] = fields[7] + ';' + str(table) + '=' + str(cytoband)
-                fh_out.write('\t'.join(fields) + '\n')
-
-            linenum = linenum + 1
-        else:
-            fh_out.write(line + '\n')
-
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
-
-    conn.close()
-    fh.close()
-    fh_out.close()
-
-
-"""Method to find overlap with CNV tables
-"""
-def addOverlapWithCnvDatabase(vcf, format='vcf', table='dgv_Cnv', 
-    tmpextin='', tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
-
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
-
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                if not chr.startswith("chr"):
-                    chr = "chr" + chr
-
-                pos = fields[inds[1]].strip()
-                isOverlap = False
-                sql = 'select * from ' + table + ' where chrom="' + \
-                    str(chr) + '" AND (chromStart <= ' + str(pos) + \
-                    ' AND ' + str(pos) + ' <= chromEnd);'
-                cursor.execute(sql)
-                rows = cursor.fetchone()
-
-                if rows is not None:
-                    line_count = line_count + 1
-                    var_count = var_count + 1
-                    isOverlap = True
-                    if str(fields[7]).endswith(";"):
-                        fields[7] = fields[7] + str(table) + '=' + \
-                        str(isOverlap)
-                    else:
-                        fields[7] = fields[7] + ';' + str(table) + \
-                        '='+str(isOverlap)
-                fh_out.write('\t'.join(fields) + '\n')
-
-            linenum = linenum + 1
-        else:
-            fh_out.write(line + '\n')
-
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
-
-    conn.close()
-    fh.close()
-    fh_out.close()
-
-
-"""Method to find overlap with targetScanS tables
-"""
-def addOverlapWithMiRNA(vcf, format='vcf', table='targetScanS', 
-    tmpextin='', tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
-
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
-
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                if not chr.startswith("chr"):
-                    chr = "chr" + chr
-
-                pos = fields[inds[1]].strip()
-                sql = 'select * from ' + table + ' where chrom="' + \
-                    str(chr) + '" AND (chromStart <= ' + str(pos) + \
-                    ' AND ' + str(pos) + ' <= chromEnd);'
-                cursor.execute(sql)
-                rows = cursor.fetchone()
-
-                if rows is not None:
-                    line_count = line_count + 1
-                    var_count = var_count + 1
-                    t = str(rows[4]) + ',' +  str(rows[1]) + '_' + \
-                        str(rows[2]) + '_' + str(rows[3])
-                    t = 'miRNAsites=' + t.strip()
-                    if str(fields[7]).endswith(";"):
-                        fields[7] = fields[7] + t
-                    else:
-                        fields[7] = fields[7] + ';' + t
-                fh_out.write('\t'.join(fields) + '\n')
-
-            linenum = linenum + 1
-        else:
-            fh_out.write(line + '\n')
-
-    fh_log.write(f"In miRNAsites: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
-
-    conn.close()
-    fh.close()
-    fh_out.close()
-
-### EOF
\ No newline at end of file
+### EOF
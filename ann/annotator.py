@@ -1,12 +1,16 @@
 import uuid
+import shlex
 import shutil
 import subprocess
 import os
+import time
 import boto3
 from botocore.config import Config
 from botocore.exceptions import ClientError
 import json
 import configparser
+import fanout
+import reference
 
 # get ann configuration
 config = configparser.ConfigParser()
@@ -19,6 +23,9 @@ helper function
 # global variable
 queue_url = config['sqs']['sqsRequestsUrl']
 
+# reference snapshot watcher (see reference.py); None without a manifest
+watcher = None
+
 
 def s3_config():
     my_config = Config(
@@ -41,17 +48,113 @@ def s3_download_files(bucket_name, object_name, file_name):
     return True
 
 
-def submit_job(file_path, job_id, file_name, email):
+def job_env(version=None):
+    # environment of a job process: the current reference snapshot, or the
+    # snapshot of version for a chunk of a job started on it; jobs already
+    # running keep the snapshot they were launched with
+    snapshot = watcher.snapshot(version) if watcher is not None else None
+    if snapshot is None:
+        return None
+    env = dict(os.environ)
+    env.update(snapshot.env())
+    return env
+
+
+def submit_job(file_path, job_id, file_name, email, receipt_handle=None, options=None):
     # try to handle the error or launching the annotator
+    # run.py keeps the request message invisible while it works and deletes
+    # it on completion, so the job is redelivered if the runner dies
+    command = 'python {} {} {} {}'.format(config['ann']['AnnRunPath'], file_path, job_id, email)
+    if receipt_handle is not None or options:
+        command += ' ' + shlex.quote(receipt_handle or '-')
+    # optional job options (stages, regions) as a JSON object
+    if options:
+        command += ' ' + shlex.quote(json.dumps(options))
     try:
-        subprocess.Popen(
-            'python {} {} {} {}'.format(config['ann']['AnnRunPath'], file_path, job_id, email), shell=True)
+        subprocess.Popen(command, shell=True, env=job_env())
     except:
         return json.dumps({'code': 500, 'status': 'error', 'message': 'fail to launch the annotator'})
 
     return json.dumps({"code": 201, "data": {"job_id": job_id, "input_file": str(file_name)}})
 
 
+def submit_batch(batch):
+    # cohort mode: one run.py annotates the coalesced jobs together; the
+    # jobs are listed in a manifest next to their inputs
+    manifest_path = config['ann']['DataPath'] + 'batch-{}.json'.format(uuid.uuid4())
+    with open(manifest_path, 'w') as f:
+        json.dump(batch, f)
+    try:
+        subprocess.Popen('python {} --batch {}'.format(config['ann']['AnnRunPath'], shlex.quote(manifest_path)),
+                         shell=True, env=job_env())
+    except:
+        print("fail to launch the annotator for a batch of {} jobs".format(len(batch)))
+        return False
+
+    print("submit a batch of {} jobs".format(len(batch)))
+    for job in batch:
+        if not dynamo_update(config['dynamodb']['TableName'], job['job_id'], "RUNNING"):
+            print("fail to update the info of job {} in dynamo database".format(job['job_id']))
+    return True
+
+
+def submit_chunk(data, receipt_handle=None):
+    # chunk tasks of a fan-out job are annotated by fanout.py, which merges
+    # the job when the last chunk finishes; like run.py it keeps the request
+    # message invisible while it works and deletes it once the chunk is
+    # stored, so the chunk is redelivered if the process dies
+    command = 'python {} --task {}'.format(config['ann']['AnnPath'] + '/fanout.py', shlex.quote(json.dumps(data)))
+    if receipt_handle is not None:
+        command += ' --receipt-handle ' + shlex.quote(receipt_handle)
+    try:
+        subprocess.Popen(command, shell=True, env=job_env(data.get('reference_version')))
+    except:
+        return json.dumps({'code': 500, 'status': 'error', 'message': 'fail to launch the chunk annotator'}), False
+
+    data = {'id': data['parent_job_id'], 'chunk': data['chunk_index']}
+    if receipt_handle is not None:
+        data['message_owner'] = 'fanout.py'
+    return json.dumps({'code': 201, 'data': data}), True
+
+
+def input_size(bucket_name, object_name):
+    try:
+        my_config = s3_config()
+        s3 = boto3.client('s3', config=my_config)
+        return s3.head_object(Bucket=bucket_name, Key=object_name)['ContentLength']
+    except ClientError:
+        return None
+
+
+def split_job(data):
+    # publish the chunk tasks of a large job back to the request queue
+    region = config['aws']['AwsRegionName']
+    chunk_size = config.getint('fanout', 'ChunkMB', fallback=256) * 1024 * 1024
+    # the chunks run on the reference version of their job, whichever
+    # annotator picks them up
+    snapshot = watcher.snapshot() if watcher is not None else None
+    if snapshot is not None:
+        data = dict(data, reference_version=snapshot.version)
+    try:
+        chunks = fanout.split_job(data, fanout.S3Store(data['s3_inputs_bucket'], region),
+                                  fanout.SqsQueue(queue_url, region), chunk_size)
+    except ClientError:
+        return None
+    return chunks
+
+
+def job_status(table_name, job_id):
+    my_config = s3_config()
+    try:
+        dynamo = boto3.resource('dynamodb', config=my_config)
+        table = dynamo.Table(table_name)
+        item = table.get_item(Key={'job_id': job_id}).get('Item')
+    except ClientError:
+        print("Fail to read job_status from dynamo database")
+        return None
+    return item['job_status'] if item else None
+
+
 # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html#DynamoDB.Client.update_item
 def dynamo_update(table_name, job_id, state):
     my_config = s3_config()
@@ -117,7 +220,7 @@ def sqs_delete_messages(sqs, receipt_handle):
     return True
 
 
-def annotation(data):
+def annotation(data, receipt_handle=None, batch=None):
     # Extract job parameters from the request body
     bucket_name = data["s3_inputs_bucket"]
     object_name = data["s3_key_input_file"]
@@ -127,6 +230,29 @@ def annotation(data):
     if bucket_name is None or object_name is None:
         return json.dumps({'code': 400, 'status': 'error', 'message': 'no correct url parameters generated'}), False
 
+    # a chunk of a fan-out job; the parent job is already RUNNING
+    if 'parent_job_id' in data:
+        return submit_chunk(data, receipt_handle)
+
+    # a redelivered request: skip finished jobs; a RUNNING job's runner died,
+    # so run it again and let it resume from its checkpoint
+    status = job_status(config['dynamodb']['TableName'], job_id)
+    if status == 'COMPLETED':
+        print("job {} is already completed".format(job_id))
+        return json.dumps({'code': 200, 'data': {'id': job_id, 'input_file': object_name}}), True
+    resumed = (status == 'RUNNING')
+
+    # large inputs are split into chunk tasks that any annotator can run
+    threshold = config.getint('fanout', 'ThresholdMB', fallback=0) * 1024 * 1024
+    size = input_size(bucket_name, object_name) if threshold > 0 or batch is not None else None
+    if size is not None and size > threshold and not resumed:
+        chunks = split_job(data)
+        if chunks:
+            if not dynamo_update(config['dynamodb']['TableName'], job_id, "RUNNING"):
+                return json.dumps({'code': 500, 'status': 'error', 'message': 'fail to update the info in dynamo database'}), False
+            return json.dumps({'code': 201, 'data': {'id': job_id, 'input_file': object_name, 'chunks': chunks}}), True
+        print("fail to split the job; annotating it on this instance")
+
     # Get the input file s3 object and copy it to a local file
     data_path = config['ann']['DataPath']
     user_file = object_name.split('/')
@@ -137,30 +263,73 @@ def annotation(data):
     if not os.path.isdir(user_path):
         os.makedirs(user_path)
 
-    # download the input file from s3 to instance
+    # download the input file from s3 to instance; a resumed job keeps the
+    # copy its checkpoint refers to
     file_path = user_path + '/' + filename
-    if not s3_download_files(bucket_name, object_name, file_path):
+    if resumed and os.path.exists(file_path) and \
+            os.path.getsize(file_path) == input_size(bucket_name, object_name):
+        print("resume job {}".format(job_id))
+    elif not s3_download_files(bucket_name, object_name, file_path):
         return json.dumps({'code': 400, 'status': 'error', 'message': 'fail to download files'}), False
 
+    # job options chosen on the web form; a BED file of regions is
+    # downloaded next to the input
+    options = {}
+    for key in ('stages', 'genes', 'region_passthrough', 'filters'):
+        if data.get(key):
+            options[key] = data[key]
+    if data.get('s3_key_regions_file'):
+        options['bed'] = file_path + '.regions.bed'
+        if not s3_download_files(bucket_name, data['s3_key_regions_file'], options['bed']):
+            return json.dumps({'code': 400, 'status': 'error', 'message': 'fail to download the regions file'}), False
+
+    # cohort mode: small new jobs wait in the batch (see main); a resumed job
+    # runs on its own from its checkpoint
+    batch_limit = config.getint('cohort', 'MaxMB', fallback=64) * 1024 * 1024
+    if batch is not None and not resumed and size is not None and size <= batch_limit:
+        batch.append({'file_path': file_path, 'job_id': job_id, 'email': email,
+                      'receipt_handle': receipt_handle, 'options': options})
+        return json.dumps({'code': 202, 'data': {'id': job_id, 'input_file': object_name,
+                                                 'message_owner': 'run.py'}}), True
+
     # annotate the job
     print("submit job")
     submit_response = json.loads(submit_job(
-        file_path, job_id, object_name, email))
+        file_path, job_id, object_name, email, receipt_handle, options))
 
     # update the job_status of dynamo database from "PENDING" to "RUNNING"
-    if not dynamo_update(config['dynamodb']['TableName'], job_id, "RUNNING"):
+    if not resumed and not dynamo_update(config['dynamodb']['TableName'], job_id, "RUNNING"):
         return json.dumps({'code': 500, 'status': 'error', 'message': 'fail to update the info in dynamo database'}), False
 
     # fail to launch the annotator
     if submit_response['code'] == 500:
         return json.dumps({'code': 500, 'status': 'error', 'message': 'fail to launch the annotator'}), False
 
-    # successfully submission
+    # successfully submission; run.py now owns the request message
     else:
-        return json.dumps({'code': 201, 'data': {'id': job_id, 'input_file': object_name}}), True
+        return json.dumps({'code': 201, 'data': {'id': job_id, 'input_file': object_name,
+                                                 'message_owner': 'run.py'}}), True
+
+
+def handle_message(sqs, message, receipt_handle, batch=None):
+    annotation_res, bool_ann = annotation(message, receipt_handle, batch)
+    annotation_res = json.loads(annotation_res)
+    if not bool_ann:
+        print('Fail to successfully complete the annotation process with \ncode: {} \nerror: {}'.format(
+            annotation_res['code'], annotation_res['message']))
+
+    # run.py deletes the message of a job it runs once the job completes,
+    # fanout.py the message of a chunk once the chunk is stored
+    if bool_ann and annotation_res['data'].get('message_owner') in ('run.py', 'fanout.py'):
+        return
+
+    # delete message in queue
+    if not sqs_delete_messages(sqs, receipt_handle):
+        print("Fail to delete messages in sqs")
 
 
 def main():
+    global watcher
 
     # connect to sqs
     # https://boto3.amazonaws.com/v1/documentation/api/latest/guide/sqs.html
@@ -172,22 +341,36 @@ def main():
         print("check the status of sqs and restart the program!")
         return
 
+    # cohort mode: small jobs arriving within WindowSecs of the first one
+    # are annotated together, up to MaxJobs per batch (0 turns it off)
+    window = config.getint('cohort', 'WindowSecs', fallback=0)
+    max_jobs = config.getint('cohort', 'MaxJobs', fallback=50)
+
+    # versioned reference snapshots: new jobs run on the current snapshot of
+    # the manifest, reloaded in the background and swapped in when it changes
+    manifest = config.get('reference', 'Manifest', fallback='')
+    if manifest:
+        watcher = reference.Watcher(manifest, config.getint('reference', 'PollSecs', fallback=30))
+        watcher.reload()
+
     # keep retrieve message from the queue
     # # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html
     while True:
-        message, receipt_handle = sqs_poll_message(sqs)
-
-        if message is None and receipt_handle is None:
-            continue
-        annotation_res, bool_ann = annotation(message)
-        annotation_res = json.loads(annotation_res)
-        if not bool_ann:
-            print('Fail to successfully complete the annotation process with \ncode: {} \nerror: {}'.format(
-                annotation_res['code'], annotation_res['message']))
-
-        # delete message in queue
-        if not sqs_delete_messages(sqs, receipt_handle):
-            print("Fail to delete messages in sqs")
+        batch = [] if window > 0 else None
+        opened = None
+        while True:
+            if watcher is not None:
+                watcher.poll()
+            message, receipt_handle = sqs_poll_message(sqs)
+            if message is not None:
+                handle_message(sqs, message, receipt_handle, batch)
+            if not batch:
+                break
+            opened = opened or time.time()
+            if time.time() - opened >= window or len(batch) >= max_jobs:
+                break
+        if batch:
+            submit_batch(batch)
 
 
 if __name__ == "__main__":
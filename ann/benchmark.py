@@ -0,0 +1,431 @@
+# benchmark.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Offline end-to-end benchmark of driver.run
+#
+# Builds a small synthetic copy of every reference table used by the
+# annotation stages in a local SQLite database (picked up by
+# utils.db_connect through ANNOTATOR_SQLITE_DB), generates a synthetic VCF
+# and reports variants/sec, per-stage time and peak memory as JSON, so
+# successive runs can be compared for regressions:
+#
+#   python benchmark.py --records 20000 --chroms 1,2,X --out new.json \
+#       --baseline old.json
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+
+import file_utils as fu
+
+# Length of every synthetic chromosome and spacing of the synthetic genes
+CHROM_LENGTH = 2000000
+GENE_SPACING = 40000
+# One dbSNP site every DBSNP_SPACING bp on average
+DBSNP_SPACING = 400
+
+BASES = ['A', 'C', 'G', 'T']
+
+BIGREFGENE_COLUMNS = ['id INTEGER', 'CHR TEXT', 'start INTEGER',
+    '"end" INTEGER', 'haplotypeReference TEXT', 'haplotypeAlternate TEXT',
+    'name TEXT', 'name2 TEXT', 'transcriptStrand TEXT', 'positionType TEXT',
+    'frame TEXT', 'mrnaCoord TEXT', 'codonCoord TEXT', 'spliceDist TEXT',
+    'referenceCodon TEXT', 'referenceAA TEXT', 'variantCodon TEXT',
+    'variantAA TEXT', 'changesAA TEXT', 'functionalClass TEXT',
+    'codingCoordStr TEXT', 'proteinCoordStr TEXT', 'inCodingRegion TEXT',
+    'spliceInfo TEXT', 'uorfChange TEXT']
+
+INTERVAL_COLUMNS = ['bin INTEGER', 'chrom TEXT', 'chromStart INTEGER',
+    'chromEnd INTEGER', 'name TEXT']
+
+CNV_TABLES = ['dgv_Cnv', 'abParts_IG_T_CelReceptors', 'mcCarroll_Cnv',
+    'conrad_Cnv']
+
+TFBS_CHROMS = [str(c) for c in range(1, 23)] + ['X', 'Y']
+
+# Column layout of every reference table, matching the row indices that
+# annotate.py reads
+TABLES = {
+    'dbSNP': ['CHR TEXT', 'POS INTEGER', '"END" INTEGER', 'RSID TEXT',
+        'REF TEXT', 'ALT TEXT', 'INFO TEXT', 'MAF TEXT'],
+    'chrom_pos_equal_base': BIGREFGENE_COLUMNS,
+    'chrom_pos_equal_nobase': BIGREFGENE_COLUMNS,
+    'chrom_pos_unequal': BIGREFGENE_COLUMNS,
+    'refGene': ['bin INTEGER', 'name TEXT', 'chrom TEXT', 'strand TEXT',
+        'txStart INTEGER', 'txEnd INTEGER', 'cdsStart INTEGER',
+        'cdsEnd INTEGER', 'exonCount INTEGER', 'exonStarts BLOB',
+        'exonEnds BLOB', 'score INTEGER', 'name2 TEXT', 'cdsStartStat TEXT',
+        'cdsEndStat TEXT', 'exonFrames TEXT'],
+    'cpgIslandExt': ['chrom TEXT', 'chromStart INTEGER', 'chromEnd INTEGER',
+        'name TEXT'],
+    'cytoBand': ['chrom TEXT', 'chromStart INTEGER', 'chromEnd INTEGER',
+        'name TEXT', 'gieStain TEXT'],
+    'gadAll': ['chromosome TEXT', 'chromStart INTEGER', 'chromEnd INTEGER',
+        'geneSymbol TEXT'],
+    'gwasCatalog': ['bin INTEGER', 'chrom TEXT', 'chromStart INTEGER',
+        'chromEnd INTEGER', 'name TEXT', 'pubMedID TEXT', 'author TEXT',
+        'pubDate TEXT', 'journal TEXT', 'title TEXT', 'trait TEXT'],
+    'targetScanS': INTERVAL_COLUMNS + ['score INTEGER', 'strand TEXT'],
+    'hugo': ['bin INTEGER', 'chrom TEXT', 'chromStart INTEGER',
+        'chromEnd INTEGER', 'hgncId TEXT', 'symbol TEXT', 'geneName TEXT'],
+    'genomicSuperDups': INTERVAL_COLUMNS + ['score INTEGER', 'strand TEXT',
+        'otherChrom TEXT', 'otherStart INTEGER', 'otherEnd INTEGER'],
+}
+for table in CNV_TABLES:
+    TABLES[table] = INTERVAL_COLUMNS
+for c in TFBS_CHROMS:
+    TABLES['tfbsConsSites' + c] = INTERVAL_COLUMNS
+
+# Indexes mirroring the lookups of annotate.py
+INDEXES = [
+    'CREATE INDEX dbSNP_pos ON dbSNP (CHR, POS)',
+    'CREATE INDEX equal_base_pos ON chrom_pos_equal_base (CHR, start)',
+    'CREATE INDEX equal_nobase_pos ON chrom_pos_equal_nobase (CHR, start)',
+    'CREATE INDEX unequal_pos ON chrom_pos_unequal (CHR, start)',
+    'CREATE INDEX refGene_pos ON refGene (chrom, txStart)',
+    'CREATE INDEX cpgIslandExt_pos ON cpgIslandExt (chrom, chromStart)',
+    'CREATE INDEX cytoBand_pos ON cytoBand (chrom, chromStart)',
+    'CREATE INDEX gadAll_pos ON gadAll (chromosome, chromStart)',
+    'CREATE INDEX gwasCatalog_pos ON gwasCatalog (chrom, chromEnd)',
+    'CREATE INDEX targetScanS_pos ON targetScanS (chrom, chromStart)',
+    'CREATE INDEX hugo_pos ON hugo (chrom, chromStart)',
+    'CREATE INDEX genomicSuperDups_pos ON genomicSuperDups (chrom, chromStart)',
+] + ['CREATE INDEX {0}_pos ON {0} (chrom, chromStart)'.format(t)
+    for t in CNV_TABLES + ['tfbsConsSites' + c for c in TFBS_CHROMS]]
+
+
+def _other_base(rnd, base):
+    return rnd.choice([b for b in BASES if b != base])
+
+
+def _intervals(rnd, count, min_len, max_len):
+    intervals = []
+    for i in range(count):
+        start = rnd.randint(1, CHROM_LENGTH - max_len)
+        intervals.append((start, start + rnd.randint(min_len, max_len)))
+    return intervals
+
+
+def _insert(conn, table, rows):
+    if (len(rows) == 0):
+        return
+    marks = ','.join(['?'] * len(rows[0]))
+    conn.executemany('INSERT INTO ' + table + ' VALUES (' + marks + ')', rows)
+
+
+def _refseq_row(rnd, idx, chrom, pos, ref, alt, gene, strand, position_type,
+    end=None):
+    return (idx, chrom, pos, end or pos, ref, alt, 'NM_' + str(gene), 'GENE' +
+        str(gene), strand, position_type, str(rnd.randint(0, 2)),
+        str(rnd.randint(1, 5000)), str(rnd.randint(1, 1600)),
+        str(rnd.randint(-20, 20)), 'GCA', 'A', 'GTA', 'V', 'Y',
+        'missense', 'c.' + str(pos % 1000) + ref + '>' + alt,
+        'p.A' + str(pos % 300) + 'V', 'true', '', '')
+
+
+"""Builds the SQLite stand-in of the reference database
+   Returns the list of dbSNP sites (chrom, pos, ref, alt) it contains
+"""
+def build_reference_db(path, chroms, seed=1):
+    rnd = random.Random(seed)
+    fu.delete(path)
+    conn = sqlite3.connect(path)
+    for table, columns in TABLES.items():
+        conn.execute('CREATE TABLE ' + table + ' (' + ', '.join(columns) + ')')
+
+    sites = []
+    gene = 0
+    for c in chroms:
+        chrom = 'chr' + c
+        rows = {table: [] for table in TABLES}
+
+        # genes with exons, promoters (CpG islands) and bigRefGene records
+        genes = []
+        for g in range(CHROM_LENGTH // GENE_SPACING - 1):
+            gene = gene + 1
+            tx_start = g * GENE_SPACING + rnd.randint(1000, 5000)
+            tx_end = tx_start + rnd.randint(5000, 30000)
+            strand = rnd.choice(['+', '-'])
+            exon_count = rnd.randint(2, 8)
+            step = (tx_end - tx_start) // exon_count
+            exon_starts = [tx_start + e * step for e in range(exon_count)]
+            exon_ends = [s + step // 3 for s in exon_starts]
+            if (rnd.random() < 0.1):
+                cds_start = cds_end = tx_end
+            else:
+                cds_start = exon_starts[0] + step // 6
+                cds_end = exon_ends[-1] - step // 6
+            rows['refGene'].append((0, 'NM_' + str(gene), chrom, strand,
+                tx_start, tx_end, cds_start, cds_end, exon_count,
+                (','.join(map(str, exon_starts)) + ',').encode('utf-8'),
+                (','.join(map(str, exon_ends)) + ',').encode('utf-8'), 0,
+                'GENE' + str(gene), 'cmpl', 'cmpl', ''))
+            promoter = tx_start - 300 if strand == '+' else tx_end + 300
+            rows['cpgIslandExt'].append((chrom, promoter - 150, promoter + 150,
+                'CpG: ' + str(rnd.randint(10, 200))))
+            rows['hugo'].append((0, chrom, tx_start, tx_end,
+                'HGNC:' + str(gene), 'GENE' + str(gene), 'gene ' + str(gene)))
+            if (rnd.random() < 0.3):
+                rows['gadAll'].append((c, tx_start, tx_end, 'GENE' + str(gene)))
+            genes.append((tx_start, tx_end, strand, gene))
+
+        # known sites, some of them with bigRefGene and GWAS records
+        pos = 0
+        g = 0
+        while True:
+            pos = pos + rnd.randint(1, 2 * DBSNP_SPACING)
+            if (pos >= CHROM_LENGTH):
+                break
+            ref = rnd.choice(BASES)
+            alt = _other_base(rnd, ref)
+            rsid = 'rs' + str(len(sites) + 1)
+            maf = str(round(rnd.random() / 2, 4)) if rnd.random() < 0.7 else '.'
+            rows['dbSNP'].append((c, pos, pos, rsid, ref, alt, 'SNV', maf))
+            sites.append((chrom, pos, ref, alt))
+
+            while (g < len(genes) - 1 and genes[g][1] < pos):
+                g = g + 1
+            tx_start, tx_end, strand, gene_id = genes[g]
+            if (tx_start <= pos <= tx_end):
+                r = rnd.random()
+                if (r < 0.6):
+                    rows['chrom_pos_equal_base'].append(_refseq_row(rnd,
+                        len(rows['chrom_pos_equal_base']), c, pos, ref, alt,
+                        gene_id, strand, rnd.choice(['CDS', 'intron',
+                        'utr5', 'utr3'])))
+                elif (r < 0.8):
+                    rows['chrom_pos_equal_nobase'].append(_refseq_row(rnd,
+                        len(rows['chrom_pos_equal_nobase']), c, pos, '', '',
+                        gene_id, strand, 'intron'))
+            if (rnd.random() < 0.01):
+                rows['gwasCatalog'].append((0, chrom, pos - 1, pos, rsid,
+                    str(rnd.randint(10000000, 30000000)), 'Author',
+                    '2010-01-01', 'Journal', 'Title', 'Trait ' +
+                    str(rnd.randint(1, 50))))
+
+        for start, end in _intervals(rnd, 200, 50, 2000):
+            rows['chrom_pos_unequal'].append(_refseq_row(rnd,
+                len(rows['chrom_pos_unequal']), c, start, '', '',
+                rnd.randint(1, gene), '+', 'splice', end=end))
+
+        band = 0
+        for start in range(0, CHROM_LENGTH, 500000):
+            band = band + 1
+            rows['cytoBand'].append((chrom, start, start + 500000,
+                ('p' if start < CHROM_LENGTH // 2 else 'q') + str(band),
+                'gneg'))
+
+        for start, end in _intervals(rnd, 500, 8, 30):
+            rows['targetScanS'].append((0, chrom, start, end,
+                'GENE' + str(rnd.randint(1, gene)) + ':miR-' +
+                str(rnd.randint(1, 500)), 0, '+'))
+        for table in CNV_TABLES:
+            for start, end in _intervals(rnd, 100, 1000, 50000):
+                rows[table].append((0, chrom, start, end,
+                    table + '_' + str(start)))
+        for start, end in _intervals(rnd, 100, 1000, 20000):
+            other = rnd.choice(chroms)
+            other_start = rnd.randint(1, CHROM_LENGTH - 20000)
+            rows['genomicSuperDups'].append((0, chrom, start, end,
+                'chr' + other + ':' + str(other_start), 1000, '+',
+                'chr' + other, other_start, other_start + end - start))
+        if c in TFBS_CHROMS:
+            for start, end in _intervals(rnd, 2000, 10, 25):
+                rows['tfbsConsSites' + c].append((0, chrom, start, end,
+                    'V$TF' + str(rnd.randint(1, 300))))
+
+        for table in TABLES:
+            _insert(conn, table, rows[table])
+
+    for index in INDEXES:
+        conn.execute(index)
+    conn.commit()
+    conn.close()
+    return sites
+
+
+"""Writes a synthetic VCF
+   known_fraction of the records are dbSNP sites from the fixture, the rest
+   random positions; with sort=False the records are shuffled
+"""
+def make_vcf(path, records, chroms, sites, known_fraction=0.5, sort=True,
+    samples=1, seed=1):
+    rnd = random.Random(seed)
+    variants = []
+    for i in range(records):
+        if (len(sites) > 0 and rnd.random() < known_fraction):
+            variants.append(rnd.choice(sites))
+        else:
+            ref = rnd.choice(BASES)
+            variants.append(('chr' + rnd.choice(chroms),
+                rnd.randint(1, CHROM_LENGTH), ref, _other_base(rnd, ref)))
+
+    order = {'chr' + c: i for i, c in enumerate(chroms)}
+    if sort:
+        variants.sort(key=lambda v: (order[v[0]], v[1]))
+    else:
+        rnd.shuffle(variants)
+
+    names = ['SAMPLE' + str(s + 1) for s in range(samples)]
+    fh = open(path, 'w')
+    fh.write('##fileformat=VCFv4.0\n')
+    fh.write('##source=annotator-benchmark\n')
+    fh.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+    fh.write('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read Depth">\n')
+    fh.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t' +
+        '\t'.join(names) + '\n')
+    for chrom, pos, ref, alt in variants:
+        genotypes = '\t'.join([rnd.choice(['0/1', '1/1', '0/0']) + ':' +
+            str(rnd.randint(5, 80)) for s in range(samples)])
+        fh.write(chrom + '\t' + str(pos) + '\t.\t' + ref + '\t' + alt +
+            '\t' + str(rnd.randint(20, 99)) + '\tPASS\tDP=' +
+            str(rnd.randint(10, 500)) + '\tGT:DP\t' + genotypes + '\n')
+    fh.close()
+    return path
+
+
+"""Runs driver.run on a synthetic job and returns the benchmark result
+"""
+def run_benchmark(workdir, records=10000, chroms=['1', '2', 'X'], sort=True,
+    samples=1, known_fraction=0.5, seed=1, workers=1):
+    import driver
+
+    fu.mkdirp(workdir)
+    db_path = os.path.join(workdir, 'reference.db')
+    vcf = os.path.join(workdir, 'benchmark.vcf')
+
+    sites = build_reference_db(db_path, chroms, seed=seed)
+    make_vcf(vcf, records, chroms, sites, known_fraction=known_fraction,
+        sort=sort, samples=samples, seed=seed)
+    input_bytes = fu.fileSize(vcf)
+    os.environ['ANNOTATOR_SQLITE_DB'] = db_path
+
+    report = driver.run(vcf, 'vcf', workers=workers)
+
+    stages = {}
+    for stage in report['children']:
+        stages[stage['name']] = {
+            'wall_secs': stage['wall_secs'],
+            'cpu_secs': stage['cpu_secs'],
+            'db_queries': stage['db_queries'],
+            'alloc_blocks_per_record': stage['alloc_blocks_per_record'],
+        }
+
+    return {
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'params': {
+            'records': records,
+            'chroms': chroms,
+            'sorted': sort,
+            'samples': samples,
+            'known_fraction': known_fraction,
+            'seed': seed,
+            'workers': workers,
+            'input_bytes': input_bytes,
+        },
+        'wall_secs': report['wall_secs'],
+        'cpu_secs': report['cpu_secs'],
+        'variants_per_sec': round(records / max(report['wall_secs'], 1e-9), 1),
+        'db_queries': report['db_queries'],
+        'peak_rss_kb': report['peak_rss_kb'],
+        'stages': stages,
+    }
+
+
+"""Lists regressions of current against baseline beyond threshold
+   (a fraction, 0.1 = 10%); stages faster than min_secs are ignored as noise
+"""
+def compare(baseline, current, threshold=0.1, min_secs=0.05):
+    regressions = []
+    if (current['variants_per_sec'] <
+        baseline['variants_per_sec'] * (1 - threshold)):
+        regressions.append('variants/sec {} -> {}'.format(
+            baseline['variants_per_sec'], current['variants_per_sec']))
+    if (current['peak_rss_kb'] > baseline['peak_rss_kb'] * (1 + threshold)):
+        regressions.append('peak RSS {} KB -> {} KB'.format(
+            baseline['peak_rss_kb'], current['peak_rss_kb']))
+    for name, stage in current['stages'].items():
+        old = baseline['stages'].get(name)
+        if (old is None or stage['wall_secs'] < min_secs):
+            continue
+        if (stage['wall_secs'] > old['wall_secs'] * (1 + threshold)):
+            regressions.append('{} {:.3f}s -> {:.3f}s'.format(name,
+                old['wall_secs'], stage['wall_secs']))
+    return regressions
+
+
+def print_result(result):
+    print(f"Variants/sec: {result['variants_per_sec']}")
+    print(f"Wall time: {result['wall_secs']:.2f} s, " +
+        f"CPU time: {result['cpu_secs']:.2f} s, " +
+        f"peak RSS: {result['peak_rss_kb']} KB, " +
+        f"DB queries: {result['db_queries']}")
+    for name, stage in result['stages'].items():
+        blocks = stage.get('alloc_blocks_per_record')
+        print(f"  {name:<35} {stage['wall_secs']:>9.3f} s " +
+            f"{stage['db_queries']:>9} queries" +
+            (f" {blocks:>9} blocks/record" if blocks is not None else ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Offline end-to-end annotation benchmark')
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--chroms', default='1,2,X',
+        help='comma separated chromosomes, without "chr"')
+    parser.add_argument('--unsorted', action='store_true',
+        help='shuffle the records of the synthetic VCF')
+    parser.add_argument('--samples', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1,
+        help='worker processes (byte-range parallel mode above 1)')
+    parser.add_argument('--known-fraction', type=float, default=0.5,
+        help='fraction of records placed on known dbSNP sites')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', default=None,
+        help='directory for the fixture and job files (default: temporary)')
+    parser.add_argument('--out', default=None, help='write the result JSON')
+    parser.add_argument('--baseline', default=None,
+        help='result JSON of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='annbench-')
+    result = run_benchmark(workdir, records=args.records,
+        chroms=args.chroms.split(','), sort=not args.unsorted,
+        samples=args.samples, known_fraction=args.known_fraction,
+        seed=args.seed, workers=args.workers)
+    print_result(result)
+
+    if args.out:
+        fh = open(args.out, 'w')
+        json.dump(result, fh, indent=2)
+        fh.close()
+
+    if args.baseline:
+        fh = open(args.baseline)
+        baseline = json.load(fh)
+        fh.close()
+        regressions = compare(baseline, result, threshold=args.threshold)
+        for r in regressions:
+            print(f"REGRESSION: {r}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+### EOF
@@ -0,0 +1,263 @@
+# bulk.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Bulk join execution of the interval stages
+#
+# Instead of one query per variant and table, the positions of a chunk
+# are loaded into a session temporary table (one executemany) and every
+# interval table is joined with it once; the joined rows are streamed back
+# and grouped by variant. The join keeps the sites table as the outer loop
+# (CROSS JOIN in SQLite, STRAIGHT_JOIN in MySQL), so the reference rows of
+# a variant are found through the same index, in the same order, as by its
+# own query. Stages without joinQueries() (dbSNP, BigRefGene) still look
+# up one variant at a time.
+#
+# FusedQuery goes one step further: the joins of all the stages of a job
+# are sent as one UNION ALL query per chunk, each branch tagged with its
+# number, and the rows are dispatched to the stages by tag. Its common
+# table expression needs MySQL 8.0 (MariaDB 10.2); on an older server the
+# fused engine falls back to BulkJoin (fused_engine()). The ORDER BY of
+# a branch does not order the union, so the rows of stages with an order
+# (Stage.order) are sorted after they are fetched.
+#
+# An engine sees a chunk through begin(stages, records) - the records that
+# need lookups - then rows(stage, records) for every stage, and end();
+# close() releases it at the end of the job.
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import re
+
+# Session table of the positions of a chunk
+SITES = 'ann_sites'
+
+# Name of the sites table inside a fused query: MySQL cannot open a
+# temporary table twice in one query, so it is read once into a common
+# table expression
+FUSED_SITES = 'fused_sites'
+
+CREATE = {
+    'sqlite': 'create temp table if not exists ' + SITES +
+        ' (idx integer, chrom text, bare text, pos integer);',
+    'mysql': 'create temporary table if not exists ' + SITES +
+        ' (idx int not null, chrom varchar(64) not null, ' +
+        'bare varchar(64) not null, pos int not null);',
+}
+JOIN = {
+    'sqlite': 'cross join',
+    'mysql': 'straight_join',
+}
+PLACEHOLDER = {
+    'sqlite': '?',
+    'mysql': '%s',
+}
+
+# First server versions with common table expressions, by server
+CTE_VERSIONS = {
+    'mysql': (8, 0),
+    'mariadb': (10, 2),
+}
+
+# Joined rows fetched per round trip
+FETCH_ROWS = 10000
+
+# MySQL column types (pymysql FIELD_TYPE) of the values a UNION ALL may
+# return converted to the type shared by all branches
+MYSQL_INTEGERS = [1, 2, 3, 8, 9, 13, 16]
+MYSQL_FLOATS = [4, 5]
+MYSQL_BLOBS = [249, 250, 251, 252]
+MYSQL_STRINGS = [15, 253, 254]
+
+
+"""Looks up the rows of a list of records for a stage with one join per
+   reference table, on the connection of cursor
+"""
+class BulkJoin(object):
+    name = 'bulk'
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.dialect = getattr(cursor, 'dialect', 'mysql')
+        self.join = JOIN[self.dialect]
+        self.loaded = None
+        cursor.execute(CREATE[self.dialect])
+
+    def begin(self, stages, records):
+        pass
+
+    def end(self):
+        pass
+
+    def close(self):
+        pass
+
+    """Fills the sites table with records, unless it already holds them
+       (the stages of a chunk usually see the same records)
+    """
+    def load(self, records):
+        sites = [(i, rec.ucsc_chrom(), rec.bare_chrom(), rec.pos)
+            for i, rec in enumerate(records)]
+        if (sites == self.loaded):
+            return
+        mark = PLACEHOLDER[self.dialect]
+        self.cursor.execute('delete from ' + SITES + ';')
+        self.cursor.executemany('insert into ' + SITES +
+            ' (idx, chrom, bare, pos) values (' + ', '.join([mark] * 4) +
+            ');', sites)
+        self.loaded = sites
+
+    """Rows of every record, in the order of records, or None if the
+       stage cannot be joined
+    """
+    def rows(self, stage, records):
+        queries = stage.joinQueries(SITES, self.join)
+        if queries is None:
+            return None
+        self.load(records)
+        found = [[] for rec in records]
+        for sql in queries:
+            self.cursor.execute(sql)
+            rows = self.cursor.fetchmany(FETCH_ROWS)
+            while (len(rows) > 0):
+                for row in rows:
+                    found[row[0]].append(tuple(row[1:]))
+                rows = self.cursor.fetchmany(FETCH_ROWS)
+        return found
+
+
+"""Value of a fused row back in the type of its own column (MySQL)
+"""
+def restore(value, type_code):
+    if (value is None or type_code is None):
+        return value
+    if (type_code in MYSQL_INTEGERS and not isinstance(value, int)):
+        return int(value)
+    if (type_code in MYSQL_FLOATS and not isinstance(value, float)):
+        return float(value)
+    if (type_code in MYSQL_BLOBS and isinstance(value, str)):
+        return value.encode('utf-8')
+    if (type_code in MYSQL_STRINGS and isinstance(value, bytes)):
+        return value.decode('utf-8')
+    return value
+
+
+"""Looks up the rows of all joinable stages of a chunk with one UNION ALL
+   query
+
+   Branches have different numbers of columns, so each is padded with
+   NULLs to the widest one. The width and column types of a branch are
+   read once from an empty result of its join. SQLite keeps the type of
+   every value; MySQL gives a UNION column one type, so the values are
+   converted back to the types of their own table (restore()).
+"""
+class FusedQuery(BulkJoin):
+    name = 'fused'
+
+    def __init__(self, cursor):
+        BulkJoin.__init__(self, cursor)
+        self.columns = {}
+        self.names = {}
+        self.fetched = {}
+
+    """Column types of the result of a join query (None for SQLite)
+    """
+    def describe(self, sql):
+        if sql not in self.columns:
+            self.cursor.execute('select * from (' + sql.rstrip(';') +
+                ') j limit 0;')
+            self.cursor.fetchall()
+            self.columns[sql] = [column[1] if self.dialect == 'mysql'
+                else None for column in self.cursor.description]
+            self.names[sql] = [column[0] for column in
+                self.cursor.description]
+        return self.columns[sql]
+
+    """Sorts the fetched rows of each record of stage by its order
+       columns (NULLs first, as in an ORDER BY); sql is its join query
+    """
+    def sort(self, stage, sql):
+        # the fetched rows no longer have the idx column
+        names = self.names[sql][1:]
+        positions = [names.index(column) for column in stage.order]
+        for rows in self.fetched[stage.name].values():
+            rows.sort(key=lambda row: [(row[i] is not None, row[i])
+                for i in positions])
+
+    def begin(self, stages, records):
+        self.fetched = {}
+        branches = []
+        ordered = []
+        for stage in stages:
+            queries = stage.joinQueries(SITES, self.join)
+            if queries is None:
+                continue
+            for sql, fused in zip(queries, stage.joinQueries(FUSED_SITES,
+                self.join)):
+                branches.append((stage, fused, self.describe(sql)))
+                if stage.order:
+                    ordered.append((stage, sql))
+            self.fetched[stage.name] = dict([(id(rec), [])
+                for rec in records])
+        if (len(branches) == 0 or len(records) == 0):
+            return
+
+        self.load(records)
+        width = max([len(types) for stage, sql, types in branches])
+        union = 'with ' + FUSED_SITES + ' as (select idx, chrom, bare, ' + \
+            'pos from ' + SITES + ') ' + ' union all '.join(['select ' +
+            str(i) + ' as part, j.*' + ', NULL' * (width - len(types)) +
+            ' from (' + sql.rstrip(';') + ') j'
+            for i, (stage, sql, types) in enumerate(branches)]) + ';'
+        self.cursor.execute(union)
+        rows = self.cursor.fetchmany(FETCH_ROWS)
+        while (len(rows) > 0):
+            for row in rows:
+                stage, sql, types = branches[row[0]]
+                values = tuple([restore(value, type_code) for value, type_code
+                    in zip(row[1:1 + len(types)], types)])
+                self.fetched[stage.name][id(records[values[0]])].append(
+                    values[1:])
+            rows = self.cursor.fetchmany(FETCH_ROWS)
+        for stage, sql in ordered:
+            self.sort(stage, sql)
+
+    """Rows fetched by begin(); None for a record that was not fetched
+       (it is looked up on its own) or a stage that cannot be joined
+    """
+    def rows(self, stage, records):
+        fetched = self.fetched.get(stage.name)
+        if fetched is None:
+            return None
+        return [fetched.get(id(rec)) for rec in records]
+
+    def end(self):
+        self.fetched = {}
+
+
+"""Server ("mysql" or "mariadb") and (major, minor) version of the MySQL
+   connection of cursor
+"""
+def server_version(cursor):
+    cursor.execute('select version();')
+    version = str(cursor.fetchall()[0][0])
+    numbers = [int(number) for number in re.findall(r'[0-9]+', version)[:2]]
+    server = 'mariadb' if 'mariadb' in version.lower() else 'mysql'
+    return server, tuple(numbers + [0] * (2 - len(numbers)))
+
+
+"""FusedQuery on the connection of cursor, or BulkJoin if the server is
+   too old for its common table expression (MySQL before 8.0)
+"""
+def fused_engine(cursor):
+    if (getattr(cursor, 'dialect', 'mysql') == 'mysql'):
+        server, version = server_version(cursor)
+        if (version < CTE_VERSIONS[server]):
+            print(f"{server} {'.'.join(map(str, version))} has no common " +
+                "table expressions; using the bulk engine instead of fused")
+            return BulkJoin(cursor)
+    return FusedQuery(cursor)
+
+### EOF
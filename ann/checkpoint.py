@@ -0,0 +1,113 @@
+# checkpoint.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Resume points of long annotation jobs
+#
+# While a job runs, a small JSON manifest next to its output records how
+# far the input has been annotated: the input and output byte offsets at a
+# buffer boundary, the number of records and the stage counts so far. The
+# output is flushed and fsync'ed before the manifest is replaced, so the
+# manifest never points past data that is on disk. A rerun of the same job
+# truncates the output to the recorded offset and continues from there.
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+import json
+import time
+import file_utils as fu
+
+# Default seconds between two checkpoints of a running job
+CHECKPOINT_SECS = 60
+
+
+"""Manifest of one output file (<outfile>.ckpt.json)
+
+   key identifies the work the offsets refer to (input size, stage names,
+   byte range); a manifest written for a different key is ignored.
+   interval is the minimum number of seconds between two saves.
+"""
+class Checkpoint(object):
+    def __init__(self, outfile, key, interval=CHECKPOINT_SECS):
+        self.outfile = outfile
+        self.filename = outfile + '.ckpt.json'
+        self.key = key
+        self.interval = interval
+        self.last = time.time()
+
+    """The saved state, or None if there is nothing valid to resume
+    """
+    def load(self):
+        if not fu.isExist(self.filename):
+            return None
+        try:
+            fh = open(self.filename)
+            state = json.load(fh)
+            fh.close()
+        except (OSError, ValueError):
+            print(f"Ignoring unreadable checkpoint {self.filename}")
+            return None
+        if (state.get('key') != self.key):
+            print(f"Ignoring checkpoint {self.filename} of another input")
+            return None
+        if not (fu.isExist(self.outfile) and
+            fu.fileSize(self.outfile) >= state['output_offset']):
+            print(f"Ignoring checkpoint {self.filename}: output is missing")
+            return None
+        return state
+
+    """Reopens the output for a resumed run: truncated to the checkpoint
+       and positioned at its end. Without a state it is created empty.
+    """
+    def open_output(self, state):
+        if state is None:
+            return open(self.outfile, 'wb')
+        fh_out = open(self.outfile, 'r+b')
+        fh_out.truncate(state['output_offset'])
+        fh_out.seek(state['output_offset'])
+        return fh_out
+
+    def due(self):
+        return (time.time() - self.last >= self.interval)
+
+    """Records that the input is annotated up to input_offset
+       fh_out is flushed and synced first; the manifest is replaced
+       atomically.
+    """
+    def save(self, fh_out, input_offset, records, stages, done=False):
+        fh_out.flush()
+        os.fsync(fh_out.fileno())
+        state = {
+            'key': self.key,
+            'input_offset': input_offset,
+            'output_offset': fh_out.tell(),
+            'records': records,
+            'counts': [stage.counts for stage in stages],
+            'done': done,
+        }
+        tmp = self.filename + '.tmp'
+        fh = open(tmp, 'w')
+        json.dump(state, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+        fh.close()
+        os.replace(tmp, self.filename)
+        self.last = time.time()
+
+    def remove(self):
+        fu.delete(self.filename)
+
+
+"""Restores the stage counts of a saved state; returns its record count
+"""
+def restore(state, stages):
+    for stage, counts in zip(stages, state['counts']):
+        stage.merge(counts)
+    print(f"Resuming from byte {state['input_offset']} " +
+        f"({state['records']} records done)")
+    return state['records']
+
+### EOF
@@ -0,0 +1,136 @@
+# dedup.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Within-job deduplication of variant sites
+#
+# Multi-sample and concatenated VCFs repeat the same (CHROM, POS, REF,
+# ALT) many times. SiteCache runs a stage once per site and keeps what it
+# did to the record - the INFO items it appended, the ID it set and its
+# counter increments - so the other occurrences of the site are annotated
+# by replaying that fragment, without a database lookup. Output and
+# count log are the same as without the cache. Jobs running the same
+# stages can share one cache (driver.run_batch). With a precomputed
+# sitestore.SiteStore, the fragments of known sites are read from the store
+# instead of the database.
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+# Sites kept per job; the oldest sites are evicted first
+MAX_SITES = 1000000
+
+
+"""Site of a record, taken before any stage runs: dbSNP annotates records
+   with an empty INFO differently, so that is part of the site
+"""
+def site_key(rec):
+    return (rec.chrom, rec.pos, rec.ref, rec.alt, len(rec.info) == 0)
+
+
+"""Cache for one job, or None if max_sites is 0 (deduplication is off,
+   and so is the site store)
+"""
+def new_cache(max_sites=MAX_SITES, store=None):
+    if (max_sites > 0):
+        return SiteCache(max_sites, store)
+    return None
+
+
+"""Per-job map from site to the annotation fragments of each stage
+"""
+class SiteCache(object):
+    def __init__(self, max_sites=MAX_SITES, store=None):
+        self.max_sites = max_sites
+        self.store = store
+        self.sites = {}
+        self.records = 0
+        self.unique = 0
+        self.stored = 0
+
+    """Counts a record of the site; True if the site was seen before or is
+       in the store. unique counts the sites annotated from the database,
+       so an evicted site seen again is counted again.
+    """
+    def seen(self, site):
+        self.records = self.records + 1
+        if site in self.sites:
+            return True
+        fragments = None
+        if (self.store is not None and not site[4]):
+            fragments = self.store.get(site[0], site[1], site[2], site[3])
+        if fragments is not None:
+            self.stored = self.stored + 1
+        else:
+            self.unique = self.unique + 1
+        self.sites[site] = fragments or {}
+        if (len(self.sites) > self.max_sites):
+            del self.sites[next(iter(self.sites))]
+        return (fragments is not None)
+
+    """Annotates rec with the fragment of stage kept for the site, if any
+       Returns True if it was replayed.
+    """
+    def replay(self, stage, rec, site):
+        fragment = self.sites.get(site, {}).get(stage.name)
+        if fragment is None:
+            return False
+        items, id, counts = fragment
+        rec.extend(items)
+        if id is not None:
+            rec.id = id
+        stage.merge(counts)
+        return True
+
+    """Annotates rec with stage; fragments are kept under the stage name
+       rows are the rows of the record's lookup if they were already
+       fetched (bulk.py). Returns True if the fragment was replayed from
+       the cache.
+    """
+    def annotate(self, stage, cursor, rec, site, rows=None):
+        if self.replay(stage, rec, site):
+            return True
+
+        fragments = self.sites.get(site)
+        before = dict(stage.counts)
+        start = len(rec.info)
+        old_id = rec.id
+        if rows is None:
+            stage.annotate(cursor, rec)
+        else:
+            stage.found(cursor, rec, rows)
+        if fragments is None:
+            return False
+        counts = {}
+        for key, value in stage.counts.items():
+            if (value != before.get(key, 0)):
+                counts[key] = value - before.get(key, 0)
+        fragments[stage.name] = (rec.info[start:],
+            rec.id if rec.id is not old_id else None, counts)
+        return False
+
+    """Adds the record counts of another cache's report (a parallel worker)
+    """
+    def merge(self, report):
+        if report is not None:
+            self.records = self.records + report['records']
+            self.unique = self.unique + report['unique_sites']
+            self.stored = self.stored + report.get('store_sites', 0)
+
+    def report(self):
+        return summary(self.records, self.unique, self.stored)
+
+
+"""Dedup report of records annotated from unique database lookups and
+   sites read from the site store
+"""
+def summary(records, unique, stored=0):
+    return {
+        'records': records,
+        'unique_sites': unique,
+        'store_sites': stored,
+        'dedup_ratio': round(records / unique, 3) if unique else None,
+    }
+
+### EOF
@@ -12,110 +12,515 @@ __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 
 import sys
 import os
-import file_utils as fu
+import mmap
+import shutil
+import multiprocessing
 import annotate as ann
+import bulk
+import checkpoint as ckpt
+import dedup as dd
+import file_utils as fu
+import filters as flt
+import perf
+import planner
+import pool
+import reference
+import regions as rg
+import sidecar
+import sitestore
+import utils as u
 
-def run(infile, format):
+"""Annotation stages in pipeline order: (name, stage class, keyword arguments)
+"""
+STAGES = [
+    ('dbSNP', ann.DbSnpStage, {}),
+    ('BigRefGene', ann.BigRefGeneStage, {}),
+    ('refGene', ann.GeneStage, {'table': 'refGene', 'promoter_offset': 500}),
+    ('cytoBand', ann.CytobandStage, {'table': 'cytoBand'}),
+    ('gadAll', ann.GadAllStage, {'table': 'gadAll'}),
+    ('gwasCatalog', ann.GwasCatalogStage, {'table': 'gwasCatalog'}),
+    ('miRNA', ann.MiRNAStage, {'table': 'targetScanS'}),
+    ('HUGO Gene Nomenclature Committee', ann.HugoStage, {'table': 'hugo'}),
+    ('dgv_Cnv', ann.CnvStage, {'table': 'dgv_Cnv'}),
+    ('abParts_IG_T_CelReceptors', ann.CnvStage,
+        {'table': 'abParts_IG_T_CelReceptors'}),
+    ('mcCarroll_Cnv', ann.CnvStage, {'table': 'mcCarroll_Cnv'}),
+    ('conrad_Cnv', ann.CnvStage, {'table': 'conrad_Cnv'}),
+    ('genomicSuperDups', ann.GenomicSuperDupsStage,
+        {'table': 'genomicSuperDups'}),
+    ('tfbsConsSites', ann.TfbsConsSitesStage, {'table': 'tfbsConsSites'}),
+]
+
+
+# Lookup engines: "variant" runs one query per variant and table, "bulk"
+# joins the interval tables with a chunk's positions and "fused" sends
+# those joins as one query per chunk (bulk.py); "pool" keeps several
+# per-variant queries in flight on pooled connections (pool.py). "auto"
+# picks one of them for each stage by the size of the job (planner.py).
+ENGINES = {
+    'variant': None,
+    'bulk': bulk.BulkJoin,
+    'fused': bulk.fused_engine,
+    'pool': pool.PooledLookup,
+}
+
+
+# Stages whose results another stage reads: refGene counts variants by the
+# positionType BigRefGene adds
+REQUIRES = {
+    'refGene': ['BigRefGene'],
+}
+
+
+"""Names of the stages to run for a requested list, in pipeline order
+   None selects all stages; required stages are added. Raises ValueError
+   for unknown names.
+"""
+def select_stages(names=None):
+    if names is None:
+        return [name for name, stage, kwargs in STAGES]
+    known = [name for name, stage, kwargs in STAGES]
+    unknown = [name for name in names if name not in known]
+    if (len(unknown) > 0):
+        raise ValueError('Unknown stages: ' + ', '.join(unknown))
+
+    selected = set(names)
+    for name in names:
+        selected.update(REQUIRES.get(name, []))
+    return [name for name in known if name in selected]
+
+
+"""New instances of the stages named in names (all stages by default),
+   in pipeline order and with zeroed counts
+   With regions (a regions.RegionSet) a RegionStage runs first; with
+   passthrough the records outside the regions are written unannotated
+   instead of being dropped.
+
+   filters are filter expressions (see filters.py); each one runs right
+   after the last stage writing its key, or before all stages for keys of
+   the input. Raises ValueError for an invalid expression.
+"""
+def build_stages(names=None, regions=None, passthrough=False, filters=None):
+    selected = select_stages(names)
+    stages = [stage(name=name, **kwargs) for name, stage, kwargs in STAGES
+        if name in selected]
+
+    placed = [[] for stage in stages]
+    first = []
+    for text in filters or []:
+        predicate = flt.parse(text)
+        owners = [i for i, stage in enumerate(stages)
+            if predicate.key in stage.infoKeys()]
+        target = placed[owners[-1]] if owners else first
+        target.append(ann.PredicateStage(predicate))
+
+    ordered = first
+    for stage, after in zip(stages, placed):
+        ordered = ordered + [stage] + after
+    if regions is not None:
+        ordered.insert(0, ann.RegionStage(regions=regions,
+            passthrough=passthrough))
+    return ordered
 
-    print("Running . . .")
 
-    ann.getSnpsFromDbSnp(vcf=infile, format='vcf', tmpextin='', 
-        tmpextout='.1')
-    print("dbSNP - done.")
-    tmpextin = 1
-    tmpextout = 2
-
-    ann.getBigRefGene(vcf=infile, format='vcf', tmpextin='.' + str(tmpextin),
-        tmpextout='.' + str(tmpextout))
-    print("BigRefGene - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.getGenes(vcf=infile, format='vcf', table='refGene', 
-        promoter_offset=500, tmpextin='.' + str(tmpextin), 
-        tmpextout='.' + str(tmpextout))
-    print("BigRefGene - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCytoband(vcf=infile, format='vcf', table='cytoBand', 
-        tmpextin='.' + str(tmpextin), tmpextout='.' + str(tmpextout))
-    print("Cytoband - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithGadAll(vcf=infile, format='vcf', table='gadAll', 
-        tmpextin='.' + str(tmpextin), tmpextout='.' + str(tmpextout))
-    print("gadAll - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithGwasCatalog(vcf=infile, format='vcf', 
-        table='gwasCatalog', tmpextin='.' + str(tmpextin), 
-        tmpextout='.' + str(tmpextout))
-    print("GwasCatalog - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithMiRNA(vcf=infile, format='vcf', table='targetScanS', 
-        tmpextin='.' + str(tmpextin), tmpextout='.' + str(tmpextout))
-    print("miRNA - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWitHUGOGeneNomenclature(vcf=infile, format='vcf', 
-        table='hugo', tmpextin='.' + str(tmpextin), 
-        tmpextout='.' + str(tmpextout))
-    print("HUGO Gene Nomenclature Committee - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCnvDatabase(vcf=infile, format='vcf', table='dgv_Cnv', 
-        tmpextin='.' + str(tmpextin), tmpextout='.' + str(tmpextout))
-    print("dgv_Cnv - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCnvDatabase(vcf=infile, format='vcf', 
-        table='abParts_IG_T_CelReceptors', tmpextin='.' + str(tmpextin), 
-        tmpextout='.' + str(tmpextout))
-    print("abParts_IG_T_CelReceptors - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCnvDatabase(vcf=infile, format='vcf', 
-        table='mcCarroll_Cnv', tmpextin='.' + str(tmpextin), 
-        tmpextout='.' + str(tmpextout))
-    print("mcCarroll_Cnv - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCnvDatabase(vcf=infile, format='vcf', 
-        table='conrad_Cnv', tmpextin='.' + str(tmpextin), 
-        tmpextout='.' + str(tmpextout))
-    print("conrad_Cnv - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithGenomicSuperDups(vcf=infile, format='vcf', 
-        table='genomicSuperDups', tmpextin='.' + str(tmpextin),
-        tmpextout='.' + str(tmpextout))
-    print("genomicSuperDups - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithTfbsConsSites(vcf=infile, table='tfbsConsSites',
-        tmpextin='.' + str(tmpextin), tmpextout='.' + str(tmpextout))
-    print("addOverlapWithTfbsConsSites - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ## Cleanup
-    for i in range(1, tmpextin):
+"""Lookup engine called name on the connection of cursor; None for the
+   per-variant queries. name may also be the engines of a plan, {stage
+   name: engine name}. Raises ValueError for an unknown engine.
+"""
+def new_engine(name, cursor):
+    if isinstance(name, dict):
+        engines = dict([(engine, new_engine(engine, cursor))
+            for engine in set(name.values())])
+        if all([engine is None for engine in engines.values()]):
+            return None
+        return planner.StageEngines(name, engines)
+    if name not in ENGINES:
+        raise ValueError(f"Unknown engine {name}; engines: auto, " +
+            ', '.join(ENGINES))
+    if ENGINES[name] is None:
+        return None
+    return ENGINES[name](cursor)
+
+
+"""Plan of the engines of stages (engine "auto") for a job of size
+   (planner.estimate()); the site store is only considered if there is
+   one and the dedup cache is on. The plan is printed.
+"""
+def plan_job(size, stages, workers=1, site_store=None,
+    dedup_max_sites=dd.MAX_SITES):
+    plan = planner.choose(size, stages, workers,
+        site_store if dedup_max_sites > 0 else None)
+    for line in planner.describe(plan):
+        print(line)
+    return plan
+
+
+"""RegionSet of a BED file and/or a gene list, or None if neither is given
+"""
+def load_regions(bed=None, genes=None):
+    if not bed and not genes:
+        return None
+    regions = rg.RegionSet()
+    if bed:
+        regions = rg.from_bed(bed)
+    if genes:
+        conn = u.db_connect()
+        for chrom, intervals in rg.from_genes(conn.cursor(),
+            genes).intervals.items():
+            for start, end in intervals:
+                regions.add(chrom, start, end)
+        conn.close()
+    regions.finish()
+    print(f"Restricted to {regions.size()} regions")
+    return regions
+
+
+"""Offset of the first data line of a memory-mapped VCF
+"""
+def header_end(mm):
+    i = 0
+    while (i < len(mm) and (ann.isHeader(mm, i) or mm[i] in b'\r\n')):
+        j = mm.find(b'\n', i)
+        i = len(mm) if j < 0 else j + 1
+    return i
+
+
+"""Splits the bytes [start, len(mm)) into at most workers ranges that
+   begin at line boundaries
+"""
+def split_ranges(mm, start, workers):
+    end = len(mm)
+    bounds = [start]
+    for i in range(1, workers):
+        j = mm.find(b'\n', start + (end - start) * i // workers)
+        bound = end if j < 0 else j + 1
+        if (bounds[-1] < bound < end):
+            bounds.append(bound)
+    if (start < end):
+        bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+"""Checkpoint key of an input: its size, the stages run over it and the
+   reference version they run on
+"""
+def checkpoint_key(infile, stages, start=None, end=None):
+    key = {'input_size': fu.fileSize(infile),
+        'stages': [stage.name for stage in stages]}
+    if reference.version() is not None:
+        key['reference'] = reference.version()
+    if start is not None:
+        key['range'] = [start, end]
+    return key
+
+
+"""Removes the temp files <infile>.1, <infile>.2 ... left behind by an
+   interrupted run of the staged (one file per stage) pipeline
+"""
+def remove_temp_files(infile):
+    i = 1
+    while fu.isExist(infile + '.' + str(i)):
         fu.delete(infile + '.' + str(i))
+        i = i + 1
+
+
+"""Worker: annotates one byte range of infile into outfile with its own
+   stages and database connection; returns the counts and reports to merge
+   An optional fifth argument is a dict of job options: checkpoint_secs,
+   stages (names), regions, passthrough, filters, dedup_max_sites,
+   site_store and engine, as taken by run(); engine "auto" plans the
+   range on its own (fan-out chunks).
+"""
+def annotate_range(args):
+    infile, start, end, outfile = args[:4]
+    options = args[4] if len(args) > 4 else {}
+    checkpoint_secs = options.get('checkpoint_secs', 0)
+    u.reset_query_stats()
+    profiler = perf.Profiler('range')
+    profiler.reference = reference.version()
+    stages = build_stages(options.get('stages'), options.get('regions'),
+        options.get('passthrough', False), options.get('filters'))
+    checkpoint = None
+    if (checkpoint_secs > 0):
+        checkpoint = ckpt.Checkpoint(outfile,
+            checkpoint_key(infile, stages, start, end), checkpoint_secs)
+    engine = options.get('engine', 'variant')
+    site_store = options.get('site_store')
+    dedup_max_sites = options.get('dedup_max_sites', dd.MAX_SITES)
+    if (engine == 'auto'):
+        profiler.plan = plan_job(planner.estimate(infile, start, end),
+            stages, 1, site_store, dedup_max_sites)
+        engine = profiler.plan['stages']
+        if not profiler.plan['site_store']:
+            site_store = None
+    store = sitestore.open_store(site_store)
+    cache = dd.new_cache(dedup_max_sites, store)
+
+    fh = open(infile, 'rb')
+    mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    conn = u.db_connect()
+    cursor = conn.cursor()
+    lookup = new_engine(engine, cursor)
+    records = ann.annotateRange(mm, start, end, outfile, stages, cursor,
+        profiler=profiler, checkpoint=checkpoint, cache=cache, engine=lookup)
+    if lookup is not None:
+        lookup.close()
+    conn.close()
+    mm.close()
+    fh.close()
+    if store is not None:
+        store.close()
+
+    return {
+        'records': records,
+        'counts': [stage.counts for stage in stages],
+        'report': profiler.report(),
+        'queries': u.query_stats(),
+        'dedup': cache.report() if cache is not None else None,
+    }
+
+
+"""Annotates infile in workers processes, one byte range each
+   The input is memory-mapped and split at line boundaries, so the load is
+   even whatever the order or chromosome mix of the records. The header is
+   written by this process; the range outputs are then appended in input
+   order, and the counts, spans and query statistics of the workers are
+   merged into stages, profiler and the query summary. Returns the number
+   of records and the merged dedup.SiteCache (None if it is off); sites
+   are deduplicated within each range. options are the job options of the workers (see
+   annotate_range); with checkpoint_secs > 0 every range is checkpointed,
+   so a rerun only annotates what the ranges had not finished.
+"""
+def run_parallel(infile, finalout, stages, profiler, workers, options={}):
+    fh = open(infile, 'rb')
+    mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    data_start = header_end(mm)
+    ranges = split_ranges(mm, data_start, workers)
+
+    fh_out = open(finalout, 'wb')
+    mv = memoryview(mm)
+    ann.annotateLines(mm, mv, ann.lineOffsets(mm, 0, data_start), [], None,
+        fh_out, profiler)
+    fh_out.flush()
+    mv.release()
+    mm.close()
+    fh.close()
+
+    parts = [finalout + '.part' + str(i) for i in range(len(ranges))]
+    results = []
+    if (len(ranges) > 0):
+        pool = multiprocessing.Pool(len(ranges))
+        results = pool.map(annotate_range, [(infile, start, end, part,
+            options) for (start, end), part in zip(ranges, parts)])
+        pool.close()
+        pool.join()
+
+    with profiler.span('stitch'):
+        for part in parts:
+            fh_part = open(part, 'rb')
+            shutil.copyfileobj(fh_part, fh_out, 1024 * 1024)
+            fh_part.close()
+            fu.delete(part)
+            fu.delete(part + '.ckpt.json')
+    fh_out.close()
+
+    records = 0
+    cache = dd.new_cache(options.get('dedup_max_sites', dd.MAX_SITES))
+    for result in results:
+        records = records + result['records']
+        for stage, counts in zip(stages, result['counts']):
+            stage.merge(counts)
+        profiler.merge(result['report'])
+        u.merge_query_stats(result['queries'])
+        if cache is not None:
+            cache.merge(result['dedup'])
+    return records, cache
+
+
+"""Runs all annotation stages on infile and writes <prefix>.annot.vcf
+   With write_sidecar=True the Parquet sidecar <prefix>.annot.parquet
+   is also written. Only the VCF layout is supported; format is kept for
+   compatibility with the pileup-era callers.
+
+   Records are read, parsed and written once; all stages share one
+   database connection. With workers > 1 the input is split into byte
+   ranges annotated in parallel processes (see run_parallel). Every stage
+   is timed in its own span; the performance report, including the
+   per-template query statistics, is written to <infile>.perf.json (next
+   to <infile>.count.log) and returned.
+
+   With checkpoint_secs > 0 progress is saved at most that often in
+   <prefix>.annot.vcf.ckpt.json (see checkpoint.py), and a run of the same
+   input after an interruption resumes from the last checkpoint. The
+   caller removes the manifest once the results are delivered.
+
+   stages is an optional list of stage names to run instead of all of
+   them (see select_stages); the count log only has their lines.
+
+   bed (a BED file) and/or genes (refGene symbols) restrict the job to
+   those regions: other records are dropped before any lookup, or written
+   unannotated with passthrough=True.
+
+   filters are filter expressions such as "GMAF<0.01" (see filters.py),
+   applied as soon as the stage writing their key has run; records they
+   filter out skip the later stages and are dropped. Kept and filtered
+   counts are added to the count log.
+
+   Each stage looks up a site (CHROM, POS, REF, ALT) only once per job;
+   repeated sites are annotated from a cache of at most dedup_max_sites
+   sites (0 turns it off, see dedup.py). The measured dedup ratio, records
+   per unique site, is printed and reported under "dedup".
+
+   site_store is the file of a precomputed sitestore.SiteStore: sites found
+   there are annotated from it without any query (it needs the dedup
+   cache).
+
+   engine selects how the stages query the database (see ENGINES); with
+   "auto" the engine of each stage, and whether to open the site store,
+   are chosen by the estimated size of the job (see planner.py) and the
+   plan is reported under "plan".
+"""
+def run(infile, format, write_sidecar=False, workers=1, checkpoint_secs=0,
+    stages=None, bed=None, genes=None, passthrough=False, filters=None,
+    dedup_max_sites=dd.MAX_SITES, site_store=None, engine='variant'):
+
+    print("Running . . .")
+    profiler = perf.Profiler('job')
+    profiler.reference = reference.version()
+    options = {'checkpoint_secs': checkpoint_secs, 'stages': stages,
+        'regions': load_regions(bed, genes), 'passthrough': passthrough,
+        'filters': filters, 'dedup_max_sites': dedup_max_sites,
+        'site_store': site_store, 'engine': engine}
+    stages = build_stages(options['stages'], options['regions'], passthrough,
+        filters)
+    if (engine == 'auto'):
+        profiler.plan = plan_job(planner.estimate(infile), stages, workers,
+            site_store, dedup_max_sites)
+        engine = profiler.plan['stages']
+        if not profiler.plan['site_store']:
+            site_store = None
+        options['engine'] = engine
+        options['site_store'] = site_store
+    finalout = annot_name(infile)
+    remove_temp_files(infile)
+
+    with profiler.span('job') as job:
+        if (workers > 1 and fu.fileSize(infile) > 0):
+            job.records, cache = run_parallel(infile, finalout, stages,
+                profiler, workers, options)
+        else:
+            checkpoint = None
+            if (checkpoint_secs > 0):
+                checkpoint = ckpt.Checkpoint(finalout,
+                    checkpoint_key(infile, stages), checkpoint_secs)
+            store = sitestore.open_store(site_store)
+            cache = dd.new_cache(dedup_max_sites, store)
+            conn = u.db_connect()
+            cursor = conn.cursor()
+            lookup = new_engine(engine, cursor)
+            job.records = ann.annotateVcf(infile, finalout, stages, cursor,
+                profiler=profiler, checkpoint=checkpoint, cache=cache,
+                engine=lookup)
+            if lookup is not None:
+                lookup.close()
+            conn.close()
+            if store is not None:
+                store.close()
+        print("Annotation - done.")
+        if cache is not None:
+            profiler.dedup = cache.report()
+            print(f"Dedup ratio: {profiler.dedup['dedup_ratio']} " +
+                f"({profiler.dedup['records']} records, " +
+                f"{profiler.dedup['unique_sites']} unique sites, " +
+                f"{profiler.dedup['store_sites']} from the site store)")
+
+        ann.writeCountLog(stages, infile + '.count.log')
+
+        if write_sidecar:
+            with profiler.span('sidecar') as span:
+                sidecar.write_parquet(finalout)
+                span.records = job.records
+            print("Parquet sidecar - done.")
+
+    u.print_query_summary()
+    profiler.query_stats = u.query_stats()
+    profiler.write(infile + '.perf.json')
+    return profiler.report()
+
+
+"""Annotates a batch of small jobs together (cohort mode)
+
+   jobs is a list of (infile, options) pairs, options holding the stages,
+   bed, genes, passthrough and filters arguments of run(). The jobs share
+   one database connection, and jobs running the same stages share one
+   dedup.SiteCache, so a site found in several jobs of the batch is looked
+   up once for all of them. Every job still gets its own output, count log
+   and performance report; its query statistics and dedup ratio count the
+   lookups the job made itself. Returns the reports in the order of jobs.
+   Engine "auto" plans the batch as one job of all the stages.
+"""
+def run_batch(jobs, write_sidecar=False, dedup_max_sites=dd.MAX_SITES,
+    site_store=None, engine='variant'):
+    print(f"Running a batch of {len(jobs)} jobs . . .")
+    plan = None
+    if (engine == 'auto'):
+        sizes = [planner.estimate(infile) for infile, options in jobs]
+        plan = plan_job({'bytes': sum([size['bytes'] for size in sizes]),
+            'lines': sum([size['lines'] for size in sizes])}, build_stages(),
+            1, site_store, dedup_max_sites)
+        engine = plan['stages']
+        if not plan['site_store']:
+            site_store = None
+    store = sitestore.open_store(site_store)
+    conn = u.db_connect()
+    cursor = conn.cursor()
+    lookup = new_engine(engine, cursor)
+    caches = {}
+    reports = []
+    for infile, options in jobs:
+        u.reset_query_stats()
+        profiler = perf.Profiler('job')
+        profiler.plan = plan
+        profiler.reference = reference.version()
+        names = tuple(select_stages(options.get('stages')))
+        if names not in caches:
+            caches[names] = dd.new_cache(dedup_max_sites, store)
+        cache = caches[names]
+        stages = build_stages(options.get('stages'), load_regions(
+            options.get('bed'), options.get('genes')),
+            options.get('passthrough', False), options.get('filters'))
+        finalout = annot_name(infile)
+        remove_temp_files(infile)
+
+        before = (cache.records, cache.unique, cache.stored) \
+            if cache is not None else None
+        with profiler.span('job') as job:
+            job.records = ann.annotateVcf(infile, finalout, stages, cursor,
+                profiler=profiler, cache=cache, engine=lookup)
+            ann.writeCountLog(stages, infile + '.count.log')
+            if write_sidecar:
+                with profiler.span('sidecar') as span:
+                    sidecar.write_parquet(finalout)
+                    span.records = job.records
+        if cache is not None:
+            profiler.dedup = dd.summary(cache.records - before[0],
+                cache.unique - before[1], cache.stored - before[2])
+        profiler.query_stats = u.query_stats()
+        profiler.write(infile + '.perf.json')
+        reports.append(profiler.report())
+        print(f"{finalout}: {job.records} records, " +
+            f"{profiler.root.db_queries} queries")
+    if lookup is not None:
+        lookup.close()
+    conn.close()
+    if store is not None:
+        store.close()
+    return reports
+
 
-    os.rename(infile + '.' + str(tmpextin), infile + '.annot')
-    finalout=(infile + '.annot').replace('.vcf.annot', '.annot.vcf')
-    os.rename(infile + '.annot', finalout)
+"""Name of the annotated output of infile (<prefix>.annot.vcf)
+"""
+def annot_name(infile):
+    return (infile + '.annot').replace('.vcf.annot', '.annot.vcf')
 
-### EOF
\ No newline at end of file
+### EOF
@@ -0,0 +1,544 @@
+# fanout.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Fan-out/fan-in annotation of very large jobs across annotator instances
+#
+# split_job() cuts the input (in S3) into line-aligned byte ranges and
+# publishes one chunk task per range back to the request queue. Any
+# annotator runs a chunk (run_chunk): it range-reads the header and its
+# bytes, annotates them and stores the output and counts next to the
+# results. The instance that finishes the last chunk merges the chunk
+# outputs into the results file (S3 multipart copy), merges the counts and
+# performance reports and runs the completion steps of run.py.
+#
+# A chunk task's message is leased like a job's (run.MessageLease) and
+# deleted only when the chunk is stored and counted, so the chunk of a
+# crashed instance is redelivered. A redelivered last chunk reaches the
+# chunk count again; the merge is claimed on the parent job's item first,
+# so it runs once. A claim older than MergeTimeoutSecs ([fanout]) is taken
+# over, in case its instance died while merging.
+#
+# Queue, object store and chunk counter are small classes with in-memory
+# stand-ins, so a whole job can be run in one process:
+#
+#   ANNOTATOR_SQLITE_DB=ref.db python fanout.py --local in.vcf --chunk-kb 64
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import boto3
+from botocore.exceptions import ClientError
+
+import annotate as ann
+import dedup as dd
+import driver
+import file_utils as fu
+import perf
+import reference
+import regions as rg
+import sidecar
+import utils as u
+
+# S3 multipart copy: every part but the last must be at least 5 MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Bytes read per range request when looking for a line boundary
+PROBE_SIZE = 64 * 1024
+
+# Seconds after which the merge claim of a job is taken over
+MERGE_TIMEOUT_SECS = 3600
+
+
+"""Request queue: chunk tasks are sent in the SNS envelope the annotator
+   already unwraps (json.loads(json.loads(Body)['Message']))
+"""
+class SqsQueue(object):
+    def __init__(self, queue_url, region_name=None):
+        self.queue_url = queue_url
+        self.sqs = boto3.client('sqs', region_name=region_name)
+
+    def send(self, data):
+        self.sqs.send_message(QueueUrl=self.queue_url,
+            MessageBody=json.dumps({'Message': json.dumps(data)}))
+
+
+class MemoryQueue(object):
+    def __init__(self):
+        self.messages = []
+
+    def send(self, data):
+        self.messages.append(json.loads(json.dumps(data)))
+
+    def receive(self):
+        return self.messages.pop(0) if self.messages else None
+
+
+"""Object store over one S3 bucket
+"""
+class S3Store(object):
+    def __init__(self, bucket, region_name=None):
+        self.bucket = bucket
+        self.s3 = boto3.client('s3', region_name=region_name)
+
+    def size(self, key):
+        return self.s3.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+
+    """Bytes [start, end) of an object
+    """
+    def read_range(self, key, start, end):
+        if (end <= start):
+            return b''
+        response = self.s3.get_object(Bucket=self.bucket, Key=key,
+            Range='bytes={}-{}'.format(start, end - 1))
+        return response['Body'].read()
+
+    def upload(self, filename, key):
+        self.s3.upload_file(filename, self.bucket, key)
+
+    def download(self, key, filename):
+        self.s3.download_file(self.bucket, key, filename)
+
+    def put(self, key, data):
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def get(self, key):
+        return self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def delete(self, key):
+        self.s3.delete_object(Bucket=self.bucket, Key=key)
+
+    """Writes the objects keys, in order, into dest without moving the data
+       through this instance (multipart upload_part_copy). Falls back to
+       downloading and concatenating when a part other than the last is
+       below the 5 MB multipart minimum.
+    """
+    def concat(self, keys, dest):
+        sizes = [self.size(key) for key in keys]
+        if (len(keys) == 1 or min(sizes[:-1]) < MIN_PART_SIZE):
+            return concat_locally(self, keys, dest)
+
+        upload = self.s3.create_multipart_upload(Bucket=self.bucket, Key=dest)
+        try:
+            parts = []
+            for number, key in enumerate(keys, 1):
+                response = self.s3.upload_part_copy(Bucket=self.bucket,
+                    Key=dest, UploadId=upload['UploadId'], PartNumber=number,
+                    CopySource={'Bucket': self.bucket, 'Key': key})
+                parts.append({'ETag': response['CopyPartResult']['ETag'],
+                    'PartNumber': number})
+            self.s3.complete_multipart_upload(Bucket=self.bucket, Key=dest,
+                UploadId=upload['UploadId'], MultipartUpload={'Parts': parts})
+        except ClientError as e:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=dest,
+                UploadId=upload['UploadId'])
+            raise e
+
+
+class MemoryStore(object):
+    def __init__(self):
+        self.objects = {}
+
+    def size(self, key):
+        return len(self.objects[key])
+
+    def read_range(self, key, start, end):
+        return self.objects[key][start:end]
+
+    def upload(self, filename, key):
+        fh = open(filename, 'rb')
+        self.objects[key] = fh.read()
+        fh.close()
+
+    def download(self, key, filename):
+        fh = open(filename, 'wb')
+        fh.write(self.objects[key])
+        fh.close()
+
+    def put(self, key, data):
+        self.objects[key] = data if isinstance(data, bytes) else data.encode()
+
+    def get(self, key):
+        return self.objects[key]
+
+    def delete(self, key):
+        self.objects.pop(key, None)
+
+    def concat(self, keys, dest):
+        self.objects[dest] = b''.join([self.objects[key] for key in keys])
+
+
+def concat_locally(store, keys, dest):
+    tmp = dest.replace('/', '_') + '.concat'
+    fh = open(tmp, 'wb')
+    for key in keys:
+        fh.write(store.get(key))
+    fh.close()
+    store.upload(tmp, dest)
+    fu.delete(tmp)
+
+
+"""Records finished chunks on the parent job's DynamoDB item
+   Chunks are added to a string set, so a redelivered chunk task is not
+   counted twice; add() returns the number of distinct finished chunks.
+   claim_merge() sets merge_claimed unless the job is merged or claimed
+   less than timeout seconds ago, and returns whether it did; merged()
+   marks the job merged.
+"""
+class DynamoCounter(object):
+    def __init__(self, table_name, region_name=None):
+        dynamo = boto3.resource('dynamodb', region_name=region_name)
+        self.table = dynamo.Table(table_name)
+
+    def add(self, job_id, chunk_index):
+        response = self.table.update_item(
+            Key={'job_id': job_id},
+            UpdateExpression="ADD chunks_done :c",
+            ExpressionAttributeValues={':c': set([str(chunk_index)])},
+            ReturnValues='UPDATED_NEW')
+        return len(response['Attributes']['chunks_done'])
+
+    def claim_merge(self, job_id, timeout=MERGE_TIMEOUT_SECS):
+        now = int(time.time())
+        try:
+            self.table.update_item(
+                Key={'job_id': job_id},
+                UpdateExpression="SET merge_claimed = :n",
+                ConditionExpression="attribute_not_exists(merged) AND " +
+                    "(attribute_not_exists(merge_claimed) OR " +
+                    "merge_claimed < :s)",
+                ExpressionAttributeValues={':n': now, ':s': now - timeout})
+        except ClientError as e:
+            if (e.response['Error']['Code'] ==
+                'ConditionalCheckFailedException'):
+                return False
+            raise
+        return True
+
+    def merged(self, job_id):
+        self.table.update_item(
+            Key={'job_id': job_id},
+            UpdateExpression="SET merged = :t",
+            ExpressionAttributeValues={':t': True})
+
+
+class MemoryCounter(object):
+    def __init__(self):
+        self.done = {}
+        self.claims = {}
+        self.finished = set()
+
+    def add(self, job_id, chunk_index):
+        self.done.setdefault(job_id, set()).add(str(chunk_index))
+        return len(self.done[job_id])
+
+    def claim_merge(self, job_id, timeout=MERGE_TIMEOUT_SECS):
+        now = time.time()
+        if (job_id in self.finished or
+            now - self.claims.get(job_id, now - timeout - 1) <= timeout):
+            return False
+        self.claims[job_id] = now
+        return True
+
+    def merged(self, job_id):
+        self.finished.add(job_id)
+
+
+"""Offset just past the first newline at or after start, found with small
+   range reads; size if there is none
+"""
+def next_line(store, key, start, size):
+    while (start < size):
+        data = store.read_range(key, start, min(start + PROBE_SIZE, size))
+        i = data.find(b'\n')
+        if (i >= 0):
+            return start + i + 1
+        start = start + len(data)
+    return size
+
+
+"""Offset of the first data line, read from the start of the object
+"""
+def data_start(store, key, size):
+    offset = 0
+    while (offset < size):
+        end = next_line(store, key, offset, size)
+        line = store.read_range(key, offset, min(end, offset + 5))
+        if not (line[:1] == b'#' or line[:5] == b'CHROM' or line[:1] in
+            (b'\r', b'\n')):
+            return offset
+        offset = end
+    return size
+
+
+"""Line-aligned byte ranges of about chunk_size covering the data lines
+"""
+def chunk_ranges(store, key, chunk_size):
+    size = store.size(key)
+    start = data_start(store, key, size)
+    ranges = []
+    while (start < size):
+        end = next_line(store, key, min(start + chunk_size, size) - 1, size)
+        ranges.append((start, end))
+        start = end
+    return start, ranges
+
+
+"""Splits a job into chunk tasks published to queue
+   data is the job request; the chunk tasks carry it along with the parent
+   job id and their byte range. Returns the number of chunks.
+"""
+def split_job(data, store, queue, chunk_size):
+    key = data['s3_key_input_file']
+    header_end, ranges = chunk_ranges(store, key, chunk_size)
+    if (len(ranges) > 0):
+        header_end = ranges[0][0]
+
+    for i, (start, end) in enumerate(ranges):
+        task = dict(data)
+        task.update({
+            'parent_job_id': data['job_id'],
+            'chunk_index': i,
+            'chunk_count': len(ranges),
+            'header_end': header_end,
+            'range_start': start,
+            'range_end': end,
+        })
+        queue.send(task)
+    print(f"Job {data['job_id']} split into {len(ranges)} chunks")
+    return len(ranges)
+
+
+"""Local and results-bucket names of a job's files
+"""
+def job_paths(data, data_path, user_prefix):
+    username = data['s3_key_input_file'].split('/')[1]
+    filename = data['s3_key_input_file'].split('/')[-1]
+    prefix = filename[:-4]
+    return {
+        'dir': os.path.join(data_path, username),
+        'input': os.path.join(data_path, username, filename),
+        'chunks': user_prefix + '/' + username + '/' + prefix + '.chunks/',
+        'annot': user_prefix + '/' + username + '/' + prefix + '.annot.vcf',
+    }
+
+
+"""RegionSet of a task's BED file (read from the input bucket) and gene
+   list, or None
+"""
+def load_regions(task, input_store, local):
+    bed = None
+    if task.get('s3_key_regions_file'):
+        key = task['s3_key_regions_file']
+        bed = local + '.regions.bed'
+        fh = open(bed, 'wb')
+        fh.write(input_store.read_range(key, 0, input_store.size(key)))
+        fh.close()
+    regions = driver.load_regions(bed, task.get('genes'))
+    if bed:
+        fu.delete(bed)
+    return regions
+
+
+"""Annotates one chunk task
+   The header and the chunk's bytes are range-read into a local file and
+   annotated like a worker range of driver.run_parallel (only chunk 0 keeps
+   the header). Output and counts go to the results store; the instance
+   finishing the last chunk claims the merge, merges the job and calls
+   complete(). Returns True if this call merged the job.
+"""
+def run_chunk(task, input_store, result_store, counter, data_path,
+    user_prefix, complete, write_sidecar=False, site_store=None,
+    engine='variant', merge_timeout=MERGE_TIMEOUT_SECS):
+    paths = job_paths(task, data_path, user_prefix)
+    i = task['chunk_index']
+    fu.mkdirp(paths['dir'])
+    local = paths['input'] + '.chunk' + str(i)
+    output = local + '.annot'
+
+    key = task['s3_key_input_file']
+    header = input_store.read_range(key, 0, task['header_end'])
+    fh = open(local, 'wb')
+    fh.write(header)
+    fh.write(input_store.read_range(key, task['range_start'],
+        task['range_end']))
+    fh.close()
+
+    start = 0 if (i == 0) else len(header)
+    options = {'stages': task.get('stages'), 'regions': load_regions(task,
+        input_store, local), 'passthrough': task.get('region_passthrough', False),
+        'filters': task.get('filters'), 'site_store': site_store,
+        'engine': engine}
+    result = driver.annotate_range((local, start, fu.fileSize(local), output,
+        options))
+    result_store.upload(output, paths['chunks'] + str(i) + '.annot.vcf')
+    result_store.put(paths['chunks'] + str(i) + '.json', json.dumps(result))
+    fu.delete(local)
+    fu.delete(output)
+    print(f"Chunk {i + 1}/{task['chunk_count']} of job " +
+        f"{task['parent_job_id']} - done.")
+
+    if (counter.add(task['parent_job_id'], i) < task['chunk_count']):
+        return False
+    # a redelivered or repeated last chunk reaches the count again
+    if not counter.claim_merge(task['parent_job_id'], merge_timeout):
+        print(f"Job {task['parent_job_id']} is merged by another task")
+        return False
+    merge_job(task, result_store, data_path, user_prefix, complete,
+        write_sidecar)
+    counter.merged(task['parent_job_id'])
+    return True
+
+
+"""Fan-in: concatenates the chunk outputs into the results file, merges
+   the chunk counts, reports and query statistics into the job's count log
+   and perf report, then calls complete(file_path, job_id, email, report)
+   The chunk objects are deleted last, so a merge taken over from a dead
+   instance finds them.
+"""
+def merge_job(task, store, data_path, user_prefix, complete,
+    write_sidecar=False):
+    paths = job_paths(task, data_path, user_prefix)
+    count = task['chunk_count']
+    outputs = [paths['chunks'] + str(i) + '.annot.vcf' for i in range(count)]
+    store.concat(outputs, paths['annot'])
+
+    u.reset_query_stats()
+    # the regions only matter for the filter counts here
+    regions = None
+    if (task.get('s3_key_regions_file') or task.get('genes')):
+        regions = rg.RegionSet()
+    stages = driver.build_stages(task.get('stages'), regions,
+        filters=task.get('filters'))
+    profiler = perf.Profiler('job')
+    profiler.reference = task.get('reference_version') or reference.version()
+    cache = dd.SiteCache()
+    for i in range(count):
+        result = json.loads(store.get(paths['chunks'] + str(i) + '.json'))
+        for stage, counts in zip(stages, result['counts']):
+            stage.merge(counts)
+        profiler.merge(result['report'])
+        profiler.root.records += result['records']
+        u.merge_query_stats(result['queries'])
+        cache.merge(result.get('dedup'))
+    profiler.query_stats = u.query_stats()
+    if (cache.records > 0):
+        profiler.dedup = cache.report()
+
+    # Derived files (count log, perf report, region index, sidecars) are
+    # written next to the local input path, as for a single-instance job
+    file_path = paths['input']
+    annot_path = file_path[:-4] + '.annot.vcf'
+    ann.writeCountLog(stages, file_path + '.count.log')
+    store.download(paths['annot'], annot_path)
+    if write_sidecar:
+        sidecar.write_parquet(annot_path)
+    profiler.write(file_path + '.perf.json')
+
+    print(f"Job {task['parent_job_id']} merged from {count} chunks")
+    complete(file_path, task['parent_job_id'], task.get('email'),
+        profiler.report())
+
+    for i in range(count):
+        store.delete(outputs[i])
+        store.delete(paths['chunks'] + str(i) + '.json')
+
+
+"""Runs a whole fan-out job in this process with the in-memory stand-ins
+   and returns the merged annotated VCF (bytes)
+"""
+def run_local(vcf, chunk_size, workdir):
+    input_store = MemoryStore()
+    result_store = MemoryStore()
+    queue = MemoryQueue()
+    counter = MemoryCounter()
+    merged = {}
+
+    key = 'inputs/local/' + os.path.basename(vcf)
+    input_store.upload(vcf, key)
+    data = {'job_id': 'local', 's3_key_input_file': key, 'email': None}
+    split_job(data, input_store, queue, chunk_size)
+
+    def complete(file_path, job_id, email, report):
+        annot_path = file_path[:-4] + '.annot.vcf'
+        merged['report'] = report
+        fh = open(annot_path, 'rb')
+        merged['vcf'] = fh.read()
+        fh.close()
+
+    task = queue.receive()
+    while task is not None:
+        run_chunk(task, input_store, result_store, counter, workdir + '/',
+            'results', complete)
+        task = queue.receive()
+    return merged.get('vcf', b'')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Fan-out/fan-in annotation of large jobs')
+    parser.add_argument('--local', metavar='VCF',
+        help='run a whole job in this process with in-memory stand-ins')
+    parser.add_argument('--chunk-kb', type=int, default=1024)
+    parser.add_argument('--workdir', default='fanout-local')
+    parser.add_argument('--task', metavar='JSON',
+        help='chunk task to run against S3, SQS and DynamoDB')
+    parser.add_argument('--receipt-handle',
+        help='request message of the task, deleted once the chunk is done')
+    args = parser.parse_args(argv)
+
+    if args.local:
+        fu.mkdirp(args.workdir)
+        merged = run_local(args.local, args.chunk_kb * 1024, args.workdir)
+        out = os.path.join(args.workdir, 'merged.annot.vcf')
+        fh = open(out, 'wb')
+        fh.write(merged)
+        fh.close()
+        print(f"Merged output written to {out}")
+        return 0
+
+    if args.task:
+        import run
+        task = json.loads(args.task)
+        config = run.config
+        region = config['aws']['AwsRegionName']
+        # the message stays invisible while the chunk runs; if this process
+        # dies it is redelivered and the chunk runs again
+        lease = None
+        if args.receipt_handle:
+            lease = run.MessageLease(args.receipt_handle)
+        try:
+            run_chunk(task, S3Store(task['s3_inputs_bucket'], region),
+                S3Store(config['s3']['BucketResult'], region),
+                DynamoCounter(config['dynamodb']['TableName'], region),
+                config['ann']['DataPath'], config['s3']['User'],
+                lambda file_path, job_id, email, report: run.complete_job(
+                    file_path, job_id, email, report, results_uploaded=True),
+                config.getboolean('ann', 'WriteSidecar', fallback=False),
+                reference.site_store(config.get('ann', 'SiteStore',
+                    fallback='') or None),
+                config.get('db', 'Engine', fallback='variant'),
+                config.getint('fanout', 'MergeTimeoutSecs',
+                    fallback=MERGE_TIMEOUT_SECS))
+        finally:
+            if lease:
+                lease.stop()
+        if lease and not lease.delete():
+            print("the chunk task will be redelivered; it is counted once")
+        return 0
+
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+### EOF
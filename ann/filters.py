@@ -0,0 +1,113 @@
+# filters.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Job-level filter expressions on INFO keys, e.g.
+#
+#   GMAF<0.01
+#   positionType in (CDS, utr5)
+#   gwasCatalog
+#   !genomicSuperDups
+#
+# An expression compares the values of one INFO key: <, <=, >, >= (numeric),
+# = or == and != (numeric when both sides are numbers, text otherwise),
+# "in (...)" and "not in (...)". A bare key keeps records that have it, a
+# key preceded by "!" those that do not. A comparison holds if any value of
+# the key satisfies it; records without the key are kept, so GMAF<0.01
+# keeps the variants that are not in dbSNP at all. Expressions are parsed
+# here, never evaluated as Python.
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import re
+
+KEY = r'[A-Za-z_][A-Za-z0-9_.]*'
+COMPARISON = re.compile(r'^\s*(' + KEY + r')\s*(<=|>=|==|!=|=|<|>)\s*' +
+    r'([^\s()]+)\s*$')
+MEMBERSHIP = re.compile(r'^\s*(' + KEY + r')\s+(not\s+in|in)\s*' +
+    r'\(([^()]*)\)\s*$', re.IGNORECASE)
+PRESENCE = re.compile(r'^\s*(!?)\s*(' + KEY + r')\s*$')
+
+NUMERIC_OPS = {
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+def to_number(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+"""One parsed filter expression
+   keep(items) tells whether a record with the INFO items (key, value)
+   passes.
+"""
+class Predicate(object):
+    def __init__(self, text, key, op, values):
+        self.text = text
+        self.key = key
+        self.op = op
+        self.values = values
+        self.numbers = [to_number(value) for value in values]
+
+    def test(self, value):
+        if (self.op == 'has'):
+            return True
+        if (self.op == 'in'):
+            return value in self.values
+        if (self.op == 'not in'):
+            return value not in self.values
+
+        number = to_number(value)
+        if (self.op in NUMERIC_OPS):
+            return (number is not None and self.numbers[0] is not None and
+                NUMERIC_OPS[self.op](number, self.numbers[0]))
+        if (number is not None and self.numbers[0] is not None):
+            equal = (number == self.numbers[0])
+        else:
+            equal = (value == self.values[0])
+        return equal if (self.op == '=') else not equal
+
+    def keep(self, items):
+        values = [value for key, value in items if key == self.key]
+        if (self.op == 'missing'):
+            return (len(values) == 0)
+        if (len(values) == 0):
+            return (self.op != 'has')
+        return any([self.test(value) for value in values])
+
+
+"""Parses one filter expression; raises ValueError if it is not valid
+"""
+def parse(text):
+    m = COMPARISON.match(text)
+    if m:
+        op = '=' if m.group(2) == '==' else m.group(2)
+        if (op in NUMERIC_OPS and to_number(m.group(3)) is None):
+            raise ValueError(f"Not a number in filter: {text}")
+        return Predicate(text.strip(), m.group(1), op, [m.group(3)])
+
+    m = MEMBERSHIP.match(text)
+    if m:
+        values = [value.strip() for value in m.group(3).split(',')
+            if value.strip() != '']
+        if (len(values) == 0):
+            raise ValueError(f"Empty list in filter: {text}")
+        op = 'in' if m.group(2).lower() == 'in' else 'not in'
+        return Predicate(text.strip(), m.group(1), op, values)
+
+    m = PRESENCE.match(text)
+    if m:
+        op = 'missing' if m.group(1) == '!' else 'has'
+        return Predicate(text.strip(), m.group(2), op, [])
+
+    raise ValueError(f"Invalid filter: {text}")
+
+### EOF
@@ -0,0 +1,214 @@
+# microbench.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Micro-benchmarks of the helpers called for every variant
+#
+# Times each helper on realistic inputs, compares the timings with stored
+# baselines and flags slowdowns beyond a threshold. Optimized replacements
+# registered in CANDIDATES are checked for identical output on the same
+# inputs and timed next to the original:
+#
+#   python microbench.py --save                  # record baselines
+#   python microbench.py --threshold 0.2         # flag >20% slowdowns
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import sys
+import json
+import timeit
+import argparse
+
+import annotate as ann
+import file_utils as fu
+import utils as u
+import pileup2vcf
+
+BASELINE_FILE = 'microbench_baseline.json'
+
+REFSEQ_ROW = '\t'.join(['1', '43071077', '43071077', 'T', 'C',
+    'NM_007294', 'BRCA1', '-', 'CDS', '2', '4837', '1613', '-12', 'AGC',
+    'S', 'GGC', 'G', 'Y', 'missense', 'c.4837A>G', 'p.S1613G', 'true', '', '0'])
+
+REFGENE_ROW = (585, 'NM_007294', 'chr17', '-', 43044294, 43125483, 43045677,
+    43124096, 23, b'43044294,43047642,43049120,', b'43045802,43047703,43049194,',
+    0, 'BRCA1', 'cmpl', 'cmpl', '1,0,1,')
+
+INFO_FIELDS = [
+    'DP=100;DB;VC=SNV;GMAF=0.1234;name=NM_007294;name2=BRCA1;'
+    'transcriptStrand=-;positionType=CDS;frame=2;mrnaCoord=4837',
+    'DP=12;positionType=interGenic',
+    'AC=2;AF=1.00;AN=2;DP=7;MQ=60.00;name=NM_000546;name2=TP53;'
+    'positionType=intron;spliceDist=-57',
+]
+
+PILEUP_BASES = [
+    ('30', '..,,..,.,.,,..*..,,.,,A.a,,..,'),
+    ('12', 'AAaaAAAaa^]A$'),
+    ('55', '.,' * 20 + '**' + 'ggGGgg' + '.,.,.,.'),
+]
+
+# (name, function, list of argument tuples)
+BENCHMARKS = [
+    ('annotate.collapseRefSeq', ann.collapseRefSeq, [(REFSEQ_ROW,)]),
+    ('annotate.collapseGeneNames', ann.collapseGeneNames,
+        [(REFGENE_ROW, ann.indicesKnownGenes, 'exon=ex12/23', 1)]),
+    ('utils.parse_field', u.parse_field,
+        [(info, key, ';', '=') for info in INFO_FIELDS
+        for key in ['name', 'positionType', 'GMAF']]),
+    ('utils.isBetween', u.isBetween,
+        [(43071077, 43044294, 43125483), (100, 200, 300), (300, 200, 300)]),
+    ('annotate.getComplementary', ann.getComplementary,
+        [(b,) for b in ['A', 'C', 'G', 'T', 'N', 'AC', '']]),
+    ('annotate.clean_mysql_chars', ann.clean_mysql_chars,
+        [('A',), ('GATTACA',), ('A"T',), ("C'G",)]),
+    ('pileup2vcf.count_alt', pileup2vcf.count_alt, PILEUP_BASES),
+]
+
+
+COMPLEMENT = {'A': 'T', 'T': 'A', 'G': 'C', 'C': 'G'}
+
+"""Dict lookup instead of the if/elif chain
+"""
+def getComplementary_lookup(nuc):
+    return COMPLEMENT.get(nuc, '')
+
+
+MYSQL_QUOTES = str.maketrans('', '', '"\'')
+
+"""Single translate() pass instead of two replace() calls
+"""
+def clean_mysql_chars_translate(entry):
+    return entry.translate(MYSQL_QUOTES)
+
+
+"""str.count instead of a Python loop over the bases
+"""
+def count_alt_count(depth, bases):
+    return int(depth) - (bases.count('.') + bases.count(',') +
+        bases.count('*'))
+
+
+"""partition() and 'in' instead of split() and str() conversions
+"""
+def parse_field_partition(text, key, sep1, sep2):
+    for f in text.strip().split(sep1):
+        name, sep, value = f.partition(sep2)
+        if key in name:
+            return value.split(sep2, 1)[0]
+    return '.'
+
+
+# Optimized replacements validated against the originals
+CANDIDATES = {
+    'annotate.getComplementary': getComplementary_lookup,
+    'annotate.clean_mysql_chars': clean_mysql_chars_translate,
+    'pileup2vcf.count_alt': count_alt_count,
+    'utils.parse_field': parse_field_partition,
+}
+
+
+"""Best time per call in nanoseconds, averaged over the inputs
+"""
+def time_function(func, inputs, number=20000, repeat=5):
+    def loop():
+        for args in inputs:
+            func(*args)
+    best = min(timeit.repeat(loop, number=number, repeat=repeat))
+    return best * 1e9 / (number * len(inputs))
+
+
+"""Inputs for which candidate and original return different results
+"""
+def mismatches(original, candidate, inputs):
+    different = []
+    for args in inputs:
+        if original(*args) != candidate(*args):
+            different.append(args)
+    return different
+
+
+def run(number=20000, repeat=5):
+    results = {}
+    for name, func, inputs in BENCHMARKS:
+        result = {'ns_per_call': round(time_function(func, inputs,
+            number=number, repeat=repeat), 1)}
+        candidate = CANDIDATES.get(name)
+        if candidate is not None:
+            different = mismatches(func, candidate, inputs)
+            result['candidate'] = candidate.__name__
+            result['candidate_identical'] = (len(different) == 0)
+            result['candidate_mismatches'] = [repr(a) for a in different]
+            result['candidate_ns_per_call'] = round(time_function(candidate,
+                inputs, number=number, repeat=repeat), 1)
+        results[name] = result
+    return results
+
+
+"""Helpers that got slower than their baseline by more than threshold
+"""
+def slowdowns(baseline, results, threshold=0.2):
+    slower = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]['ns_per_call']
+        if (result['ns_per_call'] > old * (1 + threshold)):
+            slower.append((name, old, result['ns_per_call']))
+    return slower
+
+
+def print_results(results):
+    print(f"{'helper':<30} {'ns/call':>10} {'candidate':>10} {'speedup':>8}  identical")
+    for name, r in results.items():
+        if 'candidate' in r:
+            print(f"{name:<30} {r['ns_per_call']:>10.1f} " +
+                f"{r['candidate_ns_per_call']:>10.1f} " +
+                f"{r['ns_per_call'] / r['candidate_ns_per_call']:>7.2f}x  " +
+                f"{r['candidate_identical']}")
+        else:
+            print(f"{name:<30} {r['ns_per_call']:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Micro-benchmarks of the annotation helpers')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save', action='store_true',
+        help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--number', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = run(number=args.number, repeat=args.repeat)
+    print_results(results)
+    status = 0
+
+    for name, r in results.items():
+        if not r.get('candidate_identical', True):
+            print(f"MISMATCH: {r['candidate']} differs from {name} for " +
+                ', '.join(r['candidate_mismatches']))
+            status = 1
+
+    if args.save:
+        fh = open(args.baseline, 'w')
+        json.dump(results, fh, indent=2)
+        fh.close()
+        print(f"Baseline saved to {args.baseline}")
+    elif fu.isExist(args.baseline):
+        fh = open(args.baseline)
+        baseline = json.load(fh)
+        fh.close()
+        for name, old, new in slowdowns(baseline, results, args.threshold):
+            print(f"SLOWDOWN: {name} {old:.1f} -> {new:.1f} ns/call")
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+### EOF
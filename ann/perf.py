@@ -0,0 +1,158 @@
+# perf.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Hierarchical timing spans and the per-job performance report
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import sys
+import json
+import resource
+import time
+
+import utils as u
+
+
+"""Peak resident set size of this process in KB (Linux reports KB)
+"""
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+"""Totals of one named span; entering the same span again adds to them
+   alloc_blocks is the growth in allocated memory blocks (Python objects)
+   over the span: for a parse span, the objects that the parsed records
+   keep alive.
+"""
+class Span(object):
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_secs = 0.0
+        self.cpu_secs = 0.0
+        self.records = 0
+        self.db_queries = 0
+        self.peak_rss_kb = 0
+        self.alloc_blocks = 0
+        self.children = []
+        self._children = {}
+
+    def child(self, name):
+        if name not in self._children:
+            span = Span(name)
+            self._children[name] = span
+            self.children.append(span)
+        return self._children[name]
+
+    """Adds the totals of a span dict (to_dict() of another process)
+    """
+    def merge(self, totals):
+        self.calls = self.calls + totals['calls']
+        self.wall_secs = self.wall_secs + totals['wall_secs']
+        self.cpu_secs = self.cpu_secs + totals['cpu_secs']
+        self.records = self.records + totals['records']
+        self.db_queries = self.db_queries + totals['db_queries']
+        self.alloc_blocks = self.alloc_blocks + totals.get('alloc_blocks', 0)
+        self.peak_rss_kb = max(self.peak_rss_kb, totals['peak_rss_kb'])
+        for child in totals['children']:
+            self.child(child['name']).merge(child)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'wall_secs': round(self.wall_secs, 6),
+            'cpu_secs': round(self.cpu_secs, 6),
+            'records': self.records,
+            'db_queries': self.db_queries,
+            'peak_rss_kb': self.peak_rss_kb,
+            'alloc_blocks': self.alloc_blocks,
+            'alloc_blocks_per_record': round(self.alloc_blocks /
+                self.records, 2) if self.records else None,
+            'children': [c.to_dict() for c in self.children],
+        }
+
+
+"""Context manager measuring one entry into a span
+"""
+class _Timing(object):
+    def __init__(self, profiler, span):
+        self.profiler = profiler
+        self.span = span
+
+    def __enter__(self):
+        self.profiler._stack.append(self.span)
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.queries = u.query_count()
+        self.blocks = sys.getallocatedblocks()
+        return self.span
+
+    def __exit__(self, *args):
+        span = self.span
+        span.calls = span.calls + 1
+        span.wall_secs = span.wall_secs + (time.perf_counter() - self.wall)
+        span.cpu_secs = span.cpu_secs + (time.process_time() - self.cpu)
+        span.db_queries = span.db_queries + (u.query_count() - self.queries)
+        span.peak_rss_kb = peak_rss_kb()
+        span.alloc_blocks += sys.getallocatedblocks() - self.blocks
+        self.profiler._stack.pop()
+
+
+"""Collects a tree of spans for one job
+
+   profiler = Profiler('job')
+   with profiler.span('dbSNP') as span:
+       span.records = ...
+"""
+class Profiler(object):
+    def __init__(self, name='job'):
+        self.root = Span(name)
+        self.query_stats = []
+        self.dedup = None
+        self.plan = None
+        self.reference = None
+        self._stack = []
+
+    def span(self, name):
+        if (len(self._stack) > 0):
+            return _Timing(self, self._stack[-1].child(name))
+        if (name == self.root.name):
+            return _Timing(self, self.root)
+        return _Timing(self, self.root.child(name))
+
+    """Adds the spans of a report from another process (a parallel worker)
+       under the current span. Wall times of merged spans are summed over
+       the workers, so they can exceed the elapsed time of the job.
+    """
+    def merge(self, report):
+        target = self._stack[-1] if len(self._stack) > 0 else self.root
+        for child in report['children']:
+            target.child(child['name']).merge(child)
+
+    """Stage that took the longest wall time among the root's children
+    """
+    def slowest(self):
+        if (len(self.root.children) == 0):
+            return None
+        return max(self.root.children, key=lambda s: s.wall_secs).name
+
+    def report(self):
+        report = self.root.to_dict()
+        report['slowest_stage'] = self.slowest()
+        report['queries'] = self.query_stats
+        report['dedup'] = self.dedup
+        report['plan'] = self.plan
+        report['reference_version'] = self.reference
+        return report
+
+    def write(self, filename):
+        fh = open(filename, 'w')
+        json.dump(self.report(), fh, indent=2)
+        fh.close()
+        return filename
+
+### EOF
@@ -0,0 +1,209 @@
+# planner.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Adaptive choice of the lookup engine of each stage (Engine = auto)
+#
+# What is fastest depends on the size of the job. Joins (bulk.py) pay a
+# fixed number of round trips per chunk whatever its size; a pool of
+# connections (pool.py) must first open them; the site store (sitestore.py)
+# costs a file open that a few records do not recoup. The planner
+# estimates the records of a job from its size and the line length of a
+# sample, prices each way of running each stage with the [plan] costs of
+# ann_config.ini, and picks the cheapest:
+#
+#   variant  records * queries * RoundTripMs
+#   pool     Concurrency * ConnectMs, once for all pooled stages, then
+#            records * queries * RoundTripMs / Concurrency
+#   bulk     (2 + joins) * RoundTripMs for the table and a first chunk,
+#            then records * ((1 + joins) * RoundTripMs / chunk size +
+#            JoinRecordMs)
+#
+# and opens the site store if the lookups it saves (StoreHitRatio of the
+# records) are worth more than StoreOpenMs + records * StoreRecordMs. With
+# several workers each one is priced on its share of the records. The plan
+# is printed and kept in the job report under "plan".
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+
+import annotate as ann
+import bulk
+import pool
+import utils as u
+
+# Cost model, [plan] section of ann_config.ini
+ROUND_TRIP_MS = u.config.getfloat('plan', 'RoundTripMs', fallback=2.0)
+CONNECT_MS = u.config.getfloat('plan', 'ConnectMs', fallback=50.0)
+JOIN_RECORD_MS = u.config.getfloat('plan', 'JoinRecordMs', fallback=0.05)
+STORE_OPEN_MS = u.config.getfloat('plan', 'StoreOpenMs', fallback=100.0)
+STORE_RECORD_MS = u.config.getfloat('plan', 'StoreRecordMs', fallback=0.02)
+STORE_HIT_RATIO = u.config.getfloat('plan', 'StoreHitRatio', fallback=0.5)
+SAMPLE_BYTES = u.config.getint('plan', 'SampleKB', fallback=256) * 1024
+
+# Mean queries per record of stages that run more than one (BigRefGene
+# stops at the first of its three tables with rows)
+QUERIES = {
+    ann.BigRefGeneStage: 2,
+}
+
+
+"""Estimated size of the bytes [start, end) of a VCF: bytes and data
+   lines, the bytes after the header divided by the mean length of the
+   lines of a sample taken after it
+"""
+def estimate(infile, start=0, end=None):
+    if end is None:
+        end = os.path.getsize(infile)
+    fh = open(infile, 'rb')
+    fh.seek(start)
+    # Skip the header first (as driver.header_end()): with many samples it
+    # can be longer than the sample
+    data_start = start
+    line = fh.readline()
+    while (data_start < end and len(line) > 0 and
+        (ann.isHeader(line, 0) or line in (b'\n', b'\r\n'))):
+        data_start = data_start + len(line)
+        line = fh.readline()
+    fh.seek(data_start)
+    sample = fh.read(min(SAMPLE_BYTES, max(0, end - data_start)))
+    fh.close()
+
+    truncated = (len(sample) < end - data_start)
+    if truncated:
+        # The last line of a cut sample is partial
+        sample = sample[:sample.rfind(b'\n') + 1] or sample
+    lines = 0
+    data = 0
+    for line in sample.split(b'\n'):
+        if (len(line) > 0):
+            lines = lines + 1
+            data = data + len(line) + 1
+    if (truncated and lines > 0):
+        lines = int((end - data_start) / (data / lines))
+    return {'bytes': end - start, 'lines': lines}
+
+
+"""Queries per record of a stage
+"""
+def queries(stage):
+    for cls, count in QUERIES.items():
+        if isinstance(stage, cls):
+            return count
+    return 1
+
+
+"""(fixed ms, ms per record) of running stage with each engine it can use
+"""
+def costs(stage, concurrency):
+    per_record = queries(stage) * ROUND_TRIP_MS
+    options = {
+        'variant': (0.0, per_record),
+        'pool': (0.0, per_record / concurrency),
+    }
+    joins = stage.joinQueries(bulk.SITES, bulk.JOIN['mysql'])
+    if joins is not None:
+        options['bulk'] = ((2 + len(joins)) * ROUND_TRIP_MS,
+            (1 + len(joins)) * ROUND_TRIP_MS / ann.CHUNK_SIZE +
+            JOIN_RECORD_MS)
+    return options
+
+
+"""Cheapest plan of stages for a job of size (estimate()) split among
+   workers. site_store is the configured store, if any. Returns the plan:
+   the engine of each stage, whether to open the site store and the
+   estimated cost.
+"""
+def choose(size, stages, workers=1, site_store=None,
+    concurrency=pool.CONCURRENCY):
+    records = size['lines'] / max(1, workers)
+    lookups = [stage for stage in stages
+        if not isinstance(stage, ann.FilterStage)]
+
+    best = None
+    for pooled in (False, True):
+        engines = {}
+        fixed = concurrency * CONNECT_MS if pooled else 0.0
+        per_record = 0.0
+        for stage in lookups:
+            options = costs(stage, concurrency)
+            if not pooled:
+                del options['pool']
+            name = min(options, key=lambda name: options[name][0] +
+                records * options[name][1])
+            engines[stage.name] = name
+            fixed = fixed + options[name][0]
+            per_record = per_record + options[name][1]
+        if (pooled and 'pool' not in engines.values()):
+            continue
+        cost = fixed + records * per_record
+        if (best is None or cost < best[0]):
+            best = (cost, engines, per_record)
+
+    cost, engines, per_record = best
+    store = False
+    if site_store:
+        saved = records * STORE_HIT_RATIO * per_record
+        spent = STORE_OPEN_MS + records * STORE_RECORD_MS
+        store = (saved > spent)
+        if store:
+            cost = cost - saved + spent
+    return {
+        'bytes': size['bytes'],
+        'lines': size['lines'],
+        'workers': workers,
+        'stages': engines,
+        'site_store': store,
+        'cost_ms': round(cost, 1),
+    }
+
+
+"""One line per engine of a plan, for the job log
+"""
+def describe(plan):
+    by_engine = {}
+    for stage, name in plan['stages'].items():
+        by_engine.setdefault(name, []).append(stage)
+    return [f"Plan for {plan['lines']} records ({plan['bytes']} bytes, " +
+        f"{plan['workers']} workers): estimated {plan['cost_ms']} ms, " +
+        f"site store {'on' if plan['site_store'] else 'off'}"] + \
+        [f"  {name}: {', '.join(names)}" for name, names in by_engine.items()]
+
+
+"""Engine running each stage with the engine of its plan
+   engines maps engine names to engines on one connection; stages whose
+   engine is None (variant) are looked up one variant at a time.
+"""
+class StageEngines(object):
+    name = 'plan'
+
+    def __init__(self, stages, engines):
+        self.stages = stages
+        self.engines = engines
+
+    def begin(self, stages, records):
+        for name, engine in self.engines.items():
+            if engine is not None:
+                engine.begin([stage for stage in stages
+                    if self.stages.get(stage.name) == name], records)
+
+    def rows(self, stage, records):
+        engine = self.engines.get(self.stages.get(stage.name))
+        if engine is None:
+            return None
+        return engine.rows(stage, records)
+
+    def end(self):
+        for engine in self.engines.values():
+            if engine is not None:
+                engine.end()
+
+    def close(self):
+        for engine in self.engines.values():
+            if engine is not None:
+                engine.close()
+
+### EOF
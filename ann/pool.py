@@ -0,0 +1,100 @@
+# pool.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Concurrent per-variant lookups over a pool of database connections
+#
+# The variant engine waits for every query before sending the next one,
+# so a job spends most of its time on network round trips. PooledLookup
+# keeps up to Concurrency ([db] section of ann_config.ini) queries in
+# flight: the lookups of a stage are handed to a pool of threads, each
+# taking one of as many pooled connections for the query. Rows come back
+# in any order and are kept in a reorder buffer - one slot per record -
+# so the stage annotates the records in input order, and output and count
+# log are the same as with one connection.
+#
+# Lookups only read the database (Stage.fetch()); annotating a record
+# with its rows, and the few queries that depend on them (promoter regions
+# of refGene), stay on the job's own connection.
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+import utils as u
+
+# Queries in flight per job (threads and pooled connections)
+CONCURRENCY = u.config.getint('db', 'Concurrency', fallback=8)
+
+
+"""Looks up the rows of the records of a stage concurrently on a pool of
+   connections; cursor is the job's own cursor (not used for lookups)
+"""
+class PooledLookup(object):
+    name = 'pool'
+
+    def __init__(self, cursor, concurrency=CONCURRENCY):
+        self.cursor = cursor
+        self.concurrency = max(1, int(concurrency))
+        self.connections = []
+        self.cursors = queue.Queue()
+        self.executor = None
+        self.lookups = None
+
+    """Opens the pool on first use, so a job without lookups opens no
+       connections
+    """
+    def open(self):
+        if self.executor is None:
+            for i in range(self.concurrency):
+                conn = u.db_connect()
+                self.connections.append(conn)
+                self.cursors.put(conn.cursor())
+            self.executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                thread_name_prefix='lookup')
+
+    """Rows of rec for stage, on a pooled cursor (runs in a pool thread)
+    """
+    def fetch(self, stage, rec):
+        cursor = self.cursors.get()
+        try:
+            return stage.fetch(cursor, rec)
+        finally:
+            self.cursors.put(cursor)
+
+    """Only the records that need lookups are fetched: the other records
+       of the chunk are replayed from the dedup cache
+    """
+    def begin(self, stages, records):
+        self.lookups = set([id(rec) for rec in records])
+
+    """Rows of every record, in the order of records; None for a record
+       that is not fetched (replayed from the cache, or looked up on its
+       own)
+    """
+    def rows(self, stage, records):
+        pending = [rec for rec in records if id(rec) in self.lookups]
+        if (len(pending) == 0):
+            return None
+        self.open()
+        futures = dict([(id(rec), self.executor.submit(self.fetch, stage,
+            rec)) for rec in pending])
+        return [futures[id(rec)].result() if id(rec) in futures else None
+            for rec in records]
+
+    def end(self):
+        self.lookups = None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        for conn in self.connections:
+            conn.close()
+        self.connections = []
+        self.cursors = queue.Queue()
+
+### EOF
@@ -0,0 +1,318 @@
+# reannotate.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Incremental re-annotation of stored results after reference tables are
+# refreshed
+#
+# Reads an existing .annot.vcf, strips the INFO items written by the
+# changed stages (and the ID column for dbSNP), runs only those stages
+# again and writes the new version, updating their lines in the count
+# log. Stages that write the same INFO keys (BigRefGene and refGene) are
+# always re-run together.
+#
+#   python reannotate.py --stages gwasCatalog job.annot.vcf
+#   python reannotate.py --stages dgv_Cnv,conrad_Cnv \
+#       --bucket mpcs-cc-gas-results --prefix xuhanxie/
+#
+# The batch mode rewrites every <prefix>*.annot.vcf in the bucket in place
+# (with bucket versioning the previous version is kept), together with its
+# count log and the region and query indexes derived from it.
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+import sys
+import argparse
+import boto3
+from botocore.exceptions import ClientError
+
+import annotate as ann
+import driver
+import file_utils as fu
+import perf
+import region_index
+import sidecar
+import utils as u
+import variant as v
+
+
+"""Runs of consecutive stages to re-run, in pipeline order
+
+   names is a list of stage names; a stage sharing INFO keys with a
+   selected one is selected too. Returns a list of (run, later) pairs,
+   where later are the unselected stages after the run.
+"""
+def select_runs(stages, names):
+    unknown = set(names) - set([stage.name for stage in stages])
+    if (len(unknown) > 0):
+        raise ValueError('Unknown stages: ' + ', '.join(sorted(unknown)))
+
+    selected = set(names)
+    grown = True
+    while grown:
+        grown = False
+        for a in stages:
+            for b in stages:
+                if (a.name in selected and b.name not in selected and
+                    set(a.infoKeys()) & set(b.infoKeys())):
+                    selected.add(b.name)
+                    grown = True
+
+    runs = []
+    run = []
+    for i, stage in enumerate(stages + [None]):
+        if (stage is not None and stage.name in selected):
+            run.append(stage)
+        elif (len(run) > 0):
+            later = [s for s in stages[i:] if s.name not in selected]
+            runs.append((run, later))
+            run = []
+    return runs
+
+
+"""Strips the items of a run of stages from a record's INFO
+
+   The items before the first item of a later stage stay in rec.info, so
+   the stages see the record as they would in a full run; the items from
+   there on are returned, to be appended after the new ones.
+"""
+def stripItems(rec, run, later):
+    before = []
+    after = []
+    for key, value in rec.info:
+        if any([stage.owns(key, value) for stage in run]):
+            continue
+        if (len(after) > 0 or
+            any([stage.owns(key, value) for stage in later])):
+            after.append((key, value))
+        else:
+            before.append((key, value))
+    rec.info = before
+    return after
+
+
+"""Re-runs the stages of runs on one buffer of lines of an annotated VCF
+   Header lines are copied; note is written before the #CHROM line.
+"""
+def reannotateLines(buf, mv, lines, runs, cursor, fh_out, profiler, note):
+    with profiler.span('parse') as span:
+        records = []
+        for start, end in lines:
+            if ann.isHeader(buf, start):
+                if (buf[start:start + 6] == b'#CHROM'):
+                    fh_out.write(note)
+                fh_out.write(bytes(mv[start:end]).strip() + b'\n')
+            elif (buf[start] not in b'\r\n'):
+                records.append(v.parse_record(buf, start, end, mv))
+        span.records += len(records)
+
+    for run, later in runs:
+        rest = [stripItems(rec, run, later) for rec in records]
+        for stage in run:
+            with profiler.span(stage.name) as span:
+                for rec in records:
+                    stage.annotate(cursor, rec)
+                span.records += len(records)
+        for rec, after in zip(records, rest):
+            rec.extend(after)
+
+    with profiler.span('write') as span:
+        pieces = []
+        for rec in records:
+            pieces.extend(rec.pieces())
+        fh_out.writelines(pieces)
+        span.records += len(records)
+    return len(records)
+
+
+"""Re-annotates infile into outfile with the stages named in names
+   stages are fresh stages (driver.build_stages()); the counts of the
+   re-run ones are left in them. Returns the number of records.
+"""
+def reannotateVcf(infile, outfile, stages, names, cursor, profiler=None):
+    if profiler is None:
+        profiler = perf.Profiler()
+    runs = select_runs(stages, names)
+    rerun = [stage.name for run, later in runs for stage in run]
+    note = ('##reannotated=' + ','.join(rerun) + '\n').encode('utf-8')
+
+    fh = open(infile, 'rb', buffering=0)
+    fh_out = open(outfile, 'wb')
+    records = 0
+    for buf, mv, lines in v.read_chunks(fh):
+        records += reannotateLines(buf, mv, lines, runs, cursor, fh_out,
+            profiler, note)
+    fh.close()
+    fh_out.close()
+    return records
+
+
+"""Replaces the lines of the re-run stages in an existing count log
+   Every stage writes a fixed number of lines, so the old log is split by
+   stage. Returns False, leaving the log alone, if it does not match.
+"""
+def updateCountLog(logfile, stages, names):
+    fh = open(logfile)
+    old = fh.read().splitlines()
+    fh.close()
+
+    sizes = [len(stage.log_lines()) for stage in stages]
+    if (sum(sizes) != len(old)):
+        print(f"Count log {logfile} does not match the stages; not updated")
+        return False
+
+    lines = []
+    i = 0
+    for stage, size in zip(stages, sizes):
+        if stage.name in names:
+            lines.extend(stage.log_lines())
+        else:
+            lines.extend(old[i:i + size])
+        i = i + size
+    fh = open(logfile, 'w')
+    fh.write('\n'.join(lines) + '\n')
+    fh.close()
+    return True
+
+
+"""Count log of a results file, as named by run.py
+"""
+def countLogName(annot):
+    return annot[:-len('.annot.vcf')] + '.vcf.count.log'
+
+
+"""Re-annotates one results file in place, with its count log if present
+   Returns the names of the stages that were re-run.
+"""
+def reannotateFile(annot, names, cursor, logfile=None, outfile=None):
+    stages = driver.build_stages()
+    tmp = annot + '.reannotating'
+    records = reannotateVcf(annot, tmp, stages, names, cursor)
+    os.replace(tmp, outfile or annot)
+
+    rerun = [stage.name for run, later in select_runs(stages, names)
+        for stage in run]
+    logfile = logfile or countLogName(annot)
+    if fu.isExist(logfile):
+        updateCountLog(logfile, stages, rerun)
+    print(f"{annot}: {records} records, re-ran {', '.join(rerun)}")
+    return rerun
+
+
+"""Keys of the derived files of a results object, as named by run.py
+"""
+def derivedKeys(key):
+    prefix = key[:-len('.annot.vcf')]
+    return {
+        'log': prefix + '.vcf.count.log',
+        'region': key + '.gz',
+        'region_index': key + '.gz.idx',
+        'query_index': prefix + '.annot.db',
+        'sidecar': prefix + '.annot.parquet',
+    }
+
+
+def s3_exists(s3, bucket, key):
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+    except ClientError:
+        return False
+    return True
+
+
+"""Re-annotates every <prefix>*.annot.vcf of an S3 bucket in place
+   The count log, region index, query index and Parquet sidecar are
+   rebuilt and replaced where they exist. Returns the number of files.
+"""
+def reannotateBucket(bucket, prefix, names, cursor, workdir,
+    region_name=None):
+    s3 = boto3.client('s3', region_name=region_name)
+    fu.mkdirp(workdir)
+    done = 0
+
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if not key.endswith('.annot.vcf'):
+                continue
+            annot = os.path.join(workdir, key.replace('/', '_'))
+            derived = derivedKeys(key)
+            s3.download_file(bucket, key, annot)
+            logfile = countLogName(annot)
+            has_log = s3_exists(s3, bucket, derived['log'])
+            if has_log:
+                s3.download_file(bucket, derived['log'], logfile)
+
+            reannotateFile(annot, names, cursor, logfile)
+            s3.upload_file(annot, bucket, key)
+            if has_log:
+                s3.upload_file(logfile, bucket, derived['log'])
+
+            files = [logfile]
+            if s3_exists(s3, bucket, derived['region']):
+                blocks, index = region_index.write_blocks(annot)
+                s3.upload_file(blocks, bucket, derived['region'])
+                s3.upload_file(index, bucket, derived['region_index'])
+                files.extend([blocks, index])
+            if s3_exists(s3, bucket, derived['query_index']):
+                files.append(sidecar.write_sqlite(annot))
+                s3.upload_file(files[-1], bucket, derived['query_index'])
+            if s3_exists(s3, bucket, derived['sidecar']):
+                parquet = sidecar.write_parquet(annot)
+                if parquet is not None:
+                    s3.upload_file(parquet, bucket, derived['sidecar'])
+                    files.append(parquet)
+
+            for path in files + [annot]:
+                fu.delete(path)
+            done = done + 1
+    print(f"Re-annotated {done} results under s3://{bucket}/{prefix}")
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Re-run selected annotation stages on stored results')
+    parser.add_argument('--stages', required=True,
+        help='comma separated stage names, e.g. gwasCatalog,dgv_Cnv')
+    parser.add_argument('annot', nargs='*', help='.annot.vcf files')
+    parser.add_argument('--out', help='output file (one input only)')
+    parser.add_argument('--log', help='count log (one input only)')
+    parser.add_argument('--bucket', help='results bucket (batch mode)')
+    parser.add_argument('--prefix', default='', help='key prefix')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--workdir', default='reannotate-work')
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.stages.split(',')]
+    try:
+        select_runs(driver.build_stages(), names)
+    except ValueError as e:
+        print(e)
+        print('Stages: ' + ', '.join([name for name, stage, kwargs in
+            driver.STAGES]))
+        return 1
+    if (len(args.annot) > 1 and (args.out or args.log)):
+        print('--out and --log need a single input file')
+        return 1
+
+    conn = u.db_connect()
+    cursor = conn.cursor()
+    if args.bucket:
+        reannotateBucket(args.bucket, args.prefix, names, cursor,
+            args.workdir, args.region)
+    for annot in args.annot:
+        reannotateFile(annot, names, cursor, args.log, args.out)
+    conn.close()
+    u.print_query_summary()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+### EOF
@@ -0,0 +1,216 @@
+# reference.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Versioned snapshots of the reference data
+#
+# A release of the reference data - the database of annotation tables and
+# the site store built from it - is published as a snapshot with a version
+# label, and the snapshots in service are listed in a manifest:
+#
+#   {"current": "2019-06",
+#    "snapshots": {
+#      "2019-05": {"database": "annotator_201905",
+#                  "site_store": "/data/reference/2019-05/known.sites"},
+#      "2019-06": {"database": "annotator_201906",
+#                  "site_store": "/data/reference/2019-06/known.sites"}}}
+#
+# A snapshot names the MySQL database of its tables (or "sqlite_db", a
+# local copy) and optionally its site store. The annotator daemon watches
+# the manifest ([reference] Manifest). When it changes, the new current
+# snapshot is loaded in a background thread - its site store read into
+# the page cache, its tables probed - and swapped in with one assignment.
+# Jobs launched after that run on the new snapshot; jobs already running
+# keep the one they were launched with, which run.py gets in its
+# environment. Fan-out chunk tasks carry the version of their job, and a
+# checkpoint written on another version is not resumed, so no job mixes
+# two versions. Keep a retired snapshot listed, and its tables in place,
+# until the jobs using it are done.
+#
+# Each job records the version it used in its perf report
+# ("reference_version") and DynamoDB item.
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+import json
+import threading
+import time
+
+import sitestore
+import utils as u
+
+# Environment of a job process launched on a snapshot
+ENV = {
+    'version': 'ANNOTATOR_REFERENCE_VERSION',
+    'database': 'ANNOTATOR_DATABASE',
+    'sqlite_db': 'ANNOTATOR_SQLITE_DB',
+    'site_store': 'ANNOTATOR_SITE_STORE',
+}
+
+# Seconds between checks of the manifest
+POLL_SECS = u.config.getint('reference', 'PollSecs', fallback=30)
+
+# Tables queried to check that the database of a snapshot is in place
+PROBE_TABLES = ['dbSNP', 'refGene']
+
+# Bytes of the site store read at a time to load it into the page cache
+WARM_BYTES = 1024 * 1024
+
+
+"""Version of the reference the current process runs on, or None when
+   it was not launched on a snapshot
+"""
+def version():
+    return os.environ.get(ENV['version']) or None
+
+
+"""Site store of the snapshot the current process runs on; default (the
+   configured store) when it was not launched on a snapshot
+"""
+def site_store(default=None):
+    value = os.environ.get(ENV['site_store'])
+    if value is None:
+        return default
+    return value or None
+
+
+"""One version of the reference data
+"""
+class Snapshot(object):
+    def __init__(self, version, database=None, sqlite_db=None,
+        site_store=None):
+        self.version = version
+        self.database = database
+        self.sqlite_db = sqlite_db
+        self.site_store = site_store
+
+    """Environment variables of a job running on this snapshot; unset
+       values are empty, so the daemon's own settings do not leak in
+    """
+    def env(self):
+        return {
+            ENV['version']: self.version,
+            ENV['database']: self.database or '',
+            ENV['sqlite_db']: self.sqlite_db or '',
+            ENV['site_store']: self.site_store or '',
+        }
+
+    """Reads the site store into the page cache and checks that the
+       tables can be queried; raises an exception if the snapshot is not
+       usable
+    """
+    def load(self):
+        if self.site_store:
+            store = sitestore.SiteStore(self.site_store)
+            for offset in range(0, len(store.mm), WARM_BYTES):
+                store.mm[offset:offset + WARM_BYTES]
+            store.close()
+        conn = u.db_connect(database=self.database,
+            sqlite_db=self.sqlite_db or '')
+        cursor = conn.cursor()
+        for table in PROBE_TABLES:
+            cursor.execute('select 1 from ' + table + ' limit 1;')
+            cursor.fetchall()
+        conn.close()
+
+
+"""Current version and snapshots {version: Snapshot} of a manifest file
+   Raises ValueError if the current version is not listed.
+"""
+def read_manifest(filename):
+    fh = open(filename)
+    manifest = json.load(fh)
+    fh.close()
+    snapshots = dict([(version, Snapshot(version, **fields))
+        for version, fields in manifest['snapshots'].items()])
+    if manifest['current'] not in snapshots:
+        raise ValueError(f"Current version {manifest['current']} is not " +
+            "listed")
+    return manifest['current'], snapshots
+
+
+"""Keeps the current snapshot of a manifest, reloading it in the
+   background when the manifest changes (annotator daemon)
+"""
+class Watcher(object):
+    def __init__(self, manifest, interval=POLL_SECS):
+        self.manifest = manifest
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.current = None
+        self.snapshots = {}
+        self.stamp = None
+        self.checked = 0
+        self.loading = None
+
+    """(mtime, size) of the manifest, or None if it cannot be read
+    """
+    def manifest_stamp(self):
+        try:
+            info = os.stat(self.manifest)
+        except OSError:
+            return None
+        return (info.st_mtime, info.st_size)
+
+    """Starts loading the manifest in a background thread if it changed
+       since it was last read; at most every interval seconds
+    """
+    def poll(self):
+        if (time.time() - self.checked < self.interval):
+            return
+        self.checked = time.time()
+        if (self.loading is not None and self.loading.is_alive()):
+            return
+        stamp = self.manifest_stamp()
+        if (stamp is None or stamp == self.stamp):
+            return
+        self.loading = threading.Thread(target=self.reload, args=(stamp,),
+            daemon=True)
+        self.loading.start()
+
+    """Reads the manifest and, if its current version is new, loads that
+       snapshot and swaps it in. A manifest that cannot be loaded leaves
+       the current snapshot in service and is not read again until it
+       changes.
+    """
+    def reload(self, stamp=None):
+        self.stamp = stamp or self.manifest_stamp()
+        try:
+            current, snapshots = read_manifest(self.manifest)
+            snapshot = snapshots[current]
+            if (self.current is None or self.current.version != current):
+                start = time.time()
+                snapshot.load()
+                print(f"Reference {current} loaded in " +
+                    f"{time.time() - start:.1f} s")
+            else:
+                snapshot = self.current
+        except Exception as e:
+            print(f"Not loading reference manifest {self.manifest}: {e}")
+            return False
+
+        with self.lock:
+            previous = self.current
+            self.snapshots = snapshots
+            self.current = snapshot
+        if (previous is not None and previous is not snapshot):
+            print(f"Reference {previous.version} replaced by " +
+                f"{snapshot.version} for new jobs")
+        return True
+
+    """Snapshot of a job: the one of version (a fan-out chunk of a job
+       started earlier) while it is listed, else the current one; None if
+       no snapshot was loaded
+    """
+    def snapshot(self, version=None):
+        with self.lock:
+            if version is None or version in self.snapshots:
+                return self.snapshots.get(version) or self.current
+            print(f"Reference {version} is no longer listed; using " +
+                f"{self.current.version if self.current else 'none'}")
+            return self.current
+
+### EOF
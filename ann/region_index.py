@@ -0,0 +1,256 @@
+# region_index.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Block-compressed copy of an annotated VCF plus a coordinate index, so the
+# web app can fetch and decompress only the blocks covering a region
+#
+# File layout:
+#   <prefix>.annot.vcf.gz      - concatenated gzip members (one per block);
+#                                still a valid .gz that zcat/gunzip can read
+#   <prefix>.annot.vcf.gz.idx  - binary index of the blocks, read with byte
+#                                ranges (BlockIndex):
+#       magic, JSON length (uint32), JSON summary
+#           {"version": 2, "header": {"offset": 0, "length": N},
+#            "chroms": {"1": {"first": 0, "count": 120,
+#                             "marks": [maxend, ...]}, ...}}
+#       then one fixed-size entry per block
+#           (start, end, maxend, offset, length, records)
+#
+# The entries of a chromosome are contiguous and sorted by start; maxend is
+# the largest end up to and including the entry, so it never decreases and
+# the first block that can overlap a position is found by binary search.
+# marks has the maxend of the last entry of every PAGE_ENTRIES entries of
+# the chromosome, so a lookup reads the summary and one page of entries
+# whatever the size of the file.
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import bisect
+import gzip
+import json
+import struct
+
+from regions import normalize_chrom
+
+MAGIC = b'ANNRIDX2'
+INDEX_VERSION = 2
+LENGTH = struct.Struct('<I')
+ENTRY = struct.Struct('<IIIQII')
+ENTRY_FIELDS = ['start', 'end', 'maxend', 'offset', 'length', 'records']
+
+# Uncompressed bytes per block; a block never spans two chromosomes
+BLOCK_SIZE = 65536
+
+# Entries read per range request
+PAGE_ENTRIES = 4096
+
+# Bytes read first, enough for the summary of most indexes
+PREAMBLE_BYTES = 65536
+
+
+"""Writes the gzip member for one block and returns its index entry
+"""
+def _flush_block(fh_out, lines, chrom, start, end, records):
+    data = gzip.compress(''.join(lines).encode('utf-8'))
+    offset = fh_out.tell()
+    fh_out.write(data)
+    return {'chrom': chrom, 'start': start, 'end': end,
+        'offset': offset, 'length': len(data), 'records': records}
+
+
+"""Writes the header lines as the first gzip member
+"""
+def _flush_header(fh_out, header):
+    data = gzip.compress(''.join(header).encode('utf-8'))
+    offset = fh_out.tell()
+    fh_out.write(data)
+    return {'offset': offset, 'length': len(data)}
+
+
+"""Groups blocks by chromosome (in order of first appearance), sorts the
+   blocks of each by start and adds their running maxend
+   Returns the chromosome summaries and the entries in index order.
+"""
+def _sort_blocks(blocks):
+    by_chrom = {}
+    for block in blocks:
+        by_chrom.setdefault(block['chrom'], []).append(block)
+
+    chroms = {}
+    entries = []
+    for chrom, chrom_blocks in by_chrom.items():
+        chrom_blocks.sort(key=lambda block: block['start'])
+        first = len(entries)
+        maxend = 0
+        marks = []
+        for i, block in enumerate(chrom_blocks):
+            maxend = max(maxend, block['end'])
+            entries.append(dict(block, maxend=maxend))
+            if ((i + 1) % PAGE_ENTRIES == 0 or i == len(chrom_blocks) - 1):
+                marks.append(maxend)
+        chroms[chrom] = {'first': first, 'count': len(chrom_blocks),
+            'marks': marks}
+    return chroms, entries
+
+
+"""Writes <vcf>.gz and <vcf>.gz.idx for an annotated VCF
+   Returns the (blockfile, indexfile) paths
+"""
+def write_blocks(vcf, outfile=None, indexfile=None, block_size=BLOCK_SIZE):
+    if (outfile is None):
+        outfile = vcf + '.gz'
+    if (indexfile is None):
+        indexfile = outfile + '.idx'
+
+    header = []
+    header_entry = None
+    blocks = []
+    lines = []
+    size = 0
+    chrom = None
+    start = end = 0
+
+    fh = open(vcf, 'r')
+    fh_out = open(outfile, 'wb')
+
+    for line in fh:
+        if line.startswith('#'):
+            header.append(line)
+            continue
+
+        if (header_entry is None):
+            header_entry = _flush_header(fh_out, header)
+
+        if not line.endswith('\n'):
+            line = line + '\n'
+        fields = line.split('\t', 2)
+        this_chrom = normalize_chrom(fields[0])
+        pos = int(fields[1].strip())
+
+        if (len(lines) > 0 and (this_chrom != chrom or size >= block_size)):
+            blocks.append(_flush_block(fh_out, lines, chrom, start, end,
+                len(lines)))
+            lines = []
+            size = 0
+
+        if (len(lines) == 0):
+            chrom = this_chrom
+            start = end = pos
+
+        lines.append(line)
+        size = size + len(line)
+        start = min(start, pos)
+        end = max(end, pos)
+
+    if (len(lines) > 0):
+        blocks.append(_flush_block(fh_out, lines, chrom, start, end,
+            len(lines)))
+
+    if (header_entry is None):
+        header_entry = _flush_header(fh_out, header)
+
+    fh.close()
+    fh_out.close()
+
+    chroms, entries = _sort_blocks(blocks)
+    summary = json.dumps({
+        'version': INDEX_VERSION,
+        'header': header_entry,
+        'chroms': chroms,
+    }).encode('utf-8')
+    fh_idx = open(indexfile, 'wb')
+    fh_idx.write(MAGIC + LENGTH.pack(len(summary)) + summary)
+    for entry in entries:
+        fh_idx.write(ENTRY.pack(*[entry[field] for field in ENTRY_FIELDS]))
+    fh_idx.close()
+
+    return outfile, indexfile
+
+
+"""Reader of a block index through read(first, last), which returns the
+   bytes first..last of the index file (last included, as in an HTTP
+   Range) or None if they cannot be read
+
+   Entries are numbered in index order; entry() reads and keeps the page of
+   PAGE_ENTRIES entries holding one. Raises OSError when a read fails and
+   ValueError for an index it does not understand.
+"""
+class BlockIndex(object):
+    def __init__(self, read):
+        self.read = read
+        self.pages = {}
+        data = self.fetch(0, PREAMBLE_BYTES - 1)
+        if not data.startswith(MAGIC):
+            raise ValueError("Unknown index version (no region index magic)")
+
+        start = len(MAGIC) + LENGTH.size
+        size = LENGTH.unpack_from(data, len(MAGIC))[0]
+        if (len(data) < start + size):
+            data = data + self.fetch(len(data), start + size - 1)
+        summary = json.loads(data[start:start + size].decode('utf-8'))
+        if (summary.get('version') != INDEX_VERSION):
+            raise ValueError(f"Unknown index version {summary.get('version')}")
+        self.header = summary['header']
+        self.chroms = summary['chroms']
+        self.entries_offset = start + size
+
+    def fetch(self, first, last):
+        data = self.read(first, last)
+        if data is None:
+            raise OSError(f"Unable to read index bytes {first}-{last}")
+        return data
+
+    def entry(self, i):
+        page = i // PAGE_ENTRIES
+        if page not in self.pages:
+            first = self.entries_offset + page * PAGE_ENTRIES * ENTRY.size
+            data = self.fetch(first, first + PAGE_ENTRIES * ENTRY.size - 1)
+            self.pages[page] = [dict(zip(ENTRY_FIELDS,
+                ENTRY.unpack_from(data, k * ENTRY.size)))
+                for k in range(len(data) // ENTRY.size)]
+        return self.pages[page][i % PAGE_ENTRIES]
+
+    """Number of the first entry of chrom whose maxend reaches pos; None if
+       there is none
+    """
+    def first(self, chrom, pos):
+        summary = self.chroms.get(normalize_chrom(chrom))
+        if summary is None:
+            return None
+        page = bisect.bisect_left(summary['marks'], pos)
+        if (page == len(summary['marks'])):
+            return None
+        lo = summary['first'] + page * PAGE_ENTRIES
+        hi = min(lo + PAGE_ENTRIES, summary['first'] + summary['count']) - 1
+        while (lo < hi):
+            mid = (lo + hi) // 2
+            if (self.entry(mid)['maxend'] < pos):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    """(number, entry) of each block of chrom overlapping start..end, from
+       entry first (the cursor of a next page) or from the first block that
+       can overlap
+    """
+    def overlapping(self, chrom, start, end, first=None):
+        summary = self.chroms.get(normalize_chrom(chrom))
+        if summary is None:
+            return
+        if first is None:
+            first = self.first(chrom, start)
+            if first is None:
+                return
+        for i in range(max(first, summary['first']),
+            summary['first'] + summary['count']):
+            entry = self.entry(i)
+            if (entry['start'] > end):
+                return
+            if (entry['end'] >= start):
+                yield i, entry
+
+### EOF
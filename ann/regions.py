@@ -0,0 +1,106 @@
+# regions.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Interval index of the regions a job is restricted to (BED file or gene
+# list), used to drop out-of-region records before any database lookup
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import bisect
+
+# Bases added on both sides of a gene, enough for its putative promoter
+# (GeneStage promoter_offset)
+GENE_PADDING = 500
+
+
+"""Chromosome name without the "chr" prefix
+"""
+def normalize_chrom(chrom):
+    chrom = chrom.strip()
+    if chrom.startswith('chr'):
+        chrom = chrom[3:]
+    return chrom
+
+
+"""Sorted, merged intervals per chromosome
+
+   Intervals are 0-based and half-open as in BED: a VCF record at POS p is
+   inside [start, end) when start < p <= end. contains() is a binary search
+   over the interval starts of the chromosome.
+"""
+class RegionSet(object):
+    def __init__(self):
+        self.intervals = {}
+        self.starts = {}
+        self.ends = {}
+
+    def add(self, chrom, start, end):
+        self.intervals.setdefault(normalize_chrom(chrom), []).append(
+            (int(start), int(end)))
+
+    """Sorts and merges overlapping intervals; call once after add()
+    """
+    def finish(self):
+        for chrom, intervals in self.intervals.items():
+            merged = []
+            for start, end in sorted(intervals):
+                if (len(merged) > 0 and start <= merged[-1][1]):
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+                else:
+                    merged.append((start, end))
+            self.intervals[chrom] = merged
+            self.starts[chrom] = [start for start, end in merged]
+            self.ends[chrom] = [end for start, end in merged]
+        return self
+
+    def contains(self, chrom, pos):
+        starts = self.starts.get(chrom)
+        if starts is None:
+            return False
+        i = bisect.bisect_left(starts, pos) - 1
+        return (i >= 0 and pos <= self.ends[chrom][i])
+
+    def size(self):
+        return sum([len(intervals) for intervals in self.intervals.values()])
+
+
+"""Regions of a BED file; header, track and comment lines are skipped
+"""
+def from_bed(filename, padding=0):
+    regions = RegionSet()
+    fh = open(filename)
+    for line in fh:
+        if (line.startswith(('#', 'track', 'browser')) or line.strip() == ''):
+            continue
+        fields = line.split('\t') if '\t' in line else line.split()
+        regions.add(fields[0], max(0, int(fields[1]) - padding),
+            int(fields[2]) + padding)
+    fh.close()
+    return regions.finish()
+
+
+"""Regions of the transcripts of the genes (refGene name2), padded by
+   padding bases; genes not found are printed
+"""
+def from_genes(cursor, genes, padding=GENE_PADDING):
+    regions = RegionSet()
+    found = set()
+    genes = list(dict.fromkeys(genes))
+    for i in range(0, len(genes), 500):
+        batch = genes[i:i + 500]
+        cursor.execute('select chrom, txStart, txEnd, name2 from refGene ' +
+            'where name2 in (' + ','.join(['"' + gene.replace('"', '') + '"'
+            for gene in batch]) + ');')
+        for chrom, start, end, name in cursor.fetchall():
+            regions.add(str(chrom), max(0, int(start) - padding),
+                int(end) + padding)
+            found.add(str(name))
+    missing = [gene for gene in genes if gene not in found]
+    if (len(missing) > 0):
+        print(f"Genes not found in refGene: {', '.join(missing)}")
+    return regions.finish()
+
+### EOF
@@ -11,7 +11,12 @@ __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 import logging
 import sys
 import time
+import threading
+from decimal import Decimal
 import driver
+import reference
+import region_index
+import sidecar
 import os
 import boto3
 from botocore.config import Config
@@ -43,6 +48,49 @@ class Timer(object):
             print(f"Approximate runtime: {self.secs:.2f} seconds")
 
 
+"""Keeps the job's request message invisible in SQS while the job runs
+
+   The visibility timeout is extended from a background thread. If this
+   process dies the extensions stop, the message becomes visible again and
+   another annotator resumes the job from its checkpoint. delete() removes
+   the message once the job is completed.
+"""
+
+
+class MessageLease(object):
+    def __init__(self, receipt_handle):
+        self.receipt_handle = receipt_handle
+        self.queue_url = config['sqs']['sqsRequestsUrl']
+        self.timeout = config.getint('sqs', 'VisibilityTimeout', fallback=300)
+        self.sqs = boto3.client('sqs', config=s3_config())
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.extend, daemon=True)
+        self.thread.start()
+
+    def extend(self):
+        while not self.stopped.wait(self.timeout / 3):
+            try:
+                self.sqs.change_message_visibility(
+                    QueueUrl=self.queue_url,
+                    ReceiptHandle=self.receipt_handle,
+                    VisibilityTimeout=self.timeout)
+            except ClientError:
+                print("fail to extend the visibility of the request message")
+
+    def stop(self):
+        self.stopped.set()
+
+    def delete(self):
+        self.stop()
+        try:
+            self.sqs.delete_message(QueueUrl=self.queue_url,
+                                    ReceiptHandle=self.receipt_handle)
+        except ClientError:
+            print("fail to delete the request message")
+            return False
+        return True
+
+
 """
 helper functions for routers
 """
@@ -85,21 +133,29 @@ def s3_upload_files(file_name, bucket, object_name=None):
 # https://boto3.amazonaws.com/v1/documentation/api/latest/guide/dynamodb.html
 
 
-def dynamo_update(table_name, job_id, s3_res_bucket, s3_res, s3_log, completion_time, job_status):
+def dynamo_update(table_name, job_id, s3_res_bucket, s3_res, s3_log, completion_time, job_status, extra=None):
+    update_expression = "SET job_status=:r, s3_results_bucket=:a, s3_key_result_file=:b, s3_key_log_file=:c, complete_time=:d"
+    values = {
+        ':r': job_status,
+        ':a': s3_res_bucket,
+        ':b': s3_res,
+        ':c': s3_log,
+        ':d': completion_time
+    }
+    # optional extra attributes, e.g. keys of the region index files
+    if extra:
+        for i, (name, value) in enumerate(extra.items()):
+            update_expression += ", {}=:x{}".format(name, i)
+            values[':x{}'.format(i)] = value
+
     my_config = s3_config()
     try:
         dynamo = boto3.resource('dynamodb', config=my_config)
         table = dynamo.Table(table_name)
         table.update_item(
             Key={'job_id': job_id},
-            UpdateExpression="SET job_status=:r, s3_results_bucket=:a, s3_key_result_file=:b, s3_key_log_file=:c, complete_time=:d",
-            ExpressionAttributeValues={
-                ':r': job_status,
-                ':a': s3_res_bucket,
-                ':b': s3_res,
-                ':c': s3_log,
-                ':d': completion_time
-            },
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=values,
         )
     except ClientError:
         print("Fail to update and add info into dynamo database")
@@ -108,6 +164,30 @@ def dynamo_update(table_name, job_id, s3_res_bucket, s3_res, s3_log, completion_
     return True
 
 
+def perf_totals(report):
+    """Key totals of the performance report for the job's DynamoDB item
+
+    DynamoDB does not accept floats, so times are stored as Decimal.
+    """
+    totals = {
+        'perf_wall_secs': Decimal(str(round(report['wall_secs'], 3))),
+        'perf_cpu_secs': Decimal(str(round(report['cpu_secs'], 3))),
+        'perf_records': report['records'],
+        'perf_db_queries': report['db_queries'],
+        'perf_peak_rss_kb': report['peak_rss_kb'],
+        'perf_slowest_stage': report['slowest_stage'] or '',
+    }
+    # records per site looked up; a batched job served entirely from the
+    # cache of the batch has none
+    ratio = (report.get('dedup') or {}).get('dedup_ratio')
+    if ratio is not None:
+        totals['perf_dedup_ratio'] = Decimal(str(ratio))
+    # version of the reference snapshot the job ran on (reference.py)
+    if report.get('reference_version'):
+        totals['reference_version'] = report['reference_version']
+    return totals
+
+
 def notify_complete(data):
     # select the Topic arn to publish
     topic_arn = config['sns']['TopicArnResult']
@@ -124,72 +204,188 @@ def notify_complete(data):
     return True
 
 
+def complete_job(file_path, job_id, email, perf_report, results_uploaded=False):
+    """Uploads the results of an annotated job, records them in DynamoDB,
+    notifies the user and removes the local job files
+
+    file_path is the local input path; the results are expected next to it.
+    With results_uploaded=True the annotated VCF is already in the results
+    bucket (fan-out jobs merged by fanout.py).
+    """
+    data_path = config['ann']['DataPath']
+    file_path_list = file_path.split('/')
+    filename = file_path_list[-1]
+    username = file_path_list[-2]
+
+    # remove .vcf suffix
+    filename_prefix = filename[:-4]
+    log_path = data_path + username + "/" + filename_prefix + ".vcf.count.log"
+    perf_path = data_path + username + "/" + filename_prefix + ".vcf.perf.json"
+    annot_path = data_path + username + "/" + filename_prefix + ".annot.vcf"
+    sidecar_path = data_path + username + "/" + filename_prefix + ".annot.parquet"
+    query_db_path = data_path + username + "/" + filename_prefix + ".annot.db"
+
+    # create path in s3
+    object_name_prefix = config['s3']['User'] + "/" + username + "/"
+    log_obj_name = object_name_prefix + filename_prefix + ".vcf.count.log"
+    perf_obj_name = object_name_prefix + filename_prefix + ".vcf.perf.json"
+    annot_obj_name = object_name_prefix + filename_prefix + ".annot.vcf"
+    region_obj_name = annot_obj_name + ".gz"
+    region_idx_obj_name = region_obj_name + ".idx"
+    sidecar_obj_name = object_name_prefix + filename_prefix + ".annot.parquet"
+    query_db_obj_name = object_name_prefix + filename_prefix + ".annot.db"
+
+    bucket_name = config['s3']['BucketResult']
+    table_name = config['dynamodb']['TableName']
+    completion_time = int(time.time())
+    job_status = "COMPLETED"
+
+    # 1. upload the results file (already in place for a merged fan-out job)
+    if not results_uploaded and \
+            not s3_upload_files(annot_path, bucket_name, annot_obj_name):
+        print("fail to upload annot file")
+
+    # 2. upload the log file
+    if not s3_upload_files(log_path, bucket_name, log_obj_name):
+        print("fail to upload log file")
+
+    # 3. upload the performance report next to the log file
+    extra = perf_totals(perf_report)
+    if s3_upload_files(perf_path, bucket_name, perf_obj_name):
+        extra['s3_key_perf_report'] = perf_obj_name
+    else:
+        print("fail to upload performance report")
+
+    # upload the block-compressed results and their coordinate index
+    # used by the web app to serve region queries with range reads
+    region_path, region_idx_path = region_index.write_blocks(annot_path)
+    if s3_upload_files(region_path, bucket_name, region_obj_name) and \
+            s3_upload_files(region_idx_path, bucket_name, region_idx_obj_name):
+        extra['s3_key_region_file'] = region_obj_name
+        extra['s3_key_region_index'] = region_idx_obj_name
+    else:
+        print("fail to upload region index files")
+
+    # the Parquet sidecar is optional (WriteSidecar, pyarrow installed)
+    if os.path.exists(sidecar_path):
+        if s3_upload_files(sidecar_path, bucket_name, sidecar_obj_name):
+            extra['s3_key_sidecar_file'] = sidecar_obj_name
+        else:
+            print("fail to upload parquet sidecar")
+
+    # SQLite index answering the web app's filtered result queries
+    sidecar.write_sqlite(annot_path, query_db_path)
+    if s3_upload_files(query_db_path, bucket_name, query_db_obj_name):
+        extra['s3_key_query_index'] = query_db_obj_name
+    else:
+        print("fail to upload query index")
+
+    # 4. update the dynamo database
+    if not dynamo_update(table_name, job_id, bucket_name, annot_obj_name, log_obj_name, completion_time, job_status, extra):
+        print("fail to update the dynamo database")
+
+    # 5. publishes a notification to sns and trigger lambda function
+    data = {
+        "job_id": job_id,
+        "email": email,
+        "completion_time": completion_time,
+    }
+    print(data)
+
+    if not notify_complete(data):
+        print("fail to notify the job completion to users!")
+
+    # 6. clean up local job files
+    if os.path.exists(annot_path):
+        print(annot_path)
+        print('remove annot path')
+        os.remove(annot_path)
+    for path in (region_path, region_idx_path, sidecar_path, query_db_path, perf_path,
+                 annot_path + '.ckpt.json', file_path + '.regions.bed'):
+        if os.path.exists(path):
+            os.remove(path)
+    if os.path.exists(log_path):
+        print(log_path)
+        print('remove log path')
+        os.remove(log_path)
+    if os.path.exists(file_path):
+        print(file_path)
+        print('remove user path')
+        os.remove(file_path)
+
+
+def run_batch(manifest_path):
+    """Annotates the jobs of a batch manifest written by annotator.py and
+    completes each of them
+
+    The manifest is a JSON list of jobs (file_path, job_id, email,
+    receipt_handle, options). The request messages are kept invisible
+    until the batch is done; if it fails they are redelivered and the jobs
+    run one by one.
+    """
+    with open(manifest_path) as f:
+        jobs = json.load(f)
+    leases = [MessageLease(job['receipt_handle']) for job in jobs if job.get('receipt_handle')]
+    try:
+        with Timer():
+            perf_reports = driver.run_batch(
+                [(job['file_path'], {'stages': job['options'].get('stages'),
+                                     'bed': job['options'].get('bed'),
+                                     'genes': job['options'].get('genes'),
+                                     'passthrough': job['options'].get('region_passthrough', False),
+                                     'filters': job['options'].get('filters')}) for job in jobs],
+                write_sidecar=config.getboolean('ann', 'WriteSidecar', fallback=False),
+                dedup_max_sites=config.getint('ann', 'DedupMaxSites', fallback=1000000),
+                site_store=reference.site_store(config.get('ann', 'SiteStore', fallback='') or None),
+                engine=config.get('db', 'Engine', fallback='variant'))
+
+        for job, perf_report in zip(jobs, perf_reports):
+            complete_job(job['file_path'], job['job_id'], job['email'], perf_report)
+    finally:
+        for lease in leases:
+            lease.stop()
+
+    for lease in leases:
+        if not lease.delete():
+            print("a request message of the batch will be redelivered; its job is skipped then")
+    os.remove(manifest_path)
+
+
 if __name__ == '__main__':
+    # a batch of jobs coalesced by annotator.py (cohort mode)
+    if len(sys.argv) > 2 and sys.argv[1] == '--batch':
+        run_batch(sys.argv[2])
+
     # Call the AnnTools pipeline
-    if len(sys.argv) > 1:
-        with Timer():
-            driver.run(sys.argv[1], 'vcf')
-
-        data_path = config['ann']['DataPath']
-        file_path = sys.argv[1]
-        job_id = sys.argv[2]
-        email = sys.argv[3]
-
-        file_path_list = sys.argv[1].split('/')
-        filename = file_path_list[-1]
-        username = file_path_list[-2]
-
-        # remove .vcf suffix
-        filename_prefix = filename[:-4]
-        log_path = data_path + username + "/" + filename_prefix + ".vcf.count.log"
-        annot_path = data_path + username + "/" + filename_prefix + ".annot.vcf"
-
-        # create path in s3
-        object_name_prefix = config['s3']['User'] + "/" + username + "/"
-        log_obj_name = object_name_prefix + filename_prefix + ".vcf.count.log"
-        annot_obj_name = object_name_prefix + filename_prefix + ".annot.vcf"
-
-        bucket_name = config['s3']['BucketResult']
-        table_name = config['dynamodb']['TableName']
-        completion_time = int(time.time())
-        job_status = "COMPLETED"
-
-        # 1. upload the results file
-        if not s3_upload_files(annot_path, bucket_name, annot_obj_name):
-            print("fail to upload annot file")
-
-        # 2. upload the log file
-        if not s3_upload_files(log_path, bucket_name, log_obj_name):
-            print("fail to upload log file")
-
-        # 3. update the dynamo database
-        if not dynamo_update(table_name, job_id, bucket_name, annot_obj_name, log_obj_name, completion_time, job_status):
-            print("fail to update the dynamo database")
-
-        # 4. publishes a notification to sns and trigger lambda function
-        data = {
-            "job_id": job_id,
-            "email": email,
-            "completion_time": completion_time,
-        }
-        print(data)
-
-        if not notify_complete(data):
-            print("fail to notify the job completion to users!")
-
-        # 5. clean up local job files
-        if os.path.exists(annot_path):
-            print(annot_path)
-            print('remove annot path')
-            os.remove(annot_path)
-        if os.path.exists(log_path):
-            print(log_path)
-            print('remove log path')
-            os.remove(log_path)
-        if os.path.exists(file_path):
-            print(file_path)
-            print('remove user path')
-            os.remove(file_path)
+    elif len(sys.argv) > 1:
+        # the request message, when annotator.py hands it over (argv[4])
+        lease = None
+        if len(sys.argv) > 4 and sys.argv[4] != '-':
+            lease = MessageLease(sys.argv[4])
+        # optional job options (argv[5]): stages, genes, bed, region_passthrough, filters
+        options = json.loads(sys.argv[5]) if len(sys.argv) > 5 else {}
+        try:
+            with Timer():
+                perf_report = driver.run(sys.argv[1], 'vcf',
+                                         write_sidecar=config.getboolean('ann', 'WriteSidecar', fallback=False),
+                                         workers=config.getint('ann', 'Workers', fallback=1),
+                                         checkpoint_secs=config.getint('ann', 'CheckpointSecs', fallback=60),
+                                         stages=options.get('stages'),
+                                         bed=options.get('bed'),
+                                         genes=options.get('genes'),
+                                         passthrough=options.get('region_passthrough', False),
+                                         filters=options.get('filters'),
+                                         dedup_max_sites=config.getint('ann', 'DedupMaxSites', fallback=1000000),
+                                         site_store=reference.site_store(config.get('ann', 'SiteStore', fallback='') or None),
+                                         engine=config.get('db', 'Engine', fallback='variant'))
+
+            complete_job(sys.argv[1], sys.argv[2], sys.argv[3], perf_report)
+        finally:
+            if lease:
+                lease.stop()
+
+        if lease and not lease.delete():
+            print("the request message will be redelivered; the job is skipped then")
 
     else:
         print("A valid .vcf file must be provided as input to this program.")
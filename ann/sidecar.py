@@ -0,0 +1,379 @@
+# sidecar.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Sidecars of the per-variant annotations, so results can be filtered
+# without parsing the INFO strings of the annotated VCF:
+#   <prefix>.annot.parquet - columnar copy for column pruning and
+#                            predicate pushdown (needs pyarrow)
+#   <prefix>.annot.db      - small SQLite index used by the web query API
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import sqlite3
+import file_utils as fu
+import regions as rg
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Column type of every INFO key written by the annotation stages; a key that
+# repeats in one record keeps its first value for numeric/boolean columns
+# and the distinct values joined by ',' for string columns
+ANNOTATION_KEYS = [
+    ('DB', 'bool'),
+    ('VC', 'str'),
+    ('GMAF', 'float'),
+    ('name', 'dict'),
+    ('name2', 'dict'),
+    ('transcriptStrand', 'str'),
+    ('positionType', 'dict'),
+    ('frame', 'str'),
+    ('mrnaCoord', 'int'),
+    ('codonCoord', 'int'),
+    ('spliceDist', 'int'),
+    ('referenceCodon', 'str'),
+    ('referenceAA', 'str'),
+    ('variantCodon', 'str'),
+    ('variantAA', 'str'),
+    ('changesAA', 'str'),
+    ('functionalClass', 'str'),
+    ('codingCoordStr', 'str'),
+    ('proteinCoordStr', 'str'),
+    ('inCodingRegion', 'str'),
+    ('spliceInfo', 'str'),
+    ('uorfChange', 'str'),
+    ('exon', 'str'),
+    ('non_coding_exon', 'str'),
+    ('putativePromoterRegion', 'str'),
+    ('cytoBand', 'str'),
+    ('gadAll', 'str'),
+    ('gwasCatalog', 'str'),
+    ('miRNAsites', 'str'),
+    ('HGNC_GeneAnnotation', 'str'),
+    ('dgv_Cnv', 'bool'),
+    ('abParts_IG_T_CelReceptors', 'bool'),
+    ('mcCarroll_Cnv', 'bool'),
+    ('conrad_Cnv', 'bool'),
+    ('genomicSuperDups', 'bool'),
+    ('otherChrom', 'str'),
+    ('otherStart', 'int'),
+    ('otherEnd', 'int'),
+    ('tfbsRegion', 'str'),
+]
+
+# Fixed VCF columns, followed by the annotation keys and "other", which
+# keeps INFO items with keys not listed above
+VCF_COLUMNS = [
+    ('chrom', 'dict'),
+    ('pos', 'int'),
+    ('id', 'str'),
+    ('ref', 'str'),
+    ('alt', 'str'),
+    ('qual', 'str'),
+    ('filter', 'str'),
+]
+
+# Rows buffered (as column lists) before a row group is written, which
+# bounds the memory of the sidecar on the annotator; a row group never
+# spans two chromosomes, so a filter on chrom skips whole row groups
+ROW_GROUP_SIZE = 131072
+
+
+def _arrow_type(kind):
+    if (kind == 'bool'):
+        return pa.bool_()
+    elif (kind == 'int'):
+        return pa.int64()
+    elif (kind == 'float'):
+        return pa.float64()
+    elif (kind == 'dict'):
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+"""Arrow schema of the sidecar
+"""
+def schema():
+    columns = VCF_COLUMNS + ANNOTATION_KEYS + [('other', 'str')]
+    return pa.schema([(name, _arrow_type(kind)) for name, kind in columns])
+
+
+def _convert(kind, values):
+    if (kind == 'bool'):
+        return values[0] != 'False'
+    try:
+        if (kind == 'int'):
+            return int(values[0])
+        elif (kind == 'float'):
+            return float(values[0])
+    except ValueError:
+        return None
+    return ','.join(dict.fromkeys(values))
+
+
+"""Splits an INFO string into {key: [values]} in order of appearance
+   Flags (items without '=') get the value 'True'
+"""
+def parse_info(info):
+    parsed = {}
+    if (info == '.' or info == ''):
+        return parsed
+    for item in info.split(';'):
+        item = item.strip()
+        if (item == '' or item == '.'):
+            continue
+        key, sep, value = item.partition('=')
+        if (sep == ''):
+            value = 'True'
+        parsed.setdefault(key, []).append(value)
+    return parsed
+
+
+"""Converts one annotated VCF line into a row dict keyed by column name
+"""
+def parse_row(line):
+    fields = [f.strip() for f in line.rstrip('\n').split('\t', 8)]
+    row = {
+        'chrom': fields[0],
+        'pos': int(fields[1]),
+        'id': fields[2],
+        'ref': fields[3],
+        'alt': fields[4],
+        'qual': fields[5],
+        'filter': fields[6],
+    }
+    info = parse_info(fields[7])
+    for key, kind in ANNOTATION_KEYS:
+        values = info.pop(key, None)
+        row[key] = None if values is None else _convert(kind, values)
+
+    other = []
+    for key, values in info.items():
+        for value in values:
+            other.append(key + '=' + value)
+    row['other'] = ';'.join(other) if other else None
+    return row
+
+
+def _write_group(writer, table_schema, columns):
+    arrays = []
+    for field in table_schema:
+        values = columns[field.name]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    writer.write_table(pa.Table.from_arrays(arrays, schema=table_schema),
+        row_group_size=len(columns['chrom']))
+
+
+def _new_columns(table_schema):
+    return dict([(field.name, []) for field in table_schema])
+
+
+"""Writes the Parquet sidecar of an annotated VCF
+   Returns the sidecar path, or None if pyarrow is not installed
+"""
+def write_parquet(vcf, outfile=None, row_group_size=ROW_GROUP_SIZE):
+    if (pa is None):
+        print("pyarrow is not installed; skipping the Parquet sidecar")
+        return None
+
+    if (outfile is None):
+        outfile = vcf.replace('.annot.vcf', '') + '.annot.parquet'
+
+    table_schema = schema()
+    writer = pq.ParquetWriter(outfile, table_schema,
+        use_dictionary=['chrom', 'name', 'name2', 'positionType'])
+    columns = _new_columns(table_schema)
+    rows = 0
+    chrom = None
+
+    fh = open(vcf, 'r')
+    for line in fh:
+        if line.startswith('#'):
+            continue
+        row = parse_row(line)
+        if (rows > 0 and (row['chrom'] != chrom or rows >= row_group_size)):
+            _write_group(writer, table_schema, columns)
+            columns = _new_columns(table_schema)
+            rows = 0
+        chrom = row['chrom']
+        for name, values in columns.items():
+            values.append(row[name])
+        rows = rows + 1
+
+    if (rows > 0):
+        _write_group(writer, table_schema, columns)
+
+    fh.close()
+    writer.close()
+    return outfile
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE variants (
+    id INTEGER PRIMARY KEY,
+    chrom TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    rsid TEXT,
+    ref TEXT,
+    alt TEXT,
+    qual TEXT,
+    filter TEXT,
+    gmaf REAL,
+    gmaf_key REAL NOT NULL,
+    info TEXT
+);
+CREATE TABLE variant_genes (
+    gene TEXT NOT NULL,
+    variant_id INTEGER NOT NULL
+);
+CREATE TABLE variant_types (
+    position_type TEXT NOT NULL,
+    variant_id INTEGER NOT NULL
+);
+"""
+
+# Built after loading, which is much faster than maintaining them per insert
+SQLITE_INDEXES = """
+CREATE INDEX variants_chrom_pos ON variants (chrom, pos, id);
+CREATE INDEX variants_gmaf ON variants (gmaf_key, id);
+CREATE INDEX variant_genes_gene ON variant_genes (gene, variant_id);
+CREATE INDEX variant_types_type ON variant_types (position_type, variant_id);
+"""
+
+
+"""Writes the SQLite query index of an annotated VCF
+   Variants keep file order in variants.id; chrom is stored without "chr".
+   gmaf_key is gmaf with NULL (not in dbSNP) stored as -1, so the max_gmaf
+   filter is one comparison. Gene symbols (name2) and positionType values
+   are kept in their own tables so multi-valued filters can use an index.
+"""
+def write_sqlite(vcf, outfile=None, batch_size=10000):
+    if (outfile is None):
+        outfile = vcf.replace('.annot.vcf', '') + '.annot.db'
+
+    fu.delete(outfile)
+    conn = sqlite3.connect(outfile)
+    conn.executescript(SQLITE_SCHEMA)
+
+    variants = []
+    genes = []
+    types = []
+    variant_id = 0
+
+    fh = open(vcf, 'r')
+    for line in fh:
+        if line.startswith('#'):
+            continue
+        variant_id = variant_id + 1
+        fields = [f.strip() for f in line.rstrip('\n').split('\t', 8)]
+        info = parse_info(fields[7])
+
+        chrom = rg.normalize_chrom(fields[0])
+        gmaf = info.get('GMAF')
+        try:
+            gmaf = float(gmaf[0]) if gmaf else None
+        except ValueError:
+            gmaf = None
+
+        variants.append((variant_id, chrom, int(fields[1]), fields[2],
+            fields[3], fields[4], fields[5], fields[6], gmaf,
+            -1.0 if gmaf is None else gmaf, fields[7]))
+        for gene in dict.fromkeys(info.get('name2', [])):
+            genes.append((gene, variant_id))
+        for position_type in dict.fromkeys(info.get('positionType', [])):
+            types.append((position_type, variant_id))
+
+        if (len(variants) >= batch_size):
+            _insert_batch(conn, variants, genes, types)
+            variants, genes, types = [], [], []
+
+    _insert_batch(conn, variants, genes, types)
+    fh.close()
+
+    conn.executescript(SQLITE_INDEXES)
+    conn.commit()
+    conn.close()
+    return outfile
+
+
+def _insert_batch(conn, variants, genes, types):
+    conn.executemany('INSERT INTO variants VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+        variants)
+    conn.executemany('INSERT INTO variant_genes VALUES (?,?)', genes)
+    conn.executemany('INSERT INTO variant_types VALUES (?,?)', types)
+
+
+# Columns of a variant returned by query_variants()
+QUERY_COLUMNS = ['id', 'chrom', 'pos', 'rsid', 'ref', 'alt', 'qual', 'filter',
+    'gmaf', 'info']
+
+
+"""(sql, args) of a page of query_variants()
+"""
+def variants_query(gene=None, chrom=None, start=None, end=None,
+    position_types=None, max_gmaf=None, after=0, limit=100):
+    sql = 'SELECT ' + ', '.join(QUERY_COLUMNS) + ' FROM variants WHERE id > ?'
+    args = [after]
+    if gene:
+        sql += ' AND id IN (SELECT variant_id FROM variant_genes ' + \
+            'WHERE gene = ?)'
+        args.append(gene)
+    if position_types:
+        sql += ' AND id IN (SELECT variant_id FROM variant_types ' + \
+            'WHERE position_type IN (' + \
+            ','.join('?' * len(position_types)) + '))'
+        args.extend(position_types)
+    if chrom:
+        sql += ' AND chrom = ?'
+        args.append(chrom)
+        if start is not None:
+            sql += ' AND pos >= ?'
+            args.append(start)
+        if end is not None:
+            sql += ' AND pos <= ?'
+            args.append(end)
+    if max_gmaf is not None:
+        sql += ' AND gmaf_key < ?'
+        args.append(max_gmaf)
+    sql += ' ORDER BY id LIMIT ?'
+    args.append(limit + 1)
+    return sql, args
+
+
+"""Filtered, keyset-paginated query of the SQLite index of a job (web
+   query API); returns the variants of the page and the after of the next
+   page (None on the last page)
+
+   chrom/pos are served by (chrom, pos, id) and gene and position type
+   select the matching ids through (gene, variant_id) and
+   (position_type, variant_id). max_gmaf is checked on gmaf_key as the ids
+   are walked in order, so a page reads about limit rows divided by the
+   share of variants that pass (variants without a GMAF always pass).
+   Pages continue from the last variant id (after) instead of using
+   OFFSET, so a page does not read the pages before it.
+"""
+def query_variants(db_path, gene=None, chrom=None, start=None, end=None,
+    position_types=None, max_gmaf=None, after=0, limit=100):
+    sql, args = variants_query(gene, chrom, start, end, position_types,
+        max_gmaf, after, limit)
+    conn = sqlite3.connect('file:' + db_path + '?mode=ro', uri=True)
+    try:
+        rows = conn.execute(sql, args).fetchall()
+    finally:
+        conn.close()
+
+    variants = [dict(zip(QUERY_COLUMNS, row)) for row in rows[:limit]]
+    next_after = variants[-1]['id'] if len(rows) > limit else None
+    return variants, next_after
+
+### EOF
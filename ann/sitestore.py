@@ -0,0 +1,290 @@
+# sitestore.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Precomputed annotations of known variant sites
+#
+# An offline build runs every stage once on each known site (the dbSNP
+# table, or the sites of a VCF) and stores what each stage did to the
+# record, as dedup.SiteCache keeps it: the INFO items appended, the ID set
+# and the counter increments. A job opening the store annotates a known
+# site with one lookup in a memory-mapped file and runs only the novel
+# variants through the database.
+#
+#   python sitestore.py build --out known.sites
+#   python sitestore.py build --out known.sites --vcf sites.vcf.gz
+#   python sitestore.py info known.sites
+#
+# Layout: magic, header length (uint32), JSON header (stages, chromosome
+# names, site count, reference label), then a sorted index of fixed-size
+# entries (chromosome number, POS, data offset, data length) and the data,
+# one zlib-compressed JSON entry [REF, ALT, fragments] per site. Sites are
+# found by binary search of the index on (chromosome, POS).
+#
+# Fragments are built for records that have INFO items; records with an
+# empty INFO are annotated by the stages (dbSNP writes those differently).
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+import sys
+import gzip
+import json
+import mmap
+import time
+import zlib
+import struct
+import argparse
+
+import annotate as ann
+import dedup as dd
+import utils as u
+import variant as v
+
+MAGIC = b'ANNSITE1'
+ENTRY = struct.Struct('<HIQI')
+LENGTH = struct.Struct('<I')
+
+# Sites annotated per batch during a build
+BUILD_BATCH = 10000
+
+
+"""Chromosome name as stored: without the "chr" prefix
+"""
+def store_chrom(chrom):
+    chrom = chrom.strip()
+    if chrom.startswith('chr'):
+        chrom = chrom[3:]
+    return chrom
+
+
+"""Read-only view of a store file
+   get() returns the fragments of a site, {stage name: (items, id,
+   counts)} as dedup.SiteCache keeps them, or None for unknown sites.
+"""
+class SiteStore(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.fh = open(filename, 'rb')
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if (self.mm[:len(MAGIC)] != MAGIC):
+            self.close()
+            raise ValueError(f"Not a site store: {filename}")
+        size = LENGTH.unpack_from(self.mm, len(MAGIC))[0]
+        start = len(MAGIC) + LENGTH.size
+        self.header = json.loads(self.mm[start:start + size].decode('utf-8'))
+        self.stages = self.header['stages']
+        self.count = self.header['count']
+        self.chroms = dict([(chrom, i) for i, chrom in
+            enumerate(self.header['chroms'])])
+        self.index = start + size
+        self.data = self.index + self.count * ENTRY.size
+
+    def entry(self, i):
+        return ENTRY.unpack_from(self.mm, self.index + i * ENTRY.size)
+
+    """Index of the first entry at or after (chrom number, pos)
+    """
+    def lower_bound(self, chrom, pos):
+        lo = 0
+        hi = self.count
+        while (lo < hi):
+            mid = (lo + hi) // 2
+            entry = self.entry(mid)
+            if ((entry[0], entry[1]) < (chrom, pos)):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def get(self, chrom, pos, ref, alt):
+        number = self.chroms.get(store_chrom(chrom))
+        if number is None:
+            return None
+        i = self.lower_bound(number, pos)
+        while (i < self.count):
+            entry = self.entry(i)
+            if (entry[0] != number or entry[1] != pos):
+                return None
+            start = self.data + entry[2]
+            site = json.loads(zlib.decompress(self.mm[start:start +
+                entry[3]]).decode('utf-8'))
+            if (site[0] == ref and site[1] == alt):
+                return dict([(name, ([tuple(item) for item in items], id,
+                    counts)) for name, (items, id, counts) in site[2].items()])
+            i = i + 1
+        return None
+
+    def close(self):
+        self.mm.close()
+        self.fh.close()
+
+
+"""Opens a store, or returns None if filename is empty or not readable
+"""
+def open_store(filename):
+    if not filename:
+        return None
+    try:
+        store = SiteStore(filename)
+    except (OSError, ValueError) as e:
+        print(f"Not using site store {filename}: {e}")
+        return None
+    print(f"Site store {filename}: {store.count} sites, " +
+        f"reference {store.header.get('reference') or 'unlabelled'}")
+    return store
+
+
+"""Known sites of the dbSNP table as (chrom, pos, ref, alt), sorted
+"""
+def db_sites(cursor):
+    cursor.execute('select CHR, POS, REF, ALT from dbSNP order by CHR, POS;')
+    rows = cursor.fetchmany(BUILD_BATCH)
+    while (len(rows) > 0):
+        for chrom, pos, ref, alt in rows:
+            yield (str(chrom), int(pos), str(ref), str(alt))
+        rows = cursor.fetchmany(BUILD_BATCH)
+
+
+"""Sites of a VCF (plain or gzipped), which must be sorted by position
+   within contiguous chromosomes
+"""
+def vcf_sites(filename):
+    fh = gzip.open(filename, 'rt') if filename.endswith('.gz') else \
+        open(filename)
+    for line in fh:
+        if line.startswith('#') or line.strip() == '':
+            continue
+        fields = line.split('\t', 5)
+        yield (fields[0], int(fields[1]), fields[3], fields[4])
+    fh.close()
+
+
+"""Fragments of every stage for a batch of sites (records with INFO)
+"""
+def annotate_sites(sites, stages, cursor):
+    records = [v.parse_record((f"{chrom}\t{pos}\t.\t{ref}\t{alt}\t.\t.\t" +
+        "SITE\n").encode('utf-8')) for chrom, pos, ref, alt in sites]
+    cache = dd.SiteCache(len(records) + 1)
+    keys = []
+    for rec in records:
+        keys.append(dd.site_key(rec))
+        cache.seen(keys[-1])
+    for stage in stages:
+        for rec, key in zip(records, keys):
+            cache.annotate(stage, cursor, rec, key)
+    return [cache.sites[key] for key in keys]
+
+
+"""Builds a store of sites (an iterable of (chrom, pos, ref, alt) sorted
+   by position within contiguous chromosomes) into filename
+   stages are fresh stages (driver.build_stages()). Duplicate sites are
+   stored once. Returns the number of sites.
+"""
+def build(filename, sites, cursor, stages, reference=''):
+    chroms = []
+    count = 0
+    index = open(filename + '.index', 'wb')
+    data = open(filename + '.data', 'wb')
+    offset = 0
+    last = None
+
+    def flush(batch):
+        nonlocal offset
+        for site, fragments in zip(batch, annotate_sites(batch, stages,
+            cursor)):
+            blob = zlib.compress(json.dumps([site[2], site[3], fragments],
+                separators=(',', ':')).encode('utf-8'))
+            index.write(ENTRY.pack(chroms.index(store_chrom(site[0])),
+                site[1], offset, len(blob)))
+            data.write(blob)
+            offset = offset + len(blob)
+
+    batch = []
+    for site in sites:
+        chrom = store_chrom(site[0])
+        key = (chrom, site[1], site[2], site[3])
+        if (key == last):
+            continue
+        if (last is None or chrom != last[0]):
+            if chrom in chroms:
+                raise ValueError(f"Sites of chromosome {chrom} are not " +
+                    "contiguous")
+            chroms.append(chrom)
+        elif (site[1] < last[1]):
+            raise ValueError(f"Sites are not sorted at {chrom}:{site[1]}")
+        last = key
+        batch.append(site)
+        count = count + 1
+        if (len(batch) >= BUILD_BATCH):
+            flush(batch)
+            batch = []
+    flush(batch)
+    index.close()
+    data.close()
+
+    header = json.dumps({
+        'stages': [stage.name for stage in stages
+            if not isinstance(stage, ann.FilterStage)],
+        'chroms': chroms,
+        'count': count,
+        'reference': reference,
+        'created': int(time.time()),
+    }).encode('utf-8')
+    tmp = filename + '.tmp'
+    fh = open(tmp, 'wb')
+    fh.write(MAGIC + LENGTH.pack(len(header)) + header)
+    for part in (filename + '.index', filename + '.data'):
+        fh_part = open(part, 'rb')
+        while True:
+            block = fh_part.read(1024 * 1024)
+            if not block:
+                break
+            fh.write(block)
+        fh_part.close()
+        os.remove(part)
+    fh.close()
+    os.replace(tmp, filename)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Precomputed annotations of known variant sites')
+    parser.add_argument('command', choices=['build', 'info'])
+    parser.add_argument('store', nargs='?', help='store file (info)')
+    parser.add_argument('--out', help='store file to build')
+    parser.add_argument('--vcf', help='sites to build from (default: dbSNP)')
+    parser.add_argument('--stages', help='comma separated stage names')
+    parser.add_argument('--reference', default='',
+        help='label of the reference release, kept in the header')
+    args = parser.parse_args(argv)
+
+    if (args.command == 'info'):
+        store = SiteStore(args.store or args.out)
+        print(json.dumps(store.header, indent=2))
+        store.close()
+        return 0
+
+    if not args.out:
+        parser.error('build needs --out')
+    import driver
+    stages = driver.build_stages(args.stages.split(',') if args.stages
+        else None)
+    conn = u.db_connect()
+    sites = vcf_sites(args.vcf) if args.vcf else db_sites(conn.cursor())
+    start = time.time()
+    count = build(args.out, sites, conn.cursor(), stages, args.reference)
+    conn.close()
+    print(f"{count} sites written to {args.out} " +
+        f"({os.path.getsize(args.out)} bytes, {time.time() - start:.1f} s)")
+    u.print_query_summary()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+### EOF
@@ -0,0 +1,114 @@
+# test_sidecar.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Paging of the SQLite query index (sidecar.query_variants): run with
+#   python -m unittest test_sidecar   (or pytest) from the ann directory
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import sidecar
+
+# Variants of the small index; the large one has LARGE_FACTOR times more
+SMALL_RECORDS = 2000
+LARGE_FACTOR = 10
+
+PAGE_SIZE = 50
+MAX_GMAF = 0.05
+
+# VM instructions between two calls of the progress handler
+STEP = 100
+
+
+"""Writes an annotated VCF of records variants, one in ten with a GMAF
+   (below MAX_GMAF for half of those), and returns its path
+"""
+def make_vcf(workdir, records):
+    vcf = os.path.join(workdir, f"test{records}.annot.vcf")
+    fh = open(vcf, 'w')
+    fh.write('##fileformat=VCFv4.1\n')
+    fh.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+    for i in range(records):
+        info = f"name2=GENE{i % 7};positionType=exonic"
+        if (i % 10 == 0):
+            info = f"GMAF={0.01 if i % 20 == 0 else 0.2};" + info
+        fh.write(f"chr1\t{1000 + i}\t.\tA\tG\t50\tPASS\t{info}\n")
+    fh.close()
+    return vcf
+
+
+class QueryVariantsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        cls.small = sidecar.write_sqlite(make_vcf(cls.workdir, SMALL_RECORDS))
+        cls.large = sidecar.write_sqlite(make_vcf(cls.workdir,
+            SMALL_RECORDS * LARGE_FACTOR))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir)
+
+    """VM instructions (to STEP) of the page of a max_gmaf query after
+       variant after
+    """
+    def page_steps(self, db_path, after):
+        sql, args = sidecar.variants_query(max_gmaf=MAX_GMAF, after=after,
+            limit=PAGE_SIZE)
+        conn = sqlite3.connect(db_path)
+        steps = [0]
+        conn.set_progress_handler(lambda: steps.__setitem__(0, steps[0] + 1),
+            STEP)
+        rows = conn.execute(sql, args).fetchall()
+        conn.close()
+        self.assertEqual(len(rows), PAGE_SIZE + 1)
+        return steps[0] * STEP
+
+    def test_max_gmaf_plan_walks_ids(self):
+        sql, args = sidecar.variants_query(max_gmaf=MAX_GMAF,
+            limit=PAGE_SIZE)
+        conn = sqlite3.connect(self.large)
+        plan = ' '.join([row[-1] for row in
+            conn.execute('EXPLAIN QUERY PLAN ' + sql, args)])
+        conn.close()
+        self.assertIn('INTEGER PRIMARY KEY', plan)
+        self.assertNotIn('SUBQUERY', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_max_gmaf_page_cost_does_not_grow_with_index(self):
+        small = self.page_steps(self.small, SMALL_RECORDS // 2)
+        large = self.page_steps(self.large,
+            SMALL_RECORDS * LARGE_FACTOR // 2)
+        self.assertLess(large, 2 * small + STEP)
+
+    def test_max_gmaf_pages(self):
+        conn = sqlite3.connect(self.small)
+        expected = [row[0] for row in conn.execute('SELECT id FROM ' +
+            'variants WHERE gmaf IS NULL OR gmaf < ? ORDER BY id',
+            (MAX_GMAF,))]
+        conn.close()
+
+        found = []
+        after = 0
+        pages = 0
+        while after is not None:
+            variants, after = sidecar.query_variants(self.small,
+                max_gmaf=MAX_GMAF, after=after, limit=PAGE_SIZE)
+            found.extend([variant['id'] for variant in variants])
+            pages = pages + 1
+        self.assertGreater(pages, 2)
+        self.assertEqual(found, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+### EOF
@@ -12,14 +12,237 @@ __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 
 
 import os
+import re
 import json
+import time
+import bisect
+import sqlite3
+import threading
+import configparser
 import pymysql
 import boto3
 from botocore.exceptions import ClientError
 
+# Query instrumentation settings, [db] section of ann_config.ini
+config = configparser.ConfigParser()
+config.read(os.path.join(os.path.abspath(os.path.dirname(__file__)),
+    'ann_config.ini'))
+SLOW_QUERY_SECS = config.getfloat('db', 'SlowQueryMs', fallback=200.0) / 1000
+EXPLAIN_QUERIES = config.getboolean('db', 'ExplainQueries', fallback=True)
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket
+# collects everything slower
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+_LITERALS = re.compile(r'"[^"]*"|\'[^\']*\'|\b\d+(?:\.\d+)?\b')
+_SPACES = re.compile(r'\s+')
+
+
+"""SQL template of a query: literals replaced with ? and whitespace collapsed
+"""
+def query_template(query):
+    return _SPACES.sub(' ', _LITERALS.sub('?', query)).strip()
+
+
+"""Per-template statistics of the queries executed in this process
+"""
+class QueryStats(object):
+    def __init__(self, template):
+        self.template = template
+        self.count = 0
+        self.total_secs = 0.0
+        self.max_secs = 0.0
+        self.slow = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.explain = None
+
+    def add(self, secs):
+        self.count = self.count + 1
+        self.total_secs = self.total_secs + secs
+        self.max_secs = max(self.max_secs, secs)
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, secs * 1000)] += 1
+
+    def to_dict(self):
+        return {
+            'template': self.template,
+            'count': self.count,
+            'total_secs': round(self.total_secs, 6),
+            'mean_ms': round(self.total_secs * 1000 / max(self.count, 1), 3),
+            'max_ms': round(self.max_secs * 1000, 3),
+            'slow': self.slow,
+            'histogram_ms': dict(zip([str(b) for b in LATENCY_BUCKETS_MS] +
+                ['inf'], self.histogram)),
+            'explain': self.explain,
+        }
+
+
+"""Cursor wrapper that records per-template counts and latencies, logs
+   queries slower than SLOW_QUERY_SECS and captures the EXPLAIN output of
+   every template the first time it is seen
+   The statistics are shared by all cursors of the process; lock guards
+   them for cursors used by the threads of a lookup pool (pool.py).
+"""
+class InstrumentedCursor(object):
+    queries = 0
+    stats = {}
+    lock = threading.Lock()
+
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+        self.dialect = connection.dialect
+
+    def execute(self, query, args=None):
+        template = query_template(query)
+        with InstrumentedCursor.lock:
+            stats = InstrumentedCursor.stats.get(template)
+            if stats is None:
+                stats = QueryStats(template)
+                InstrumentedCursor.stats[template] = stats
+                if EXPLAIN_QUERIES:
+                    stats.explain = self._connection.explain(query, args)
+            InstrumentedCursor.queries = InstrumentedCursor.queries + 1
+
+        start = time.perf_counter()
+        if args is None:
+            result = self._cursor.execute(query)
+        else:
+            result = self._cursor.execute(query, args)
+        secs = time.perf_counter() - start
+
+        with InstrumentedCursor.lock:
+            stats.add(secs)
+            if (secs > SLOW_QUERY_SECS):
+                stats.slow = stats.slow + 1
+        if (secs > SLOW_QUERY_SECS):
+            print(f"Slow query ({secs * 1000:.1f} ms): {query.strip()}")
+        return result
+
+    """One statement run for every parameter tuple of rows (one round trip
+       on MySQL); recorded as a single query
+    """
+    def executemany(self, query, rows):
+        template = query_template(query)
+        with InstrumentedCursor.lock:
+            stats = InstrumentedCursor.stats.get(template)
+            if stats is None:
+                stats = QueryStats(template)
+                InstrumentedCursor.stats[template] = stats
+            InstrumentedCursor.queries = InstrumentedCursor.queries + 1
+
+        start = time.perf_counter()
+        result = self._cursor.executemany(query, rows)
+        with InstrumentedCursor.lock:
+            stats.add(time.perf_counter() - start)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+"""Connection wrapper handing out instrumented cursors
+   explain_prefix is how the database asks for a query plan; dialect is
+   "mysql" or "sqlite"
+"""
+class InstrumentedConnection(object):
+    def __init__(self, conn, explain_prefix='EXPLAIN ', dialect='mysql'):
+        self._conn = conn
+        self.explain_prefix = explain_prefix
+        self.dialect = dialect
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs), self)
+
+    """Query plan rows as strings, or None if the database refuses
+    """
+    def explain(self, query, args=None):
+        cursor = self._conn.cursor()
+        try:
+            if args is None:
+                cursor.execute(self.explain_prefix + query)
+            else:
+                cursor.execute(self.explain_prefix + query, args)
+            return ['\t'.join([str(x) for x in row]) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Unable to EXPLAIN query: {e}")
+            return None
+        finally:
+            cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+"""Number of queries executed through db_connect() in this process
+"""
+def query_count():
+    return InstrumentedCursor.queries
+
+
+"""Statistics of every query template, most expensive first
+"""
+def query_stats():
+    stats = sorted(InstrumentedCursor.stats.values(),
+        key=lambda s: s.total_secs, reverse=True)
+    return [s.to_dict() for s in stats]
+
+
+"""Forgets the statistics of earlier queries (new worker or job)
+"""
+def reset_query_stats():
+    InstrumentedCursor.queries = 0
+    InstrumentedCursor.stats = {}
+
+
+"""Adds query statistics from another process (query_stats() output)
+"""
+def merge_query_stats(stats):
+    for s in stats:
+        total = InstrumentedCursor.stats.get(s['template'])
+        if total is None:
+            total = QueryStats(s['template'])
+            InstrumentedCursor.stats[s['template']] = total
+        total.count = total.count + s['count']
+        total.total_secs = total.total_secs + s['total_secs']
+        total.max_secs = max(total.max_secs, s['max_ms'] / 1000)
+        total.slow = total.slow + s['slow']
+        total.histogram = [a + b for a, b in
+            zip(total.histogram, s['histogram_ms'].values())]
+        if total.explain is None:
+            total.explain = s['explain']
+        InstrumentedCursor.queries = InstrumentedCursor.queries + s['count']
+
+
+"""Prints the per-template query summary table
+"""
+def print_query_summary():
+    stats = query_stats()
+    if (len(stats) == 0):
+        return
+    print("Query summary (most expensive first):")
+    print(f"{'count':>9} {'total s':>9} {'mean ms':>9} {'max ms':>9} " +
+        f"{'slow':>6}  template")
+    for s in stats:
+        print(f"{s['count']:>9} {s['total_secs']:>9.2f} {s['mean_ms']:>9.2f} " +
+            f"{s['max_ms']:>9.2f} {s['slow']:>6}  {s['template'][:100]}")
+
+
 """Get connection to reference database
+   If sqlite_db (or, when it is None, ANNOTATOR_SQLITE_DB) is set, a local
+   SQLite copy of the reference tables is used instead (offline
+   benchmarks, see benchmark.py); it may be used by the threads of a
+   lookup pool, one at a time. database or ANNOTATOR_DATABASE names the
+   MySQL database of a reference snapshot (see reference.py), "annotator"
+   by default.
 """
-def db_connect():
+def db_connect(database=None, sqlite_db=None):
+    if sqlite_db is None:
+        sqlite_db = os.environ.get('ANNOTATOR_SQLITE_DB')
+    if sqlite_db:
+        return InstrumentedConnection(
+            sqlite3.connect(sqlite_db, check_same_thread=False),
+            explain_prefix='EXPLAIN QUERY PLAN ', dialect='sqlite')
+
     AWS_REGION_NAME = os.environ['AWS_REGION_NAME'] if \
         ('AWS_REGION_NAME' in  os.environ) else "us-east-1"
 
@@ -37,15 +260,16 @@ def db_connect():
     mysql_port = rds_secret['port']
     username = rds_secret['username']
     password = rds_secret['password']
-    database_name = 'annotator'
+    database_name = database or os.environ.get('ANNOTATOR_DATABASE') or \
+        'annotator'
 
     # Return a connection to the database
-    return pymysql.connect(
+    return InstrumentedConnection(pymysql.connect(
         host=rds_host,
         port=mysql_port,
         user=username,
         passwd=password,
-        db=database_name)
+        db=database_name))
 
 
 """Column inices for pileup and VCF
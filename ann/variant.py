@@ -0,0 +1,212 @@
+# variant.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Parse-once model of a VCF data line shared by all annotation stages
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+
+"""Splits an INFO string into an ordered list of (key, value) items
+   Flags get the value None; '.' and empty items are dropped
+"""
+def parse_info(info):
+    items = []
+    if (info == '.' or info == ''):
+        return items
+    for item in info.split(';'):
+        if (item == '' or item == '.'):
+            continue
+        key, sep, value = item.partition('=')
+        items.append((key, value if sep else None))
+    return items
+
+
+"""INFO string of a list of (key, value) items; '.' when empty
+"""
+def format_info(items):
+    if (len(items) == 0):
+        return '.'
+    return ';'.join([k if v is None else k + '=' + v for k, v in items])
+
+
+# Bytes read per readinto() call; a chunk of records never outlives the
+# buffer it was parsed from
+BUFFER_SIZE = 4 * 1024 * 1024
+
+NEWLINE = ord('\n')
+
+
+"""One VCF data line, parsed from a byte buffer without copying it
+
+   Only CHROM, POS, REF, ALT and INFO are decoded; INFO becomes an ordered
+   multimap of (key, value) items that stages read and append to. The other
+   columns stay memoryview slices of the input buffer and are written back
+   unchanged:
+     prefix - "CHROM<tab>POS<tab>"
+     id     - the ID column (a str once a stage sets it)
+     middle - "<tab>REF<tab>ALT<tab>QUAL<tab>FILTER<tab>"
+     tail   - "<tab>FORMAT<tab>samples...<newline>", or just the newline
+   Genotype columns are never split, so a cohort VCF with thousands of
+   samples costs about the same per record as a single-sample one.
+"""
+class VariantRecord(object):
+    __slots__ = ('chrom', 'pos', 'id', 'ref', 'alt', 'info', 'prefix',
+        'middle', 'tail')
+
+    def __init__(self, chrom, pos, id, ref, alt, info, prefix, middle, tail):
+        self.chrom = chrom
+        self.pos = pos
+        self.id = id
+        self.ref = ref
+        self.alt = alt
+        self.info = info
+        self.prefix = prefix
+        self.middle = middle
+        self.tail = tail
+
+    """Chromosome without the "chr" prefix, as in dbSNP and gadAll
+    """
+    def bare_chrom(self):
+        chrom = self.chrom.strip()
+        if chrom.startswith('chr'):
+            chrom = chrom.replace('chr', '')
+        return chrom
+
+    """Chromosome with the "chr" prefix, as in the UCSC tables
+    """
+    def ucsc_chrom(self):
+        chrom = self.chrom.strip()
+        if not chrom.startswith('chr'):
+            chrom = 'chr' + chrom
+        return chrom
+
+    """First value of an INFO key, or default if the key is absent
+    """
+    def get(self, key, default=None):
+        for k, v in self.info:
+            if (k == key):
+                return v
+        return default
+
+    def add(self, key, value=None):
+        self.info.append((key, value))
+
+    def extend(self, items):
+        self.info.extend(items)
+
+    """Appends the items of an INFO fragment such as "a=1;b=2"
+    """
+    def add_fragment(self, fragment):
+        self.info.extend(parse_info(fragment))
+
+    """Pieces of the output line; the unchanged columns are the input slices
+    """
+    def pieces(self):
+        id = self.id.encode('utf-8') if isinstance(self.id, str) else self.id
+        return [self.prefix, id, self.middle,
+            format_info(self.info).encode('utf-8'), self.tail]
+
+    """The record as a VCF line (bytes, newline terminated)
+    """
+    def to_bytes(self):
+        return b''.join(self.pieces())
+
+
+"""Parses the VCF data line buf[start:end], newline included
+   buf is bytes, a bytearray or an mmap; mv, a memoryview of buf, is created if not
+   given. The record keeps slices of buf, so buf must not be overwritten
+   while the record is in use.
+"""
+def parse_record(buf, start=0, end=None, mv=None):
+    if end is None:
+        end = len(buf)
+    if mv is None:
+        mv = memoryview(buf)
+
+    tabs = []
+    i = start
+    while (len(tabs) < 8):
+        i = buf.find(b'\t', i, end)
+        if (i < 0):
+            break
+        tabs.append(i)
+        i = i + 1
+
+    line_end = end
+    if (buf[line_end - 1] == NEWLINE):
+        line_end = line_end - 1
+        if (line_end > start and buf[line_end - 1] == ord('\r')):
+            line_end = line_end - 1
+    info_end = tabs[7] if len(tabs) > 7 else line_end
+    tail = mv[info_end:end]
+    if (line_end == end):
+        # Last line of a file without a final newline
+        tail = bytes(tail) + b'\n'
+
+    return VariantRecord(
+        str(mv[start:tabs[0]], 'utf-8'),
+        int(str(mv[tabs[0] + 1:tabs[1]], 'ascii')),
+        mv[tabs[1] + 1:tabs[2]],
+        str(mv[tabs[2] + 1:tabs[3]], 'utf-8'),
+        str(mv[tabs[3] + 1:tabs[4]], 'utf-8'),
+        parse_info(str(mv[tabs[6] + 1:info_end], 'utf-8')),
+        mv[start:tabs[1] + 1],
+        mv[tabs[2]:tabs[6] + 1],
+        tail)
+
+
+"""Reads a VCF in binary mode with readinto() into one reusable buffer
+
+   Yields (buf, mv, lines) for every fill of the buffer, where lines are
+   the (start, end) offsets of the complete lines in buf, newline included.
+   The buffer is reused for the next fill, so everything parsed from one
+   chunk must be written before asking for the next. A line longer than
+   the buffer doubles it; a last line without a newline gets one.
+"""
+def read_chunks(fh, buffer_size=BUFFER_SIZE):
+    buf = bytearray(buffer_size)
+    mv = memoryview(buf)
+    kept = 0
+
+    while True:
+        n = fh.readinto(mv[kept:])
+        filled = kept + n
+        if (n == 0):
+            if (kept == 0):
+                return
+            if (buf[filled - 1] != NEWLINE):
+                if (filled == len(buf)):
+                    buf, mv = _grow(buf, mv, filled)
+                buf[filled] = NEWLINE
+                filled = filled + 1
+
+        last = buf.rfind(b'\n', 0, filled)
+        if (last < 0):
+            buf, mv = _grow(buf, mv, filled)
+            kept = filled
+            continue
+
+        lines = []
+        i = 0
+        while (i <= last):
+            j = buf.find(b'\n', i, last + 1) + 1
+            lines.append((i, j))
+            i = j
+        yield buf, mv, lines
+
+        kept = filled - (last + 1)
+        if (kept > 0):
+            buf[0:kept] = buf[last + 1:filled]
+        if (n == 0):
+            return
+
+
+def _grow(buf, mv, filled):
+    bigger = bytearray(len(buf) * 2)
+    bigger[0:filled] = buf[0:filled]
+    return bigger, memoryview(bigger)
+
+### EOF
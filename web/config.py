@@ -108,6 +108,46 @@ class Config(object):
     # Time before free user results are archived (in seconds)
     FREE_USER_DATA_RETENTION = 300
 
+    # Region viewer: rows per page and maximum compressed blocks read per page
+    GAS_REGION_PAGE_SIZE = 50
+    GAS_REGION_MAX_BLOCKS = 16
+
+    # Annotator modules shared with the web app (region index reader,
+    # chromosome names, query index, filter parser); ann.zip is unpacked
+    # next to web
+    GAS_ANN_PATH = os.path.abspath(os.path.join(basedir, os.pardir, 'ann'))
+
+    # Query API: local cache of per-job SQLite indexes and page sizes; the
+    # least recently used indexes are removed when the cache is over
+    # GAS_QUERY_CACHE_MAX_MB (an index used in the last
+    # GAS_QUERY_CACHE_MIN_AGE seconds is kept, it may be open)
+    GAS_QUERY_CACHE_DIR = basedir + "/query_cache"
+    GAS_QUERY_CACHE_MAX_MB = 2048
+    GAS_QUERY_CACHE_MIN_AGE = 60
+    GAS_QUERY_PAGE_SIZE = 100
+    GAS_QUERY_MAX_PAGE_SIZE = 1000
+
+    # Annotation stages offered on the /annotate form, in pipeline order:
+    # (stage name used by the annotator, label)
+    GAS_ANNOTATION_STAGES = [
+        ('dbSNP', 'dbSNP identifiers and allele frequencies'),
+        ('BigRefGene', 'RefSeq transcript effects'),
+        ('refGene', 'Gene structure (exon, intron, promoter)'),
+        ('cytoBand', 'Cytogenetic bands'),
+        ('gadAll', 'Genetic Association Database diseases'),
+        ('gwasCatalog', 'GWAS Catalog traits'),
+        ('miRNA', 'TargetScan miRNA sites'),
+        ('HUGO Gene Nomenclature Committee', 'HGNC gene names'),
+        ('dgv_Cnv', 'DGV copy number variants'),
+        ('abParts_IG_T_CelReceptors', 'Immunoglobulin and T cell receptor regions'),
+        ('mcCarroll_Cnv', 'McCarroll copy number variants'),
+        ('conrad_Cnv', 'Conrad copy number variants'),
+        ('genomicSuperDups', 'Segmental duplications'),
+        ('tfbsConsSites', 'Conserved transcription factor binding sites'),
+    ]
+    # Largest gene panel a job can be restricted to
+    GAS_MAX_PANEL_GENES = 5000
+
 
 class DevelopmentConfig(Config):
     DEBUG = True
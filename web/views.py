@@ -8,9 +8,13 @@
 ##
 __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 
+import os
+import re
+import sys
 import uuid
 import time
 import json
+import zlib
 from datetime import datetime
 
 import boto3
@@ -26,6 +30,12 @@ from gas import app, db
 from decorators import authenticated, is_premium
 from auth import get_profile, update_profile
 
+sys.path.append(app.config['GAS_ANN_PATH'])
+from region_index import BlockIndex  # noqa: E402
+from regions import normalize_chrom  # noqa: E402
+import filters as flt  # noqa: E402
+from sidecar import query_variants  # noqa: E402
+
 
 '''
 helper functions for router
@@ -180,6 +190,165 @@ def read_s3_file(bucket_name, object_name):
     return content
 
 
+def read_s3_range(bucket_name, object_name, start, end):
+    # https://docs.aws.amazon.com/AmazonS3/latest/API/API_GetObject.html
+    my_config = s3_config()
+    try:
+        s3 = boto3.client('s3', config=my_config)
+        response = s3.get_object(Bucket=bucket_name, Key=object_name,
+                                 Range='bytes={}-{}'.format(start, end))
+        content = response['Body'].read()
+    except ClientError as e:
+        print("Fail to read byte range of file in s3!")
+        logging.error(e)
+        return None
+    return content
+
+
+def gunzip_members(data):
+    # decompress a run of concatenated gzip members
+    lines = []
+    while data:
+        d = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        lines.append(d.decompress(data))
+        data = d.unused_data
+    return b''.join(lines).decode('utf-8')
+
+
+def region_rows(bucket_name, object_name, index, chrom, start, end,
+                first_block=None, skip=0):
+    """Read the rows of chrom:start-end from the block-compressed results
+
+    index is the BlockIndex of the results file. Only blocks whose
+    coordinates overlap the region are fetched, starting at index entry
+    first_block (found by binary search when None) and skipping the first
+    skip matching rows of that block. At most GAS_REGION_MAX_BLOCKS blocks
+    are read per call and blocks adjacent in the file are coalesced into a
+    single range request.
+
+    Returns (rows, next_cursor) where next_cursor is a (block, skip) tuple
+    or None when the region is exhausted, or (None, None) on S3 errors.
+    """
+    page_size = app.config['GAS_REGION_PAGE_SIZE']
+    max_blocks = app.config['GAS_REGION_MAX_BLOCKS']
+
+    selected = []
+    try:
+        for i, block in index.overlapping(chrom, start, end,
+                                          first=first_block):
+            selected.append((i, block))
+            if len(selected) == max_blocks + 1:
+                break
+    except OSError as e:
+        logging.error(e)
+        return None, None
+    more_blocks = len(selected) > max_blocks
+    selected = selected[:max_blocks]
+
+    # coalesce blocks that follow each other in the file into byte ranges
+    ranges = []
+    for i, block in selected:
+        if ranges and ranges[-1][-1][1]['offset'] + \
+                ranges[-1][-1][1]['length'] == block['offset']:
+            ranges[-1].append((i, block))
+        else:
+            ranges.append([(i, block)])
+
+    rows = []
+    for run in ranges:
+        first = run[0][1]
+        last = run[-1][1]
+        data = read_s3_range(bucket_name, object_name, first['offset'],
+                             last['offset'] + last['length'] - 1)
+        if data is None:
+            return None, None
+        for i, block in run:
+            offset = block['offset'] - first['offset']
+            text = gunzip_members(data[offset:offset + block['length']])
+            matched = 0
+            for line in text.splitlines():
+                fields = line.split('\t', 8)
+                if not start <= int(fields[1]) <= end:
+                    continue
+                matched += 1
+                if i == first_block and matched <= skip:
+                    continue
+                if len(rows) == page_size:
+                    return rows, (i, matched - 1)
+                rows.append(fields[:8])
+
+    if more_blocks:
+        return rows, (selected[-1][0] + 1, 0)
+    return rows, None
+
+
+def query_index_path(job_detail):
+    """Local copy of the job's SQLite query index, downloaded on first use
+    """
+    cache_dir = app.config['GAS_QUERY_CACHE_DIR']
+    db_path = os.path.join(cache_dir, job_detail['job_id'] + '.annot.db')
+    if os.path.exists(db_path):
+        # the modification time orders the cache by last use
+        try:
+            os.utime(db_path)
+            return db_path
+        except OSError:
+            pass  # evicted meanwhile, download it again
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # download under a temporary name so readers never see a partial file
+    tmp_path = db_path + '.' + str(uuid.uuid4())
+    my_config = s3_config()
+    try:
+        s3 = boto3.client('s3', config=my_config)
+        s3.download_file(job_detail['s3_results_bucket'],
+                         job_detail['s3_key_query_index'], tmp_path)
+    except ClientError as e:
+        print("Fail to download the query index from s3!")
+        logging.error(e)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    os.replace(tmp_path, db_path)
+    prune_query_cache(cache_dir)
+    return db_path
+
+
+def prune_query_cache(cache_dir):
+    """Remove the least recently used query indexes over the size cap
+
+    Files are removed oldest first until the cache fits in
+    GAS_QUERY_CACHE_MAX_MB, skipping those used in the last
+    GAS_QUERY_CACHE_MIN_AGE seconds. Partial downloads left behind by a
+    failed worker are counted and removed the same way.
+    """
+    max_bytes = app.config['GAS_QUERY_CACHE_MAX_MB'] * 1024 * 1024
+    min_age = app.config['GAS_QUERY_CACHE_MIN_AGE']
+
+    files = []
+    for name in os.listdir(cache_dir):
+        if '.annot.db' not in name:
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            info = os.stat(path)
+        except OSError:
+            continue
+        files.append((info.st_mtime, info.st_size, path))
+
+    total = sum(size for mtime, size, path in files)
+    now = time.time()
+    for mtime, size, path in sorted(files):
+        if total <= max_bytes or now - mtime < min_age:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
 def upgrade_to_premium(table_name, items):
     my_config = s3_config()
     for item in items:
@@ -287,7 +456,66 @@ def annotate():
         return abort(500)
 
     # Render the upload form which will parse/submit the presigned POST
-    return render_template('annotate.html', s3_post=presigned_post)
+    return render_template('annotate.html', s3_post=presigned_post,
+                           stages=app.config['GAS_ANNOTATION_STAGES'],
+                           selected=session.get('stages'),
+                           genes=session.get('genes'),
+                           region_passthrough=session.get('region_passthrough'),
+                           filters=session.get('filters'))
+
+
+def valid_filter(text):
+    # the annotator's own parser decides, so the form cannot accept what a
+    # job would reject
+    try:
+        flt.parse(text)
+    except ValueError:
+        return False
+    return True
+
+
+"""Stores the annotation stages, gene panel and filters chosen on the
+/annotate form
+The upload itself goes straight to S3, so the choice is kept in the
+session until the S3 redirect reaches /annotate/job.
+"""
+
+
+@app.route('/annotate/options', methods=['POST'])
+@authenticated
+def annotate_options():
+    options = request.get_json(silent=True) or {}
+    stages = options.get('stages')
+    known = [name for name, label in app.config['GAS_ANNOTATION_STAGES']]
+    if not isinstance(stages, list) or len(stages) == 0 or \
+            any(stage not in known for stage in stages):
+        return jsonify({'code': 400, 'status': 'error', 'message': 'select at least one known annotation stage'}), 400
+
+    # optional gene panel: records outside the genes are dropped, or passed
+    # through unannotated
+    genes = options.get('genes') or []
+    if isinstance(genes, str):
+        genes = genes.replace(',', ' ').split()
+    if not isinstance(genes, list) or len(genes) > app.config['GAS_MAX_PANEL_GENES'] or \
+            any(not re.match(r'^[A-Za-z0-9._-]+$', str(gene)) for gene in genes):
+        return jsonify({'code': 400, 'status': 'error', 'message': 'invalid gene list'}), 400
+
+    # optional filter expressions, one per line, e.g. GMAF<0.01
+    filters = options.get('filters') or []
+    if isinstance(filters, str):
+        filters = [f.strip() for f in filters.splitlines() if f.strip()]
+    if not isinstance(filters, list) or \
+            any(not valid_filter(str(f)) for f in filters):
+        return jsonify({'code': 400, 'status': 'error', 'message': 'invalid filter expression'}), 400
+
+    # all stages is the default and is not stored with the job
+    session['stages'] = None if len(set(stages)) == len(known) else \
+        [name for name in known if name in stages]
+    session['genes'] = genes or None
+    session['region_passthrough'] = bool(options.get('region_passthrough')) if genes else None
+    session['filters'] = filters or None
+    return jsonify({'code': 200, 'data': {'stages': session['stages'] or known,
+                                          'genes': genes, 'filters': filters}})
 
 
 """Fires off an annotation job
@@ -332,6 +560,12 @@ def create_annotation_job_request():
         "user_role": user_role,
         "email": user_email,
     }
+    # optional subset of annotation stages, gene panel and filters chosen on
+    # the /annotate form
+    for option in ('stages', 'genes', 'region_passthrough', 'filters'):
+        value = session.pop(option, None)
+        if value:
+            data[option] = value
     # Persist job to database
     # Move your code here...
     # check whether the dynamo database have the table or not
@@ -427,6 +661,131 @@ def annotation_details(id):
     return render_template('annotation_details.html', annotation=job_detail, free_access_expired=free_access_expired)
 
 
+"""Display the annotated variants of a job within a genomic region
+Reads only the blocks of the results file that overlap the region
+"""
+
+
+@app.route('/annotations/<id>/region', methods=['GET'])
+@authenticated
+def annotation_region(id):
+    job_detail = dynamo_query_job(
+        app.config['AWS_DYNAMODB_ANNOTATIONS_TABLE'], id)
+    if not job_detail:
+        print("Fail to retrieve the detail of this job!")
+        return abort(404)
+    job_detail = job_detail[0]
+
+    # check user authority
+    if session['primary_identity'] != job_detail['user_id']:
+        return abort(403)
+
+    if job_detail['job_status'] != 'COMPLETED' or \
+            's3_key_region_index' not in job_detail:
+        return abort(404)
+
+    # archived results of free users are only available after upgrading
+    if job_detail['user_role'] == 'free_user' and \
+            'results_file_archive_id' in job_detail:
+        return redirect(url_for('subscribe'))
+
+    chrom = normalize_chrom(request.args.get('chrom', ''))
+    try:
+        start = int(request.args.get('start', 1))
+        end = int(request.args.get('end', start))
+        block = request.args.get('block')
+        block = int(block) if block is not None else None
+        skip = int(request.args.get('skip', 0))
+    except ValueError:
+        return abort(400)
+    if not chrom or start > end or (block is not None and block < 0) or \
+            skip < 0:
+        return abort(400)
+
+    # the index is read by byte ranges: its summary, then the pages of
+    # entries the binary search and the scan of the region touch
+    bucket_name = job_detail['s3_results_bucket']
+    index_key = job_detail['s3_key_region_index']
+    try:
+        index = BlockIndex(lambda first, last: read_s3_range(
+            bucket_name, index_key, first, last))
+    except (OSError, ValueError) as e:
+        print("Fail to read the region index!")
+        logging.error(e)
+        return abort(500)
+
+    rows, next_cursor = region_rows(
+        bucket_name, job_detail['s3_key_region_file'], index, chrom, start,
+        end, first_block=block, skip=skip)
+    if rows is None:
+        return abort(500)
+
+    next_url = None
+    if next_cursor is not None:
+        next_url = url_for('annotation_region', id=id, chrom=chrom,
+                           start=start, end=end, block=next_cursor[0],
+                           skip=next_cursor[1])
+
+    return render_template('annotation_region.html', job_id=id, chrom=chrom,
+                           start=start, end=end, rows=rows, next_url=next_url)
+
+
+"""Query the annotated variants of a job
+Filters: gene, chrom/start/end, position_type (comma separated), max_gmaf;
+paging: limit and after (next_after of the previous page)
+"""
+
+
+@app.route('/annotations/<id>/query', methods=['GET'])
+@authenticated
+def annotation_query(id):
+    job_detail = dynamo_query_job(
+        app.config['AWS_DYNAMODB_ANNOTATIONS_TABLE'], id)
+    if not job_detail:
+        return jsonify({'code': 404, 'status': 'error', 'message': 'job not found'}), 404
+    job_detail = job_detail[0]
+
+    if session['primary_identity'] != job_detail['user_id']:
+        return jsonify({'code': 403, 'status': 'error', 'message': 'not authorized to query this job'}), 403
+    if job_detail['job_status'] != 'COMPLETED' or \
+            's3_key_query_index' not in job_detail:
+        return jsonify({'code': 404, 'status': 'error', 'message': 'no query index for this job'}), 404
+    if job_detail['user_role'] == 'free_user' and \
+            'results_file_archive_id' in job_detail:
+        return jsonify({'code': 403, 'status': 'error', 'message': 'upgrade to Premium to query archived results'}), 403
+
+    try:
+        start = request.args.get('start')
+        start = int(start) if start is not None else None
+        end = request.args.get('end')
+        end = int(end) if end is not None else None
+        max_gmaf = request.args.get('max_gmaf')
+        max_gmaf = float(max_gmaf) if max_gmaf is not None else None
+        after = int(request.args.get('after', 0))
+        limit = int(request.args.get('limit', app.config['GAS_QUERY_PAGE_SIZE']))
+    except ValueError:
+        return jsonify({'code': 400, 'status': 'error', 'message': 'invalid numeric parameter'}), 400
+    limit = max(1, min(limit, app.config['GAS_QUERY_MAX_PAGE_SIZE']))
+
+    chrom = request.args.get('chrom')
+    if chrom:
+        chrom = normalize_chrom(chrom)
+    position_types = [t.strip() for t in
+                      request.args.get('position_type', '').split(',') if t.strip()]
+
+    db_path = query_index_path(job_detail)
+    if db_path is None:
+        return jsonify({'code': 500, 'status': 'error', 'message': 'fail to load the query index'}), 500
+
+    variants, next_after = query_variants(
+        db_path, gene=request.args.get('gene'), chrom=chrom, start=start,
+        end=end, position_types=position_types, max_gmaf=max_gmaf,
+        after=after, limit=limit)
+
+    return jsonify({'code': 200, 'data': {'job_id': id, 'variants': variants,
+                                          'next_after': next_after}})
+
+
 """Display the log file contents for an annotation job
 """
 